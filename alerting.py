@@ -0,0 +1,366 @@
+"""
+alerting.py
+Background alerting stage: every time new KPI periods arrive, runs
+anomaly_detector.detect_anomalies on them and pushes the resulting alerts to sinks,
+without anyone having the Alertes tab open.
+
+  - incidents     a (site, KPI) alert stays one incident while the following periods
+                  keep alerting; repeats are dropped, escalations are sent again
+  - rate limit    token bucket per (site, KPI): `burst` alerts, refilled at `per_hour`
+  - sinks         FileSink (JSON lines), WebhookSink (POST, or a stub that keeps
+                  the payloads), SMTPSink (one digest per cycle, e.g. to a local
+                  debug server: python -m aiosmtpd -n -l localhost:1025)
+  - bounded cost  sites are processed in chunks of `chunk_sites`, each on a trailing
+                  window of `window` periods, so a cycle's memory does not grow with
+                  the number of sites or the length of the history
+"""
+import json
+import smtplib
+import threading
+import time
+import urllib.request
+from collections import deque
+from email.message import EmailMessage
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import anomaly_detector as ad
+import forecaster as fc
+import parallel
+from data_generator import SITE_COL, data_version, period_dates
+
+
+LEVEL_RANK = {"modéré": 1, "élevé": 2, "critique": 3}
+DEFAULT_WINDOW = {"D": 365, "W": 104, "M": 36, "Q": 12, "Y": 10}
+
+
+# ── Sinks ────────────────────────────────────────────────────────────────────
+class Sink:
+    """Receives the alerts of one cycle (a non-empty list of alert dicts)."""
+    name = "sink"
+
+    def send(self, alerts: List[Dict]) -> None:
+        raise NotImplementedError
+
+
+class FileSink(Sink):
+    """Appends one JSON object per alert to a file."""
+    name = "fichier"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, alerts: List[Dict]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for a in alerts:
+                f.write(json.dumps(a, ensure_ascii=False, default=str) + "\n")
+
+
+class WebhookSink(Sink):
+    """
+    POSTs {"alerts": [...]} as JSON to url. Without a url it is a stub: payloads
+    are kept in `sent` (last `keep` only), e.g. for tests or a dry run.
+    """
+    name = "webhook"
+
+    def __init__(self, url: Optional[str] = None, timeout: float = 5.0, keep: int = 100):
+        self.url, self.timeout = url, timeout
+        self.sent: deque = deque(maxlen=keep)
+
+    def send(self, alerts: List[Dict]) -> None:
+        body = json.dumps({"alerts": alerts}, ensure_ascii=False, default=str).encode()
+        if self.url is None:
+            self.sent.append(body)
+            return
+        req = urllib.request.Request(self.url, data=body, method="POST",
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout):
+            pass
+
+
+class SMTPSink(Sink):
+    """One e-mail digest per cycle (most severe alerts first, at most `max_lines` listed)."""
+    name = "smtp"
+
+    def __init__(self, recipients: Sequence[str], host: str = "localhost", port: int = 1025,
+                 sender: str = "alertes@smart-impact.local", max_lines: int = 200):
+        self.recipients, self.host, self.port = list(recipients), host, port
+        self.sender, self.max_lines = sender, max_lines
+
+    def send(self, alerts: List[Dict]) -> None:
+        n_crit = sum(a["level"] == "critique" for a in alerts)
+        msg = EmailMessage()
+        msg["Subject"] = f"[Smart Impact] {len(alerts)} alerte(s), dont {n_crit} critique(s)"
+        msg["From"], msg["To"] = self.sender, ", ".join(self.recipients)
+        lines = [f"[{a['level'].upper()}] {a['site']} · {a['period']} · {a['message']}"
+                 for a in sorted(alerts, key=lambda a: -LEVEL_RANK.get(a["level"], 0))]
+        if len(lines) > self.max_lines:
+            lines = lines[:self.max_lines] + [f"… et {len(lines) - self.max_lines} autre(s)"]
+        msg.set_content("\n".join(lines))
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(msg)
+
+
+# ── Rate limiting ────────────────────────────────────────────────────────────
+class TokenBuckets:
+    """One token bucket per key: `burst` tokens, refilled at per_hour tokens per hour."""
+
+    def __init__(self, burst: float = 3, per_hour: float = 1, clock: Callable[[], float] = time.time):
+        self.burst, self.rate, self.clock = float(burst), per_hour / 3600.0, clock
+        self._state: Dict[Tuple, Tuple[float, float]] = {}
+
+    def allow(self, key: Tuple) -> bool:
+        now = self.clock()
+        tokens, last = self._state.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        allowed = tokens >= 1
+        self._state[key] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+    def prune(self) -> None:
+        """Forget buckets that have refilled completely (memory ∝ recently alerting keys)."""
+        now = self.clock()
+        self._state = {k: (t, last) for k, (t, last) in self._state.items()
+                       if t + (now - last) * self.rate < self.burst}
+
+    def __len__(self) -> int:
+        return len(self._state)
+
+
+# ── Detection ────────────────────────────────────────────────────────────────
+def _site_if_labels(args) -> np.ndarray:
+    """Isolation Forest labels of the last n_new rows of one site's window (worker task)."""
+    frame, n_new = args
+    if len(frame) < 2:
+        return np.ones(n_new, dtype=int)
+    return ad.run_isolation_forest(frame, n_jobs=1)[-n_new:]
+
+
+def detect_window(window: pd.DataFrame, codes: np.ndarray, is_new: np.ndarray, freq: str,
+                  if_labels: Optional[np.ndarray] = None) -> List[Tuple]:
+    """
+    Vectorized anomaly_detector.detect_anomalies (default residual z-scores) for many
+    sites at once. window: trailing windows of several sites, sorted by site code then
+    period; each site's expected values come from its own window. Rows flagged is_new
+    are compared with the previous row of their site (a site's first row never alerts).
+    if_labels: Isolation Forest label of every is_new row (None → z-scores only).
+    Returns (row position, alert dict) for every alert, in detect_anomalies order.
+    """
+    first   = np.r_[True, codes[1:] != codes[:-1]]
+    rows    = np.flatnonzero(is_new & ~first)
+    if not len(rows):
+        return []
+    glob = np.zeros(len(window), dtype=bool)
+    if if_labels is not None:
+        glob[np.flatnonzero(is_new)] = np.asarray(if_labels) == -1
+    glob = glob[rows]
+    features = ad.available_features(window)
+    X = window[features].to_numpy(dtype=float)
+    Z = ad.residual_zscores_by_site(X, codes, freq, fc.period_index(period_dates(window), freq))[rows]
+
+    # Vectorized pre-filter; the record itself is built by the same code as detect_anomalies
+    found = []
+    for c, kpi in enumerate(features):
+        z = Z[:, c]
+        for j in np.flatnonzero(ad.flag_mask(kpi, z)):
+            r = rows[j]
+            found.append((int(r), ad.kpi_anomaly(kpi, float(z[j]), X[r - 1, c], X[r, c], bool(glob[j]))))
+    found.sort(key=lambda t: (t[0], ad.LEVEL_ORDER[t[1]["level"]]))
+    return found
+
+
+class AlertingStage:
+    """
+    Incremental alerting over a (multi-site) KPI frame. Each `process(df)` call only
+    looks at the periods of each site that were not seen by a previous call
+    (a site's first call: its latest period only, so history is not replayed).
+    """
+
+    def __init__(self, sinks: Sequence[Sink], window: Optional[int] = None, chunk_sites: int = 500,
+                 burst: float = 3, per_hour: float = 1, isolation_forest: bool = True,
+                 n_jobs: Optional[int] = None, site_col: str = SITE_COL,
+                 clock: Callable[[], float] = time.time):
+        self.sinks       = list(sinks)
+        self.window      = window
+        self.chunk_sites = chunk_sites
+        self.isolation_forest = isolation_forest
+        self.n_jobs      = n_jobs
+        self.site_col    = site_col
+        self.buckets     = TokenBuckets(burst, per_hour, clock)
+        self.incidents: Dict[Tuple, Dict] = {}        # open incidents, (site, kpi) → first alert
+        self.last_seen: Dict[object, pd.Timestamp] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ── One cycle ─────────────────────────────────────────────────────────────
+    def process(self, df: pd.DataFrame) -> Dict:
+        """
+        Detect, deduplicate, rate-limit and deliver the alerts of the new periods of df.
+        Returns cycle stats: sites, periods, detected, duplicates, rate_limited, sent, errors.
+        A site's last seen period only moves once its chunk has been detected and
+        filtered, so a call that raises is replayed in full by the next one.
+        """
+        t0 = time.perf_counter()
+        stats = {"sites": 0, "periods": 0, "detected": 0, "duplicates": 0,
+                 "rate_limited": 0, "sent": 0, "errors": []}
+        if df.empty:
+            return stats
+        freq   = fc.infer_frequency(parallel.site_groups(df, self.site_col)[0][1])
+        window = self.window or DEFAULT_WINDOW.get(freq, 36)
+
+        dates = period_dates(df).values
+        codes, sites = (pd.factorize(df[self.site_col], sort=False) if self.site_col in df.columns
+                        else (np.zeros(len(df), dtype=np.int64), np.array([""], dtype=object)))
+        seen = pd.to_datetime(pd.Series([self.last_seen.get(s) for s in sites], dtype=object)).values
+        for chunk in parallel.blocks(np.arange(len(sites)), max(1, -(-len(sites) // self.chunk_sites))):
+            mask  = np.isin(codes, chunk)
+            order = np.lexsort((dates[mask], codes[mask]))
+            sub, sc, sd = df[mask].iloc[order], codes[mask][order], dates[mask][order]
+
+            from_end = pd.Series(sc).groupby(sc).cumcount(ascending=False).to_numpy()
+            last     = seen[sc]
+            is_new   = np.where(np.isnat(last), from_end == 0, sd > last)
+            n_new    = np.bincount(sc, weights=is_new, minlength=len(sites)).astype(int)
+            keep     = from_end < window + n_new[sc]
+            sub, sc, sd, is_new = sub[keep], sc[keep], sd[keep], is_new[keep]
+            ends   = [i for i in np.flatnonzero(np.r_[sc[1:] != sc[:-1], True]) if n_new[sc[i]]]
+            latest = {sites[sc[i]]: sub["mois_label"].iloc[i] for i in ends}
+            stats["sites"]   += len(ends)
+            stats["periods"] += int(is_new.sum())
+            if not is_new.any():
+                continue
+
+            labels = None
+            if self.isolation_forest:
+                bounds = np.flatnonzero(np.r_[True, sc[1:] != sc[:-1], True])
+                tasks  = [(sub.iloc[lo:hi].reset_index(drop=True), int(n_new[sc[lo]]))
+                          for lo, hi in zip(bounds[:-1], bounds[1:]) if n_new[sc[lo]]]
+                labels = np.concatenate(parallel.map_tasks(_site_if_labels, tasks, self.n_jobs))
+
+            alerts = [{"site": sites[sc[i]], "period": sub["mois_label"].iloc[i], **a}
+                      for i, a in detect_window(sub, sc, is_new, freq, labels)]
+            stats["detected"] += len(alerts)
+            kept = self._filter(alerts, stats)
+            self._close_incidents(latest, alerts)
+            for i in ends:
+                self.last_seen[sites[sc[i]]] = pd.Timestamp(sd[i])
+            self._deliver(kept, stats)
+
+        self.buckets.prune()
+        stats["seconds"] = round(time.perf_counter() - t0, 3)
+        return stats
+
+    def _filter(self, alerts: List[Dict], stats: Dict) -> List[Dict]:
+        """
+        Drop repeats of open incidents (unless they escalate), then rate-limit. An
+        incident is only opened / escalated once its alert passes the rate limit, so a
+        rate-limited alert is retried by the next repeat instead of becoming a duplicate.
+        """
+        out = []
+        for a in alerts:
+            key  = (a["site"], a["kpi"])
+            open_ = self.incidents.get(key)
+            if open_ is not None and LEVEL_RANK[a["level"]] <= LEVEL_RANK[open_["level"]]:
+                stats["duplicates"] += 1
+                continue
+            if not self.buckets.allow(key):
+                stats["rate_limited"] += 1
+                continue
+            a["status"]   = "aggravé" if open_ is not None else "nouveau"
+            a["incident"] = open_["incident"] if open_ is not None else f"{a['site']}:{a['kpi']}:{a['period']}"
+            self.incidents[key] = {"incident": a["incident"], "level": a["level"]}
+            out.append(a)
+        return out
+
+    def _close_incidents(self, latest: Dict, alerts: List[Dict]) -> None:
+        """An incident ends when the latest period of its site ({site: label}) no longer alerts on its KPI."""
+        still = {(a["site"], a["kpi"]) for a in alerts if a["period"] == latest[a["site"]]}
+        for key in [k for k in self.incidents if k[0] in latest and k not in still]:
+            del self.incidents[key]
+
+    def _deliver(self, alerts: List[Dict], stats: Dict) -> None:
+        if not alerts:
+            return
+        for a in alerts:
+            a["global_anomaly"] = bool(a["global_anomaly"])
+        for sink in self.sinks:
+            try:
+                sink.send(alerts)
+            except Exception as exc:                      # one failing sink must not stop the others
+                stats["errors"].append(f"{sink.name} : {exc}")
+        stats["sent"] += len(alerts)
+
+    # ── Background loop ───────────────────────────────────────────────────────
+    def start(self, load: Callable[[], pd.DataFrame], interval: float = 60.0,
+              on_cycle: Optional[Callable[[Dict], None]] = None) -> None:
+        """
+        Poll `load` every `interval` seconds on a daemon thread; a cycle runs only when
+        the data changed (data_version). on_cycle receives each cycle's stats. A cycle
+        that raises (load, detection, …) is reported in stats["errors"] and retried at
+        the next poll; the loop keeps running.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            version = None
+            while not self._stop.is_set():
+                stats = None
+                try:
+                    df = load()
+                    current = data_version(df)
+                    if current != version:
+                        stats   = self.process(df)
+                        version = current
+                except Exception as exc:
+                    stats = {"errors": [f"cycle : {type(exc).__name__}: {exc}"]}
+                if stats is not None and on_cycle:
+                    try:
+                        on_cycle(stats)
+                    except Exception:
+                        pass
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=loop, name="alerting", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import data_generator as dg
+
+    parser = argparse.ArgumentParser(description="Run the alerting stage on simulated data arriving month by month.")
+    parser.add_argument("--sites",   type=int, default=50)
+    parser.add_argument("--start",   type=int, default=6, help="months already known before the first cycle")
+    parser.add_argument("--file",    default=None, help="JSON-lines file sink")
+    parser.add_argument("--webhook", default=None, help="webhook URL (default: stub)")
+    parser.add_argument("--smtp",    default=None, help="host:port of an SMTP (debug) server")
+    parser.add_argument("--to",      default="ops@smart-impact.local")
+    parser.add_argument("--no-if",   action="store_true", help="z-scores only (no Isolation Forest)")
+    parser.add_argument("--jobs",    type=int, default=1)
+    args = parser.parse_args()
+
+    sinks: List[Sink] = [WebhookSink(args.webhook)]
+    if args.file:
+        sinks.append(FileSink(args.file))
+    if args.smtp:
+        host, port = args.smtp.rsplit(":", 1)
+        sinks.append(SMTPSink([args.to], host, int(port)))
+
+    data  = dg.generate_multisite_data(args.sites)
+    stage = AlertingStage(sinks, isolation_forest=not args.no_if, n_jobs=args.jobs)
+    for m in range(args.start, data["mois_idx"].max() + 1):
+        stats = stage.process(data[data["mois_idx"] <= m])
+        print(f"{data.loc[data['mois_idx'] == m, 'mois_label'].iloc[0]:9s} "
+              + " · ".join(f"{k} {v}" for k, v in stats.items() if k != "errors")
+              + (f" · erreurs {stats['errors']}" if stats["errors"] else ""))
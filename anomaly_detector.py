@@ -2,25 +2,35 @@
 anomaly_detector.py
 ML-based anomaly detection using:
   - Isolation Forest  (multivariate, unsupervised)
-  - Z-score           (per-KPI, statistical)
+  - Z-score           (per-KPI standardized residual vs a model-expected value:
+                       ARIMA one-step prediction or seasonal profile, see forecaster.expected_values)
+  - PELT change points (per-KPI level shifts, see changepoint.py)
 Replaces all hard-coded thresholds.
 """
+import importlib.util
+
 import pandas as pd
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional
 from datetime import datetime
 
-try:
-    from sklearn.ensemble import IsolationForest
-    from sklearn.preprocessing import StandardScaler
-    SKLEARN_OK = True
-except ImportError:
-    SKLEARN_OK = False
+import changepoint as cp
+import forecaster as fc
+import parallel
+import shared_arrays as sa
+from data_generator import SITE_COL
+
+# scikit-learn takes ~1.5 s to import: only check it is installed here, import on first fit
+SKLEARN_OK = importlib.util.find_spec("sklearn") is not None
 
 
 # ── KPI columns used for ML ───────────────────────────────────────────────────
 ML_FEATURES = ["chiffre_affaires", "marge", "energie", "co2", "absenteisme", "satisfaction", "productivite"]
 
+def available_features(df: pd.DataFrame) -> List[str]:
+    """ML_FEATURES present in df (the daily export has no productivity column)."""
+    return [c for c in ML_FEATURES if c in df.columns]
+
 # ── Human-readable labels ─────────────────────────────────────────────────────
 KPI_LABELS = {
     "chiffre_affaires": "Chiffre d'Affaires",
@@ -44,153 +54,258 @@ KPI_DIRECTION = {
 }
 
 # ── Severity from z-score magnitude ──────────────────────────────────────────
+MIN_ANOMALY_Z = 1.2         # |z| from which a KPI is flagged ("modéré")
+LEVEL_ORDER   = {"critique": 0, "élevé": 1, "modéré": 2}    # most severe first
+
 def _zscore_level(z: float) -> str:
     az = abs(z)
     if az >= 2.5:  return "critique"
     if az >= 1.8:  return "élevé"
-    if az >= 1.2:  return "modéré"
+    if az >= MIN_ANOMALY_Z:  return "modéré"
     return "normal"
 
 
+def flag_mask(kpi: str, z) -> np.ndarray:
+    """z-scores (scalar or array) that raise an anomaly on kpi: at least "modéré", in the KPI's bad direction."""
+    z   = np.asarray(z, dtype=float)
+    bad = z > 0 if KPI_DIRECTION.get(kpi, "down_bad") == "up_bad" else z < 0
+    return bad & (np.abs(z) >= MIN_ANOMALY_Z)
+
+
+def kpi_anomaly(kpi: str, z: float, prev_val: float, curr_val: float, is_global_anomaly: bool) -> Optional[Dict]:
+    """
+    Anomaly record of one KPI at one period, or None if not flagged (flag_mask).
+    Shared by detect_anomalies and alerting.detect_window, so both report the same
+    levels (escalated one step when Isolation Forest flags the period) and messages.
+    """
+    if not flag_mask(kpi, z):
+        return None
+    delta_pct = (curr_val - prev_val) / abs(prev_val) * 100 if prev_val != 0 else 0.0
+    level = _zscore_level(z)
+    if is_global_anomaly and level == "modéré":
+        level = "élevé"
+    elif is_global_anomaly and level == "élevé":
+        level = "critique"
+    label = KPI_LABELS.get(kpi, kpi)
+    sign  = "+" if delta_pct > 0 else ""
+    return {
+        "kpi":       kpi,
+        "level":     level,
+        "delta":     delta_pct,
+        "zscore":    round(z, 2),
+        "method":    "Isolation Forest + Z-score" if is_global_anomaly else "Z-score",
+        "message":   f"{label} : {sign}{delta_pct:.1f}% (z={z:+.2f})",
+        "global_anomaly": is_global_anomaly,
+    }
+
+
 def compute_zscores(df: pd.DataFrame) -> pd.DataFrame:
     """Return a DataFrame of z-scores for each KPI column."""
-    result = df[ML_FEATURES].copy()
-    for col in ML_FEATURES:
+    features = available_features(df)
+    result = df[features].copy()
+    for col in features:
         mu  = df[col].mean()
         std = df[col].std(ddof=1)
         result[col] = (df[col] - mu) / std if std > 0 else 0.0
     return result
 
 
-def run_isolation_forest(df: pd.DataFrame, contamination: float = 0.1) -> np.ndarray:
+def compute_residual_zscores(df: pd.DataFrame, fits: Optional[Dict[str, Dict]] = None,
+                             freq: Optional[str] = None) -> pd.DataFrame:
+    """
+    Same layout as compute_zscores, but each value is scored against what the model
+    expected for it: (observed − expected) / σ of the KPI's residuals. A normal seasonal
+    high is expected, so it scores ~0. fits: forecaster.forecast_all_kpis results to
+    reuse (no new fit); rows without an expectation keep their global z-score.
+    """
+    features = available_features(df)
+    result   = compute_zscores(df)
+    expected = fc.expected_values(df, fits, freq)
+    for col in features:
+        resid = df[col].to_numpy(dtype=float) - expected[col]
+        ok    = np.isfinite(resid)
+        std   = resid[ok].std(ddof=1) if ok.sum() > 1 else 0.0
+        z     = resid / std if std > 0 else np.zeros(len(df))
+        result[col] = np.where(ok, z, result[col].to_numpy(dtype=float))
+    return result
+
+
+def residual_zscores_by_site(X: np.ndarray, codes: np.ndarray, freq: str,
+                             periods: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    compute_residual_zscores (default seasonal profile) of each site's rows of X, rows
+    sorted by site (codes), columns = KPIs. periods: each row's forecaster.period_index
+    on the shared calendar (default: position within its site), so a site with missing
+    periods keeps its seasonality in phase. NaN values are left out of the fit and
+    score NaN; sites with the same missing cells share one least-squares solve.
+    """
+    bounds = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1], True])
+    lo, hi = bounds[:-1], bounds[1:]
+    site   = np.repeat(np.arange(len(lo)), hi - lo)
+    if periods is None:
+        periods = np.arange(len(X)) - np.repeat(lo, hi - lo)
+    periods = np.asarray(periods, dtype=np.int64)
+    periods = periods - periods.min() if len(periods) else periods
+    n, k = (int(periods.max()) + 1 if len(periods) else 0), X.shape[1]
+
+    grid = np.full((len(lo), k, n), np.nan)                                   # (sites, KPIs, periods)
+    grid[site, :, periods] = X
+    series = grid.reshape(-1, n)
+    resid  = series - fc.batch_seasonal_profile(series, freq)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        count = np.isfinite(resid).sum(axis=1)
+        std   = np.where(count > 1, np.nanstd(np.where(count[:, None] > 1, resid, 0.0), axis=1,
+                                              ddof=1), 0.0)[:, None]
+    z = np.divide(resid, std, out=np.where(np.isnan(series), np.nan, 0.0), where=std > 0)
+    return z.reshape(len(lo), k, n)[site, :, periods]
+
+
+def run_isolation_forest(df: pd.DataFrame, contamination: float = 0.1,
+                         n_jobs: Optional[int] = None) -> np.ndarray:
     """
     Returns array of -1 (anomaly) or 1 (normal) for each row.
     Falls back to z-score if sklearn unavailable.
     """
-    if not SKLEARN_OK or len(df) < 6:
+    model = fit_isolation_forest(df, contamination, n_jobs)
+    if model is None:
         # Fallback: flag rows where any z > 2
         zs = compute_zscores(df)
         flags = (zs.abs() > 2.0).any(axis=1).map({True: -1, False: 1})
         return flags.values
+    return predict_isolation_forest(model, df)
+
+
+def fit_isolation_forest(df: pd.DataFrame, contamination: float = 0.1, n_jobs: Optional[int] = None):
+    """
+    Fit (scaler, IsolationForest) on df; None if sklearn is unavailable or df too short.
+    Trees are built on n_jobs threads; the fixed seed gives the same forest for any n_jobs.
+    """
+    if not SKLEARN_OK or len(df) < 6:
+        return None
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import StandardScaler
 
-    X = df[ML_FEATURES].values
+    X = df[available_features(df)].values
     scaler = StandardScaler()
     X_scaled = scaler.fit_transform(X)
     iso = IsolationForest(
         n_estimators=200,
         contamination=contamination,
-        random_state=42,
+        random_state=parallel.RANDOM_STATE,
         max_samples="auto",
+        n_jobs=parallel.n_workers(n_jobs),
     )
-    return iso.fit_predict(X_scaled)
+    return scaler, iso.fit(X_scaled)
+
+
+def predict_isolation_forest(model, df: pd.DataFrame) -> np.ndarray:
+    """-1 / 1 labels for the rows of df with an already fitted model (no refit)."""
+    scaler, iso = model
+    return iso.predict(scaler.transform(df[available_features(df)].values))
 
 
 # ── Main detection function ───────────────────────────────────────────────────
-def detect_anomalies(current, previous, df: pd.DataFrame) -> List[Dict]:
+def detect_anomalies(current, previous, df: pd.DataFrame,
+                     zscores_df: Optional[pd.DataFrame] = None,
+                     if_labels: Optional[np.ndarray] = None,
+                     current_idx: Optional[int] = None) -> List[Dict]:
     """
     Combines:
       1. Isolation Forest global anomaly flag
       2. Per-KPI Z-score for root cause identification
+    zscores_df / if_labels can be passed in when scanning many months of the same df
+    (default: compute_residual_zscores with the cheap seasonal profile), and with them
+    current_idx, current's row position in df (default: looked up by mois_label).
     """
     anomalies = []
 
-    # ── Z-scores over all history ─────────────────────────────────────────────
-    zscores_df = compute_zscores(df)
-    current_idx = df[df["mois_label"] == current["mois_label"]].index[0]
+    # ── Standardized residuals over all history ───────────────────────────────
+    if zscores_df is None:
+        zscores_df = compute_residual_zscores(df)
+    if current_idx is None:
+        current_idx = df.index.get_loc(df[df["mois_label"] == current["mois_label"]].index[0])
     current_z   = zscores_df.iloc[current_idx]
 
     # ── Isolation Forest flag ─────────────────────────────────────────────────
-    if_labels = run_isolation_forest(df)
+    if if_labels is None:
+        if_labels = run_isolation_forest(df)
     is_global_anomaly = (if_labels[current_idx] == -1)
 
-    # ── Per-KPI analysis ──────────────────────────────────────────────────────
-    for kpi in ML_FEATURES:
-        z     = float(current_z[kpi])
-        level = _zscore_level(z)
-        if level == "normal":
-            continue
-
-        direction = KPI_DIRECTION.get(kpi, "down_bad")
-        # Only flag if the direction is "bad"
-        is_bad = (direction == "up_bad" and z > 0) or (direction == "down_bad" and z < 0)
-        if not is_bad:
-            continue
-
-        # Compute % delta vs previous
-        prev_val = previous[kpi]
-        curr_val = current[kpi]
-        if prev_val != 0:
-            delta_pct = (curr_val - prev_val) / abs(prev_val) * 100
-        else:
-            delta_pct = 0.0
-
-        # Boost level if also flagged by Isolation Forest
-        if is_global_anomaly and level == "modéré":
-            level = "élevé"
-        elif is_global_anomaly and level == "élevé":
-            level = "critique"
-
-        label = KPI_LABELS.get(kpi, kpi)
-        sign  = "+" if delta_pct > 0 else ""
-        anomalies.append({
-            "kpi":       kpi,
-            "level":     level,
-            "delta":     delta_pct,
-            "zscore":    round(z, 2),
-            "method":    "Isolation Forest + Z-score" if is_global_anomaly else "Z-score",
-            "message":   f"{label} : {sign}{delta_pct:.1f}% (z={z:+.2f})",
-            "global_anomaly": is_global_anomaly,
-        })
+    # ── Per-KPI analysis (only deviations in the KPI's bad direction) ────────
+    for kpi in available_features(df):
+        anomaly = kpi_anomaly(kpi, float(current_z[kpi]), previous[kpi], current[kpi], is_global_anomaly)
+        if anomaly is not None:
+            anomalies.append(anomaly)
 
     # Sort: critique → élevé → modéré
-    order = {"critique": 0, "élevé": 1, "modéré": 2}
-    anomalies.sort(key=lambda x: order.get(x["level"], 3))
+    anomalies.sort(key=lambda x: LEVEL_ORDER.get(x["level"], 3))
     return anomalies
 
 
-def get_all_anomaly_rows(df: pd.DataFrame) -> pd.DataFrame:
+def _log_record(mois_label: str, anomaly: Dict, z: float, method: str,
+                delta_pct: Optional[float] = None) -> Dict:
+    """Alert-log row (get_all_anomaly_rows format) of a kpi_anomaly record."""
+    delta_pct = anomaly["delta"] if delta_pct is None else delta_pct
+    return {
+        "Mois":           mois_label,
+        "KPI":            KPI_LABELS.get(anomaly["kpi"], anomaly["kpi"]),
+        "Niveau":         anomaly["level"].capitalize(),
+        "Variation":      f"{'+' if delta_pct > 0 else ''}{delta_pct:.1f}%",
+        "Z-Score":        f"{z:+.2f}",
+        "Méthode":        method,
+        "Anomalie globale": "✅" if anomaly["global_anomaly"] else "—",
+        "_level_order":   LEVEL_ORDER.get(anomaly["level"], 3),
+    }
+
+
+def anomaly_records(df: pd.DataFrame, zscores_df: pd.DataFrame, if_labels: np.ndarray,
+                    start: int = 1) -> List[Dict]:
     """
-    Run anomaly detection on every row — used for the Alert History log.
-    Returns a flat DataFrame of all detected anomalies across all months.
+    Alert-log records for rows start..end of df (row idx is compared with idx-1).
+    zscores_df and if_labels are positionally aligned with df.
     """
-    if_labels  = run_isolation_forest(df)
-    zscores_df = compute_zscores(df)
-    records    = []
-
-    for idx in range(1, len(df)):  # skip first row (no previous)
+    records = []
+    for idx in range(max(start, 1), len(df)):  # skip first row (no previous)
         current  = df.iloc[idx]
         previous = df.iloc[idx - 1]
-        is_global = (if_labels[idx] == -1)
-
-        for kpi in ML_FEATURES:
-            z     = float(zscores_df.iloc[idx][kpi])
-            level = _zscore_level(z)
-            if level == "normal":
-                continue
-
-            direction = KPI_DIRECTION.get(kpi, "down_bad")
-            is_bad    = (direction == "up_bad" and z > 0) or (direction == "down_bad" and z < 0)
-            if not is_bad:
-                continue
-
-            prev_val  = previous[kpi]
-            curr_val  = current[kpi]
-            delta_pct = (curr_val - prev_val) / abs(prev_val) * 100 if prev_val != 0 else 0.0
-
-            if is_global and level == "modéré":  level = "élevé"
-            elif is_global and level == "élevé": level = "critique"
-
-            records.append({
-                "Mois":           current["mois_label"],
-                "KPI":            KPI_LABELS.get(kpi, kpi),
-                "Niveau":         level.capitalize(),
-                "Variation":      f"{'+' if delta_pct > 0 else ''}{delta_pct:.1f}%",
-                "Z-Score":        f"{z:+.2f}",
-                "Méthode":        "IF + Z-score" if is_global else "Z-score",
-                "Anomalie globale": "✅" if is_global else "—",
-                "_level_order":   {"critique": 0, "élevé": 1, "modéré": 2}.get(level, 3),
-            })
+        is_global = bool(if_labels[idx] == -1)
+        method    = "IF + Z-score" if is_global else "Z-score"
+
+        for kpi in zscores_df.columns:
+            z = float(zscores_df.iloc[idx][kpi])
+            anomaly = kpi_anomaly(kpi, z, previous[kpi], current[kpi], is_global)
+            if anomaly is not None:
+                records.append(_log_record(current["mois_label"], anomaly, z, method))
+    return records
+
+
+def level_shift_records(shifts: pd.DataFrame) -> List[Dict]:
+    """
+    Alert-log records for change points (changepoint.detect_level_shifts output).
+    The shift size in noise σ is judged like a z-score (kpi_anomaly); the variation
+    reported is the shift in % of the previous level.
+    """
+    records = []
+    for s in shifts.itertuples(index=False):
+        z = float(s.shift_sigma)
+        anomaly = kpi_anomaly(s.kpi, z, 0.0, 0.0, False)
+        if anomaly is not None:
+            records.append(_log_record(s.mois_label, anomaly, z, "Rupture de niveau (PELT)", s.shift_pct))
+    return records
+
 
+def get_all_anomaly_rows(df: pd.DataFrame, shifts: Optional[pd.DataFrame] = None,
+                         fits: Optional[Dict[str, Dict]] = None) -> pd.DataFrame:
+    """
+    Run anomaly detection on every row — used for the Alert History log.
+    Returns a flat DataFrame of all detected anomalies across all months,
+    including level shifts (shifts: precomputed changepoint.detect_level_shifts(df)).
+    fits: forecaster.forecast_all_kpis(df) results, reused for the expected values.
+    """
+    if shifts is None:
+        shifts = cp.detect_level_shifts(df, kpis=available_features(df))
+    records = anomaly_records(df, compute_residual_zscores(df, fits), run_isolation_forest(df))
+    records += level_shift_records(shifts)
     if not records:
         return pd.DataFrame()
 
@@ -199,6 +314,40 @@ def get_all_anomaly_rows(df: pd.DataFrame) -> pd.DataFrame:
     return result.reset_index(drop=True)
 
 
+def _site_anomaly_rows(args) -> pd.DataFrame:
+    """Worker task: alert log of one site, read from the shared KPI matrix."""
+    handle, site, lo, hi, shifts = args
+    rows = get_all_anomaly_rows(sa.frame_view(handle, lo, hi), shifts)
+    return rows.assign(Site=site) if len(rows) else rows
+
+
+def anomaly_rows_by_site(df: pd.DataFrame, shifts: Optional[pd.DataFrame] = None,
+                         n_jobs: Optional[int] = None, site_col: str = SITE_COL) -> pd.DataFrame:
+    """
+    get_all_anomaly_rows for every site of a long multi-site frame, sites spread over
+    n_jobs worker processes. The KPIs are placed once in shared memory; each task
+    only carries a handle and the site's row range (one worker: plain serial loop,
+    no shared copy). Same columns plus "Site", most severe first.
+    """
+    site_shifts = lambda site: None if shifts is None else shifts[shifts["site"] == site]
+    if parallel.n_workers(n_jobs) == 1:
+        frames = []
+        for site, frame in parallel.site_groups(df, site_col):
+            rows = get_all_anomaly_rows(frame.reset_index(drop=True), site_shifts(site))
+            if len(rows):
+                frames.append(rows.assign(Site=site))
+    else:
+        with sa.SharedKPIMatrix(df, available_features(df), site_col=site_col) as shared:
+            tasks = [(shared.handle, site, lo, hi, site_shifts(site)) for site, lo, hi in shared.site_ranges]
+            frames = [f for f in parallel.map_tasks(_site_anomaly_rows, tasks, n_jobs) if len(f)]
+    if not frames:
+        return pd.DataFrame()
+    result = pd.concat(frames, ignore_index=True)
+    level  = result["Niveau"].str.lower().map({"critique": 0, "élevé": 1, "modéré": 2}).fillna(3)
+    result = result.iloc[np.lexsort((result["Site"].to_numpy(), level.to_numpy()))]
+    return result[["Site"] + [c for c in result.columns if c != "Site"]].reset_index(drop=True)
+
+
 # ── Priorities & Recommendations (unchanged API) ──────────────────────────────
 PRIORITY_MAP = {
     "energie":          {"title": "Réduire la consommation énergétique",
@@ -0,0 +1,334 @@
+"""
+api.py
+HTTP access to scores, anomalies and forecasts for other internal tools.
+Small ASGI service (Starlette, already installed with Streamlit) around the
+existing modules. CPU work runs in a process pool so the event loop stays free;
+responses carry a content-hash ETag and are kept in an in-memory LRU cache.
+
+Endpoints (JSON):
+    GET  /health
+    GET  /sites
+    GET  /score?site=Site 01&month=Déc 2024
+    GET  /anomalies?site=Site 01&month=Déc 2024
+    GET  /forecast?site=Site 01&n_periods=3
+    POST /batch      {"queries": [{"kind": "score", "site": "Site 01", "month": "Déc 2024"}, ...]}
+
+Usage:
+    python api.py --sites 10 --port 8000
+"""
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+import anomaly_detector as ad
+import forecaster as fc
+import parallel
+import score_engine as se
+from data_generator import SITE_COL, data_version, generate_multisite_data
+
+
+QUERY_KINDS = ["score", "anomalies", "forecast"]
+MAX_BATCH   = 5000
+
+
+class QueryError(ValueError):
+    """Invalid query; reported to the client as HTTP 4xx with a French message."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+# ── CPU work (runs in worker processes: module-level, picklable) ─────────────
+def site_results(site_df: pd.DataFrame, queries: List[Dict]) -> List[Dict]:
+    """
+    Answer every query of one site. Z-scores and the Isolation Forest are computed
+    at most once per call, forecasts once per horizon, whatever the number of queries.
+    """
+    site_df = site_df.reset_index(drop=True)
+    months  = {m: i for i, m in enumerate(site_df["mois_label"])}
+    zscores_df = if_labels = None
+    forecasts: Dict[int, List[Dict]] = {}
+    results = []
+    for q in queries:
+        kind = q["kind"]
+        if kind == "forecast":
+            n_periods = q.get("n_periods", 3)
+            if len(site_df) < 2:
+                results.append({"error": "Au moins deux périodes sont nécessaires pour une prévision",
+                                "status": 422})
+                continue
+            if n_periods not in forecasts:
+                forecasts[n_periods] = fc.forecast_global_score(site_df, se.compute_score, n_periods)
+            results.append({"forecast": forecasts[n_periods]})
+            continue
+
+        month = q.get("month") or site_df["mois_label"].iloc[-1]
+        if month not in months:
+            results.append({"error": f"Mois inconnu : {month}", "status": 404})
+            continue
+        idx      = months[month]
+        current  = site_df.iloc[idx]
+        previous = site_df.iloc[max(0, idx - 1)]
+        if kind == "score":
+            results.append({"month": month, **se.compute_score(current, previous)})
+        else:
+            if zscores_df is None:
+                zscores_df = ad.compute_residual_zscores(site_df)
+                if_labels  = ad.run_isolation_forest(site_df)
+            anomalies = ad.detect_anomalies(current, previous, site_df, zscores_df, if_labels, idx)
+            results.append({"month": month, "anomalies": anomalies})
+    return results
+
+
+# ── Response encoding and caching ─────────────────────────────────────────────
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (pd.Timestamp, np.datetime64)):
+        return str(obj)
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def encode(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, default=_json_default, sort_keys=True).encode("utf-8")
+
+
+def etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+class ResponseCache:
+    """LRU of encoded response bodies keyed by (data version, request key)."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[bytes, str]]" = OrderedDict()
+        self.hits = self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[Tuple[bytes, str]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: Tuple, body: bytes) -> Tuple[bytes, str]:
+        entry = (body, etag(body))
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+
+# ── Service ───────────────────────────────────────────────────────────────────
+class ScoreService:
+    """Dataset, worker pool and response cache shared by the endpoints."""
+
+    def __init__(self, df: pd.DataFrame, site_col: str = SITE_COL,
+                 max_workers: Optional[int] = None, cache_size: int = 1024):
+        """max_workers=0 runs the CPU work inline (no process pool)."""
+        self.site_col    = site_col
+        self.max_workers = max_workers
+        self.cache       = ResponseCache(cache_size)
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.set_data(df)
+
+    def set_data(self, df: pd.DataFrame) -> None:
+        """Swap the dataset; cached responses of the old version stop matching."""
+        if self.site_col in df.columns:
+            self.sites = {site: g.reset_index(drop=True) for site, g in df.groupby(self.site_col, sort=False)}
+        else:
+            self.sites = {"": df.reset_index(drop=True)}
+        self.version = data_version(df)
+
+    def start(self) -> None:
+        if self.max_workers != 0 and self.pool is None:
+            workers = self.max_workers or parallel.cpu_count()
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=parallel.worker_init,
+                                            initargs=(max(1, parallel.cpu_count() // workers),))
+
+    def stop(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def _site(self, site: Optional[str]) -> str:
+        if not site and len(self.sites) == 1:
+            return next(iter(self.sites))
+        if site not in self.sites:
+            raise QueryError(f"Site inconnu : {site}", 404)
+        return site
+
+    async def run(self, queries: List[Dict]) -> List[Dict]:
+        """Answer queries in their original order, one worker task per site."""
+        by_site: Dict[str, List[int]] = {}
+        for i, q in enumerate(queries):
+            by_site.setdefault(q["site"], []).append(i)
+
+        loop  = asyncio.get_running_loop()
+        tasks = []
+        for site, idxs in by_site.items():
+            args = (self.sites[site], [queries[i] for i in idxs])
+            if self.pool is None:
+                tasks.append(asyncio.sleep(0, site_results(*args)))
+            else:
+                tasks.append(loop.run_in_executor(self.pool, site_results, *args))
+
+        results: List[Optional[Dict]] = [None] * len(queries)
+        for idxs, site_out in zip(by_site.values(), await asyncio.gather(*tasks)):
+            for i, r in zip(idxs, site_out):
+                results[i] = r
+        return results
+
+    def parse_query(self, raw: Dict) -> Dict:
+        kind = raw.get("kind", "score")
+        for field in ("kind", "site", "month"):
+            if raw.get(field) is not None and not isinstance(raw[field], str):
+                raise QueryError(f"{field} doit être une chaîne de caractères")
+        if kind not in QUERY_KINDS:
+            raise QueryError(f"Type de requête inconnu : {kind} (attendu : {', '.join(QUERY_KINDS)})")
+        q = {"kind": kind, "site": self._site(raw.get("site"))}
+        if kind == "forecast":
+            n_periods = raw.get("n_periods", 3)
+            try:
+                if isinstance(n_periods, bool) or (isinstance(n_periods, float) and not n_periods.is_integer()):
+                    raise ValueError(n_periods)
+                q["n_periods"] = int(n_periods)
+            except (TypeError, ValueError, OverflowError):
+                raise QueryError("n_periods doit être un entier")
+            if not 1 <= q["n_periods"] <= 24:
+                raise QueryError("n_periods doit être compris entre 1 et 24")
+        else:
+            q["month"] = raw.get("month")
+        return q
+
+
+def _respond(request: Request, body: bytes, tag: str, status: int = 200) -> Response:
+    headers = {"ETag": tag, "Cache-Control": "private, max-age=0, must-revalidate"}
+    if status == 200 and tag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(body, status_code=status, media_type="application/json", headers=headers)
+
+
+def _error(message: str, status: int) -> Response:
+    return Response(encode({"error": message}), status_code=status, media_type="application/json")
+
+
+async def _cached(request: Request, key: Tuple, queries: List[Dict], single: bool) -> Response:
+    service: ScoreService = request.app.state.service
+    key = (service.version,) + key
+    entry = service.cache.get(key)
+    if entry is None:
+        results = await service.run(queries)
+        if single:
+            if "error" in results[0]:
+                return _error(results[0]["error"], results[0]["status"])
+            payload = results[0]
+        else:
+            payload = {"results": results}
+        entry = service.cache.put(key, encode(payload))
+    return _respond(request, *entry)
+
+
+# ── Endpoints ─────────────────────────────────────────────────────────────────
+async def health(request: Request) -> Response:
+    service: ScoreService = request.app.state.service
+    return Response(encode({"status": "ok", "version": service.version, "sites": len(service.sites),
+                            "cache": {"hits": service.cache.hits, "misses": service.cache.misses}}),
+                    media_type="application/json")
+
+
+async def sites(request: Request) -> Response:
+    service: ScoreService = request.app.state.service
+    body = encode({"sites": [{"site": s, "months": g["mois_label"].tolist()} for s, g in service.sites.items()]})
+    return _respond(request, body, etag(body))
+
+
+def _single(kind: str):
+    async def endpoint(request: Request) -> Response:
+        service: ScoreService = request.app.state.service
+        try:
+            q = service.parse_query({"kind": kind, **request.query_params})
+        except QueryError as e:
+            return _error(str(e), e.status)
+        return await _cached(request, tuple(sorted(q.items(), key=lambda kv: kv[0])), [q], single=True)
+    return endpoint
+
+
+async def batch(request: Request) -> Response:
+    service: ScoreService = request.app.state.service
+    try:
+        body = await request.json()
+    except ValueError:
+        return _error("Corps JSON invalide", 400)
+    raw = body.get("queries") if isinstance(body, dict) else None
+    if not isinstance(raw, list) or not raw:
+        return _error("Le corps doit contenir une liste non vide 'queries'", 400)
+    if len(raw) > MAX_BATCH:
+        return _error(f"Au plus {MAX_BATCH} requêtes par lot", 413)
+    try:
+        queries = [service.parse_query(q if isinstance(q, dict) else {}) for q in raw]
+    except QueryError as e:
+        return _error(str(e), e.status)
+    key = ("batch", hashlib.sha256(encode(queries)).hexdigest())
+    return await _cached(request, key, queries, single=False)
+
+
+def create_app(df: Optional[pd.DataFrame] = None, site_col: str = SITE_COL,
+               max_workers: Optional[int] = None, cache_size: int = 1024) -> Starlette:
+    """
+    Build the ASGI app. Without df, serves the simulated 5-site portfolio.
+    max_workers=0 computes inline, which is handy for local tests.
+    """
+    service = ScoreService(df if df is not None else generate_multisite_data(),
+                           site_col, max_workers, cache_size)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        service.start()
+        try:
+            yield
+        finally:
+            service.stop()
+
+    app = Starlette(routes=[
+        Route("/health",    health),
+        Route("/sites",     sites),
+        Route("/score",     _single("score")),
+        Route("/anomalies", _single("anomalies")),
+        Route("/forecast",  _single("forecast")),
+        Route("/batch",     batch, methods=["POST"]),
+    ], lifespan=lifespan)
+    app.state.service = service
+    return app
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve scores, anomalies and forecasts over HTTP.")
+    parser.add_argument("--sites",   type=int, default=5, help="number of simulated sites")
+    parser.add_argument("--host",    default="127.0.0.1")
+    parser.add_argument("--port",    type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (0 = inline)")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(generate_multisite_data(args.sites), max_workers=args.workers),
+                host=args.host, port=args.port)
@@ -11,6 +11,15 @@ import data_generator as dg
 import anomaly_detector as ad
 import score_engine as se
 import forecaster as fc
+import leaderboard as lb
+import rollups as rl
+import charts
+import correlation as cr
+import changepoint as cp
+import heatmap_tiles as ht
+import profiling
+from cache import CACHE
+from charts import PLOT_BG, PLOT_CFG, light_axis
 
 # ══════════════════════════════════════════════════════════════════════════════
 st.set_page_config(
@@ -34,37 +43,33 @@ st.markdown("""
     color: #1a1d2e;
 }
 .block-container {
-    padding: 0 !important;
+    padding: 0 20px 16px !important;
     max-width: 100% !important;
 }
 
-/* ── Tabs ── */
-.stTabs [data-baseweb="tab-list"] {
-    background: #ffffff !important;
-    border-bottom: 1px solid #e5e9f2 !important;
-    padding: 0 20px !important;
-    gap: 2px !important;
-    box-shadow: 0 1px 4px rgba(0,0,0,0.04) !important;
+/* ── View switcher (tab bar: only the active view is computed) ── */
+div[role="radiogroup"] {
+    background: #ffffff;
+    border-bottom: 1px solid #e5e9f2;
+    margin: 0 -20px 6px;
+    padding: 0 20px;
+    gap: 2px;
+    box-shadow: 0 1px 4px rgba(0,0,0,0.04);
 }
-.stTabs [data-baseweb="tab"] {
-    background: transparent !important;
-    color: #8b92a9 !important;
-    font-family: 'Plus Jakarta Sans', sans-serif !important;
-    font-weight: 600 !important;
-    font-size: 13px !important;
+div[role="radiogroup"] label {
     padding: 12px 18px !important;
-    border-radius: 0 !important;
-    border-bottom: 2px solid transparent !important;
-}
-.stTabs [aria-selected="true"] {
-    color: #5b4fcf !important;
-    border-bottom: 2px solid #5b4fcf !important;
-    background: transparent !important;
+    margin: 0 !important;
+    border-bottom: 2px solid transparent;
 }
-.stTabs [data-baseweb="tab-panel"] {
-    background: transparent !important;
-    padding: 16px 20px !important;
+div[role="radiogroup"] label > div:first-child { display: none; }
+div[role="radiogroup"] label p {
+    color: #8b92a9;
+    font-family: 'Plus Jakarta Sans', sans-serif;
+    font-weight: 600;
+    font-size: 13px;
 }
+div[role="radiogroup"] label:has(input:checked) { border-bottom: 2px solid #5b4fcf; }
+div[role="radiogroup"] label:has(input:checked) p { color: #5b4fcf; }
 
 /* ── KPI cards ── */
 .kcard {
@@ -203,29 +208,131 @@ hr { border-color: #eaedf5 !important; }
 # ══════════════════════════════════════════════════════════════════════════════
 # DATA
 # ══════════════════════════════════════════════════════════════════════════════
-@st.cache_data
-def load_data():       return dg.generate_monthly_data()
-@st.cache_data
-def get_history(_df):  return ad.get_all_anomaly_rows(_df)
-@st.cache_data
-def get_forecasts(_df):return fc.forecast_all_kpis(_df, n_periods=3)
-@st.cache_data
-def get_sc_fc(_df):    return fc.forecast_global_score(_df, se.compute_score, n_periods=3)
-@st.cache_data
-def get_fut_m(_df):    return fc.get_forecast_months(_df, n_periods=3)
-
-df             = load_data()
-alert_history  = get_history(df)
-all_forecasts  = get_forecasts(df)
-score_fc       = get_sc_fc(df)
-future_months  = get_fut_m(df)
-months         = df["mois_label"].tolist()
+# Every derived result is keyed by the data version (content hash), not by the
+# DataFrame object (leading "_" = not part of the key), and is only computed
+# when the view that needs it is open. Results live in the process-wide CACHE
+# (one copy for all sessions, LRU under a fixed RAM budget, see cache.py).
+DATA_SOURCES = {
+    "Simulation mensuelle":    dg.generate_monthly_data,
+    "Export journalier (CSV)": dg.load_daily_csv,
+}
+
+@CACHE.memoize(ttl=900)           # picks up a refreshed CSV export
+def load_rollups(source):
+    """All granularities of a source, aggregated once; views only slice them.
+    Also returns the corrections made by validation when the source was loaded."""
+    raw    = DATA_SOURCES[source]()
+    tables = rl.build_rollups(raw)
+    return tables, {g: dg.data_version(t) for g, t in tables.items()}, raw.attrs.get("validation", [])
+@CACHE.memoize()
+def get_shifts(version, _df):    return cp.detect_level_shifts(_df, kpis=ad.available_features(_df))
+@CACHE.memoize()
+def get_history(version, _df):   return ad.get_all_anomaly_rows(_df, get_shifts(version, _df), get_forecasts(version, _df))
+# Forecasts are fitted on each KPI's current regime (after its last significant level shift)
+@CACHE.memoize()
+def get_forecasts(version, _df):
+    return fc.forecast_all_kpis(_df, n_periods=3, train_start=cp.regime_starts(get_shifts(version, _df)))
+@CACHE.memoize()
+def get_sc_fc(version, _df):
+    return fc.forecast_global_score(_df, se.compute_score, n_periods=3,
+                                    train_start=cp.regime_starts(get_shifts(version, _df)))
+@CACHE.memoize()
+def get_fut_m(version, _df):     return fc.get_forecast_months(_df, n_periods=3)
+@CACHE.memoize()
+def get_hist_scores(version, _df): return se.score_history(_df)["global_score"].tolist()
+@CACHE.memoize()
+def get_explain(version, _df):   return se.explain_scores(_df)
+@CACHE.memoize()
+def get_ml(version, _df):
+    """IF labels and z-scores of the residuals vs the forecast models (seasonal highs are expected)."""
+    return ad.run_isolation_forest(_df), ad.compute_residual_zscores(_df, get_forecasts(version, _df))
+@CACHE.memoize()
+def load_portfolio():  return dg.generate_multisite_data(n_sites=25)
+@CACHE.memoize()
+def get_leaderboard(): return lb.build_leaderboard(load_portfolio())
+@CACHE.memoize()
+def get_ccf(version, _df):       return cr.cross_correlations(_df)
+@CACHE.memoize()
+def get_portfolio_ccf(version):  return cr.cross_correlations(load_portfolio())
+@CACHE.memoize()
+def get_pyramid():     return ht.ZPyramid(load_portfolio())
+def profile_pipeline(version, _df):
+    """
+    KPI_PROFILE=1: the first render of each data version runs the pipeline under
+    profiling.py, calling the modules directly (the get_* helpers may be cache hits).
+    Returns the run directory, or None while another render is being profiled
+    (not cached: a later render profiles it).
+    """
+    key = ("app.profile_pipeline", version)
+    run = CACHE.get(key)
+    if run is None:
+        with profiling.profile_run("app") as run_dir:
+            if run_dir is not None:
+                shifts = cp.detect_level_shifts(_df, kpis=ad.available_features(_df))
+                fits   = fc.forecast_all_kpis(_df, n_periods=3, train_start=cp.regime_starts(shifts))
+                se.score_history(_df)
+                ad.run_isolation_forest(_df)
+                ad.compute_residual_zscores(_df, fits)
+                ad.get_all_anomaly_rows(_df, shifts, fits)
+        if run_dir is None:
+            return None
+        run = str(run_dir)
+        CACHE.put(key, run)
+    return run
+
+# ── Figures (cached per data version; long series are downsampled in charts) ──
+@CACHE.memoize()
+def fig_gauge(score):
+    return charts.gauge_figure(score)
+@CACHE.memoize()
+def fig_trend(version, _df, sel_month):
+    traces = {kpi: (_df[kpi].values, color, label) for kpi, (color, label) in TREND_KPIS.items()}
+    return charts.trend_figure(_df["mois_label"].tolist(), traces, sel_month)
+@CACHE.memoize()
+def fig_score_fc(version, _df, compact):
+    return charts.score_forecast_figure(_df["mois_label"].tolist(), get_hist_scores(version, _df),
+                                        get_sc_fc(version, _df), compact=compact)
+@CACHE.memoize()
+def fig_kpi_fc(version, _df, kpi, title, color):
+    fcast = get_forecasts(version, _df)[kpi]
+    return charts.kpi_forecast_figure(_df["mois_label"].tolist(), _df[kpi].values, get_fut_m(version, _df),
+                                      fcast["forecast"], title, fcast["method"], color)
+@CACHE.memoize()
+def fig_heatmap(version, _df):
+    z_mat = get_ml(version, _df)[1].T
+    return charts.zscore_heatmap(z_mat.values, [KPI_SHORT[k] for k in z_mat.index],
+                                 _df["mois_label"].tolist())
+@CACHE.memoize()
+def fig_portfolio_tile(level, row_tile):
+    tile = get_pyramid().tile(level, row_tile)
+    return charts.tile_heatmap(tile.z, tile.rows, tile.columns, np.vectorize(KPI_SHORT.get)(tile.kpi))
+@CACHE.memoize()
+def fig_site_tile(site, level):
+    tile = get_pyramid().site_tile(site, level)
+    return charts.tile_heatmap(tile.z, [KPI_SHORT[k] for k in tile.rows], tile.columns)
+
+TREND_KPIS = {
+    "chiffre_affaires": ("#5b4fcf","CA"),
+    "energie":          ("#f97316","Énergie"),
+    "satisfaction":     ("#ec4899","Satisf."),
+    "co2":              ("#16a34a","CO₂"),
+}
+KPI_SHORT = {"chiffre_affaires":"CA","marge":"Marge","energie":"Énergie",
+             "co2":"CO₂","absenteisme":"Absent.","satisfaction":"Satisf.","productivite":"Produc."}
+
+@CACHE.memoize()
+def fig_waterfall(version, _df, row):
+    expl  = get_explain(version, _df).iloc[row]
+    parts = {k: expl[k] for k in se.SCORED_KPIS if k in _df.columns}
+    parts["rounding"] = expl["rounding"]
+    return charts.contribution_waterfall(expl["previous_score"], parts, {**KPI_SHORT, "rounding": "Arrondi"})
+
 
 # ══════════════════════════════════════════════════════════════════════════════
 # HEADER
 # ══════════════════════════════════════════════════════════════════════════════
 st.markdown("""
-<div style="background:#ffffff;border-bottom:1px solid #eaedf5;
+<div style="background:#ffffff;border-bottom:1px solid #eaedf5;margin:0 -20px;
             padding:12px 24px;display:flex;align-items:center;
             justify-content:space-between;box-shadow:0 1px 6px rgba(0,0,0,0.05);">
   <div style="display:flex;align-items:center;gap:12px;">
@@ -243,14 +350,48 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ══════════════════════════════════════════════════════════════════════════════
-# TABS
+# VIEWS — a radio styled as a tab bar, so only the active view runs
 # ══════════════════════════════════════════════════════════════════════════════
-tab1, tab2, tab3, tab4 = st.tabs([
+VIEWS = [
     "📊  Vue Principale",
     "📈  Prévisions",
     "🤖  Analyse ML",
     "🔔  Alertes",
-])
+    "🏆  Classement",
+    "🔗  Corrélations",
+]
+view = st.radio("Vue", VIEWS, horizontal=True, label_visibility="collapsed", key="view")
+
+# ── Source · granularity · date range (reads a precomputed rollup table) ─────
+sc1, sc2, sc3, sc4 = st.columns([2, 2, 3, 3], gap="small")
+with sc1:
+    source = st.selectbox("Source", list(DATA_SOURCES), key="src")
+tables, versions, checks = load_rollups(source)
+with sc2:
+    granularity = st.selectbox("Granularité", list(tables), index=list(tables).index("Mois"), key="gran")
+full_table = tables[granularity]
+d_min, d_max = full_table["date"].min().date(), full_table["date"].max().date()
+with sc3:
+    d_range = st.date_input("Période", (d_min, d_max), min_value=d_min, max_value=d_max,
+                            format="DD/MM/YYYY", key=f"range_{source}")
+d_start, d_end = (d_range if len(d_range) == 2 else (d_range[0], d_max))
+with sc4:
+    if checks:
+        with st.expander(f"🧹 {len(checks)} correction(s) à l'import"):
+            st.dataframe(pd.DataFrame(checks), hide_index=True, use_container_width=True)
+    cstats = CACHE.stats()
+    st.caption(f"Cache : {cstats['hit_rate']:.0%} de hits · {cstats['bytes'] / 2**20:,.1f} / "
+               f"{cstats['max_bytes'] / 2**20:,.0f} Mo · {cstats['entries']} résultats")
+
+df      = rl.select_range(full_table, d_start, d_end)
+version = f"{versions[granularity]}:{d_start}:{d_end}"
+months  = df["mois_label"].tolist()
+if len(df) < 2:
+    st.warning("Sélectionnez une période couvrant au moins deux points à cette granularité.")
+    st.stop()
+profile_dir = profile_pipeline(version, df) if profiling.enabled() else None
+if profile_dir is not None:
+    st.caption(f"🔬 Profil du pipeline : {profile_dir}")
 
 # ────────────────────────────────────────────────────────────────────────────
 # HELPERS
@@ -280,19 +421,10 @@ def card_class(anomalies, kpi, inverse=False):
             return "bad" if a["level"] == "critique" else "warn"
     return ""
 
-PLOT_CFG = {"displayModeBar": False, "staticPlot": False}
-PLOT_BG  = dict(paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)")
-
-def light_axis():
-    return dict(
-        xaxis=dict(showgrid=False, tickfont=dict(color="#9ca3af", size=9), tickangle=-30),
-        yaxis=dict(gridcolor="#f0f0f4", tickfont=dict(color="#9ca3af", size=9)),
-    )
-
 # ══════════════════════════════════════════════════════════════════════════════
 # TAB 1 — MAIN VIEW  (everything fits in one viewport)
 # ══════════════════════════════════════════════════════════════════════════════
-with tab1:
+if view == VIEWS[0]:
 
     # Month picker in a slim top bar
     hc1, hc2, hc3 = st.columns([5, 2, 1])
@@ -306,7 +438,8 @@ with tab1:
     previous = df.iloc[prev_idx]
 
     score_data  = se.compute_score(current, previous)
-    anomalies   = ad.detect_anomalies(current, previous, df)
+    if_labels, zscores_df = get_ml(version, df)
+    anomalies   = ad.detect_anomalies(current, previous, df, zscores_df, if_labels)
     priorities  = ad.get_priorities(anomalies)
     recos       = ad.get_recommendations(anomalies)
     gscore      = score_data["global_score"]
@@ -320,33 +453,11 @@ with tab1:
         sc_label = "Bonne performance" if gscore >= 75 else "En baisse" if gscore >= 55 else "Critique"
         sc_icon  = "✅" if gscore >= 75 else "⚠️" if gscore >= 55 else "🚨"
 
-        # Gauge
-        fig_g = go.Figure(go.Indicator(
-            mode="gauge+number",
-            value=gscore,
-            domain={"x":[0,1],"y":[0,1]},
-            number={"font":{"size":46,"family":"Plus Jakarta Sans","color":"white"}},
-            gauge={
-                "axis":{"range":[0,100],"visible":False},
-                "bar":{"color":"rgba(255,255,255,0.9)","thickness":0.18},
-                "bgcolor":"rgba(255,255,255,0.1)",
-                "borderwidth":0,
-                "steps":[
-                    {"range":[0,40],  "color":"rgba(255,255,255,0.15)"},
-                    {"range":[40,65], "color":"rgba(255,255,255,0.15)"},
-                    {"range":[65,80], "color":"rgba(255,255,255,0.15)"},
-                    {"range":[80,100],"color":"rgba(255,255,255,0.15)"},
-                ],
-                "threshold":{"line":{"color":"white","width":3},"thickness":0.85,"value":gscore},
-            }
-        ))
-        fig_g.update_layout(**PLOT_BG, height=150, margin=dict(l=10,r=10,t=10,b=0))
-
         st.markdown(f"""
         <div class="score-hero">
           <div class="score-label">Score Global · {sel_month}</div>
         """, unsafe_allow_html=True)
-        st.plotly_chart(fig_g, use_container_width=True, config=PLOT_CFG)
+        st.plotly_chart(fig_gauge(gscore), use_container_width=True, config=PLOT_CFG)
         st.markdown(f"""
           <div style="display:flex;justify-content:space-between;align-items:center;margin-top:-8px;">
             <span style="background:rgba(255,255,255,0.2);border-radius:8px;
@@ -395,6 +506,13 @@ with tab1:
         </div>
         """, unsafe_allow_html=True)
 
+        # What moved the score since the previous period
+        if curr_idx > 0:
+            st.markdown('<div class="scard">', unsafe_allow_html=True)
+            st.markdown(f'<div class="scard-title">📊 Variation vs {previous["mois_label"]}</div>', unsafe_allow_html=True)
+            st.plotly_chart(fig_waterfall(version, df, curr_idx), use_container_width=True, config=PLOT_CFG)
+            st.markdown('</div>', unsafe_allow_html=True)
+
     # ── CENTRE: KPI grid (2×3) + sparkline chart ──────────────────────────────
     with col_m:
         # KPI grid: 3 columns × 2 rows
@@ -425,7 +543,7 @@ with tab1:
                 d_html  = delta_html(d, " pts", inverse=inv)
             else:
                 d = pct_delta(cv, pv)
-                val_str = f"{cv:,.0f}{unit}"
+                val_str = f"{cv:,.0f}{unit}" if abs(cv) >= 100 else f"{cv:,.2f}{unit}"
                 d_html  = delta_html(d, "%", inverse=inv)
 
             cls = card_class(anomalies, kpi)
@@ -446,37 +564,7 @@ with tab1:
         st.markdown('<div class="scard">', unsafe_allow_html=True)
         st.markdown('<div class="scard-title">Tendances historiques (normalisées)</div>', unsafe_allow_html=True)
 
-        TREND_KPIS = {
-            "chiffre_affaires": ("#5b4fcf","CA"),
-            "energie":          ("#f97316","Énergie"),
-            "satisfaction":     ("#ec4899","Satisf."),
-            "co2":              ("#16a34a","CO₂"),
-        }
-        fig_t = go.Figure()
-        for kpi, (color, label) in TREND_KPIS.items():
-            vals = df[kpi].values.astype(float)
-            norm = (vals - vals.min()) / (vals.max() - vals.min() + 1e-9) * 100
-            fig_t.add_trace(go.Scatter(
-                x=df["mois_label"], y=norm,
-                mode="lines", name=label,
-                line=dict(color=color, width=2),
-                hovertemplate=f"<b>{label}</b>: %{{customdata:.1f}}<extra></extra>",
-                customdata=vals,
-            ))
-        # Mark selected month
-        sel_x = [sel_month, sel_month]
-        fig_t.add_shape(type="line", x0=sel_month, x1=sel_month, y0=0, y1=100,
-                        line=dict(color="#5b4fcf", width=1.5, dash="dot"))
-
-        fig_t.update_layout(
-            **PLOT_BG,
-            height=170, margin=dict(l=0,r=0,t=4,b=0),
-            **light_axis(),
-            legend=dict(orientation="h", y=1.15, font=dict(size=10,color="#6b7280"),
-                        bgcolor="rgba(0,0,0,0)"),
-            hovermode="x unified",
-        )
-        st.plotly_chart(fig_t, use_container_width=True, config=PLOT_CFG)
+        st.plotly_chart(fig_trend(version, df, sel_month), use_container_width=True, config=PLOT_CFG)
         st.markdown('</div>', unsafe_allow_html=True)
 
     # ── RIGHT: Priorities + Recommendations + Export ───────────────────────────
@@ -485,39 +573,8 @@ with tab1:
         st.markdown('<div class="scard">', unsafe_allow_html=True)
         st.markdown('<div class="scard-title">📈 Prévision Score (3 mois)</div>', unsafe_allow_html=True)
 
-        hist_scores = []
-        for i in range(len(df)):
-            r = df.iloc[i]; p = df.iloc[max(0,i-1)]
-            hist_scores.append(se.compute_score(r,p)["global_score"])
-
-        fc_x = [df["mois_label"].iloc[-1]] + [s["month"] for s in score_fc]
-        fc_y = [hist_scores[-1]] + [s["score"] for s in score_fc]
-
-        fig_fc = go.Figure()
-        fig_fc.add_trace(go.Scatter(
-            x=df["mois_label"].tolist()[-8:], y=hist_scores[-8:],
-            mode="lines+markers", line=dict(color="#5b4fcf",width=2.5),
-            marker=dict(size=5,color="#5b4fcf"), showlegend=False,
-        ))
-        fig_fc.add_trace(go.Scatter(
-            x=fc_x, y=fc_y,
-            mode="lines+markers", line=dict(color="#ef4444",width=2,dash="dot"),
-            marker=dict(size=7,symbol="diamond",color="#ef4444"), showlegend=False,
-        ))
-        # CI band
-        fc_upper = [hist_scores[-1]] + [s["upper"] for s in score_fc]
-        fc_lower = [hist_scores[-1]] + [s["lower"] for s in score_fc]
-        fig_fc.add_trace(go.Scatter(
-            x=fc_x+fc_x[::-1], y=fc_upper+fc_lower[::-1],
-            fill="toself", fillcolor="rgba(239,68,68,0.07)",
-            line=dict(color="rgba(0,0,0,0)"), showlegend=False, hoverinfo="skip",
-        ))
-        fig_fc.add_hline(y=55, line_dash="dash", line_color="rgba(239,68,68,0.35)")
-        fig_fc.update_layout(
-            **PLOT_BG, height=145, margin=dict(l=0,r=0,t=4,b=0),
-            **light_axis(),
-        )
-        st.plotly_chart(fig_fc, use_container_width=True, config=PLOT_CFG)
+        score_fc = get_sc_fc(version, df)
+        st.plotly_chart(fig_score_fc(version, df, True), use_container_width=True, config=PLOT_CFG)
         proj = score_fc[-1]["score"] if score_fc else gscore
         trend_txt = "📉 tendance baisse" if proj < gscore else "📈 tendance hausse"
         st.markdown(f'<p style="font-size:11px;color:#9ca3af;text-align:center;margin-top:-4px;">Prév. M+3 : <b style="color:{"#dc2626" if proj<55 else "#16a34a"};">{proj:.0f}/100</b> · {trend_txt}</p>', unsafe_allow_html=True)
@@ -573,40 +630,12 @@ with tab1:
 # ══════════════════════════════════════════════════════════════════════════════
 # TAB 2 — FORECASTS
 # ══════════════════════════════════════════════════════════════════════════════
-with tab2:
+if view == VIEWS[1]:
     st.markdown('<div class="ibox">📡 Prévisions ARIMA (statsmodels) avec intervalles de confiance · fallback régression linéaire.</div>', unsafe_allow_html=True)
 
-    # Score forecast full
-    hist_scores2 = []
-    for i in range(len(df)):
-        r=df.iloc[i]; p=df.iloc[max(0,i-1)]
-        hist_scores2.append(se.compute_score(r,p)["global_score"])
-
-    fc_x2 = [df["mois_label"].iloc[-1]] + [s["month"] for s in score_fc]
-    fc_y2 = [hist_scores2[-1]] + [s["score"] for s in score_fc]
-    fc_u2 = [hist_scores2[-1]] + [s["upper"] for s in score_fc]
-    fc_l2 = [hist_scores2[-1]] + [s["lower"] for s in score_fc]
-
-    fig_sf = go.Figure()
-    fig_sf.add_trace(go.Scatter(x=df["mois_label"].tolist(), y=hist_scores2,
-        mode="lines+markers", name="Historique",
-        line=dict(color="#5b4fcf",width=2.5), marker=dict(size=6,color="#5b4fcf"),
-        fill="tozeroy", fillcolor="rgba(91,79,207,0.05)"))
-    fig_sf.add_trace(go.Scatter(x=fc_x2+fc_x2[::-1], y=fc_u2+fc_l2[::-1],
-        fill="toself", fillcolor="rgba(239,68,68,0.08)",
-        line=dict(color="rgba(0,0,0,0)"), showlegend=False, hoverinfo="skip"))
-    fig_sf.add_trace(go.Scatter(x=fc_x2, y=fc_y2,
-        mode="lines+markers", name="Prévision ARIMA",
-        line=dict(color="#ef4444",width=2.5,dash="dot"),
-        marker=dict(size=9,symbol="diamond",color="#ef4444")))
-    fig_sf.add_hline(y=55, line_dash="dash", line_color="rgba(239,68,68,0.4)",
-                     annotation_text="Seuil critique", annotation_font_color="#ef4444",annotation_font_size=11)
-    fig_sf.update_layout(**PLOT_BG, height=280, margin=dict(l=0,r=0,t=10,b=0),
-                         **light_axis(),
-                         legend=dict(font=dict(size=11,color="#6b7280"),bgcolor="rgba(0,0,0,0)"))
     st.markdown('<div class="scard">', unsafe_allow_html=True)
     st.markdown('<div class="scard-title">🎯 Prévision Score Global</div>', unsafe_allow_html=True)
-    st.plotly_chart(fig_sf, use_container_width=True, config=PLOT_CFG)
+    st.plotly_chart(fig_score_fc(version, df, False), use_container_width=True, config=PLOT_CFG)
     st.markdown('</div>', unsafe_allow_html=True)
 
     # Per-KPI forecasts in 3 columns
@@ -621,44 +650,29 @@ with tab2:
     c1,c2,c3 = st.columns(3, gap="small")
     fcols = [c1,c2,c3]
     for i,(kpi,lbl,color) in enumerate(KPI_FC):
-        hist_v = df[kpi].tolist()
-        fc_v   = all_forecasts[kpi]["forecast"]
-        method = all_forecasts[kpi]["method"]
-        x_h    = df["mois_label"].tolist()
-        x_fc2  = [x_h[-1]] + future_months
-        y_fc2  = [hist_v[-1]] + fc_v
-
-        fig_k = go.Figure()
-        fig_k.add_trace(go.Scatter(x=x_h, y=hist_v, mode="lines",
-            line=dict(color=color,width=2), showlegend=False))
-        fig_k.add_trace(go.Scatter(x=x_fc2, y=y_fc2, mode="lines+markers",
-            line=dict(color="#ef4444",width=2,dash="dot"),
-            marker=dict(size=7,symbol="diamond",color="#ef4444"), showlegend=False))
-        fig_k.update_layout(**PLOT_BG, height=160,
-            title=dict(text=f"{lbl} <span style='font-size:10px;color:#9ca3af;'>· {method}</span>",
-                       font=dict(size=12,color="#374151")),
-            margin=dict(l=0,r=0,t=36,b=0), **light_axis())
         with fcols[i%3]:
             st.markdown('<div class="scard">', unsafe_allow_html=True)
-            st.plotly_chart(fig_k, use_container_width=True, config=PLOT_CFG)
+            st.plotly_chart(fig_kpi_fc(version, df, kpi, lbl, color), use_container_width=True, config=PLOT_CFG)
             st.markdown('</div>', unsafe_allow_html=True)
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 # TAB 3 — ML ANALYSIS
 # ══════════════════════════════════════════════════════════════════════════════
-with tab3:
+if view == VIEWS[2]:
     st.markdown('<div class="ibox">🤖 <b>Isolation Forest</b> détecte les mois globalement anormaux · <b>Z-score</b> identifie le KPI responsable.</div>', unsafe_allow_html=True)
 
-    if_labels  = ad.run_isolation_forest(df)
-    zscores_df = ad.compute_zscores(df)
+    if_labels, zscores_df = get_ml(version, df)
 
     ml1, ml2 = st.columns([3,5], gap="medium")
 
     with ml1:
         st.markdown('<div class="scard">', unsafe_allow_html=True)
         st.markdown('<div class="scard-title">🗓️ Mois flaggés — Isolation Forest</div>', unsafe_allow_html=True)
-        for i, m in enumerate(months):
+        # Long histories: list flagged periods only, not one row per day
+        listed = range(len(months)) if len(months) <= 24 else np.flatnonzero(if_labels == -1)
+        for i in listed:
+            m    = months[i]
             is_a = (if_labels[i] == -1)
             bg   = "#fef2f2" if is_a else "#f0fdf4"
             bd   = "#fecaca" if is_a else "#bbf7d0"
@@ -680,27 +694,8 @@ with tab3:
     with ml2:
         # Z-score heatmap
         st.markdown('<div class="scard">', unsafe_allow_html=True)
-        st.markdown('<div class="scard-title">🌡️ Heatmap Z-scores</div>', unsafe_allow_html=True)
-        kpi_short = {"chiffre_affaires":"CA","marge":"Marge","energie":"Énergie",
-                     "co2":"CO₂","absenteisme":"Absent.","satisfaction":"Satisf.","productivite":"Produc."}
-        z_mat = zscores_df[ad.ML_FEATURES].T
-        z_mat.index   = [kpi_short[k] for k in ad.ML_FEATURES]
-        z_mat.columns = df["mois_label"].tolist()
-
-        fig_h = go.Figure(go.Heatmap(
-            z=z_mat.values, x=z_mat.columns.tolist(), y=z_mat.index.tolist(),
-            colorscale=[[0,"#3730a3"],[0.35,"#818cf8"],[0.5,"#f8fafc"],
-                        [0.65,"#fb923c"],[1,"#dc2626"]],
-            zmid=0,
-            colorbar=dict(tickfont=dict(color="#6b7280",size=10),thickness=10),
-            text=z_mat.round(1).values, texttemplate="%{text}",
-            textfont=dict(size=9),
-            hovertemplate="<b>%{y}</b> | %{x}<br>Z: %{z:.2f}<extra></extra>",
-        ))
-        fig_h.update_layout(**PLOT_BG, height=240, margin=dict(l=0,r=0,t=4,b=0),
-            xaxis=dict(showgrid=False, tickfont=dict(color="#9ca3af",size=9), tickangle=-35),
-            yaxis=dict(tickfont=dict(color="#374151",size=10)))
-        st.plotly_chart(fig_h, use_container_width=True, config=PLOT_CFG)
+        st.markdown('<div class="scard-title">🌡️ Heatmap Z-scores · écart au modèle</div>', unsafe_allow_html=True)
+        st.plotly_chart(fig_heatmap(version, df), use_container_width=True, config=PLOT_CFG)
         st.markdown('<p style="font-size:11px;color:#9ca3af;text-align:center;margin-top:-4px;">Rouge = trop haut · Bleu = trop bas · Blanc = normal</p>', unsafe_allow_html=True)
         st.markdown('</div>', unsafe_allow_html=True)
 
@@ -708,8 +703,8 @@ with tab3:
         sel_ml = st.selectbox("Détail pour :", months, index=len(months)-1, key="ml_m")
         sel_z  = zscores_df.iloc[df[df["mois_label"]==sel_ml].index[0]]
 
-        zcols = st.columns(7)
-        for i, kpi in enumerate(ad.ML_FEATURES):
+        zcols = st.columns(len(zscores_df.columns))
+        for i, kpi in enumerate(zscores_df.columns):
             z    = float(sel_z[kpi])
             lvl  = ad._zscore_level(z)
             c    = "#dc2626" if lvl=="critique" else "#ea580c" if lvl=="élevé" else "#ca8a04" if lvl=="modéré" else "#16a34a"
@@ -717,17 +712,36 @@ with tab3:
             with zcols[i]:
                 st.markdown(f"""
                 <div style="background:{bg};border-radius:10px;padding:10px 6px;text-align:center;">
-                  <div style="font-size:9px;font-weight:700;color:#6b7280;margin-bottom:4px;">{kpi_short[kpi]}</div>
+                  <div style="font-size:9px;font-weight:700;color:#6b7280;margin-bottom:4px;">{KPI_SHORT[kpi]}</div>
                   <div style="font-size:18px;font-weight:800;color:{c};">{z:+.1f}</div>
                   <div style="font-size:9px;color:{c};">{lvl}</div>
                 </div>
                 """, unsafe_allow_html=True)
 
+    # Portfolio: sites × periods (max |z| over the KPIs), click a site to drill into its KPIs
+    pyramid = get_pyramid()
+    level   = pyramid.level_for()
+    st.markdown('<div class="scard">', unsafe_allow_html=True)
+    st.markdown(f'<div class="scard-title">🏢 Portefeuille · {len(pyramid.sites)} sites · max |Z| tous KPIs</div>', unsafe_allow_html=True)
+    n_pages = pyramid.n_tiles(level)[0]
+    page = st.selectbox("Sites :", range(n_pages), key="hm_page",
+                        format_func=lambda p: f"{p * ht.TILE_SITES + 1}–{min((p + 1) * ht.TILE_SITES, len(pyramid.sites))} (les plus anormaux d'abord)") if n_pages > 1 else 0
+    event = st.plotly_chart(fig_portfolio_tile(level, page), use_container_width=True, config=PLOT_CFG,
+                            on_select="rerun", selection_mode="points", key="hm_portfolio")
+    points = event.selection.points if event else []
+    if points and points[0].get("y") in pyramid.sites:
+        st.session_state["hm_site"] = points[0]["y"]
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    hm_site = st.selectbox("Détail du site :", pyramid.sites, key="hm_site")
+    st.plotly_chart(fig_site_tile(hm_site, level), use_container_width=True, config=PLOT_CFG)
+
 
 # ══════════════════════════════════════════════════════════════════════════════
 # TAB 4 — ALERT HISTORY
 # ══════════════════════════════════════════════════════════════════════════════
-with tab4:
+if view == VIEWS[3]:
+    alert_history = get_history(version, df)
     if alert_history.empty:
         st.info("Aucune anomalie détectée sur la période.")
     else:
@@ -791,4 +805,94 @@ with tab4:
                  "Modéré":"background:#fefce8;color:#ca8a04;font-weight:700"}
             return m.get(val,"")
         styled = filtered.style.applymap(style_niveau, subset=["Niveau"])
-        st.dataframe(styled, use_container_width=True, hide_index=True, height=320)
\ No newline at end of file
+        st.dataframe(styled, use_container_width=True, hide_index=True, height=320)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# TAB 5 — CROSS-SITE LEADERBOARD
+# ══════════════════════════════════════════════════════════════════════════════
+if view == VIEWS[4]:
+    board = get_leaderboard()
+    st.markdown(f'<div class="ibox">🏆 Classement de <b>{len(board.sites)} sites</b> · rangs et percentiles précalculés pour chaque période et chaque dimension.</div>', unsafe_allow_html=True)
+
+    lc1, lc2, lc3 = st.columns([2, 2, 1], gap="small")
+    with lc1:
+        lb_period = st.selectbox("Période", board.periods, index=len(board.periods)-1, key="lb_p")
+    with lc2:
+        lb_metric = st.selectbox("Classer par", lb.METRICS, format_func=lb.METRIC_LABELS.get, key="lb_m")
+    with lc3:
+        lb_top = st.number_input("Top", min_value=5, max_value=len(board.sites), value=min(20, len(board.sites)), step=5, key="lb_n")
+
+    ranking = board.ranking(lb_period, lb_metric, top=int(lb_top))
+
+    def style_move(val):
+        if pd.isna(val) or val == 0: return "color:#9ca3af"
+        return "color:#16a34a;font-weight:700" if val > 0 else "color:#dc2626;font-weight:700"
+    def style_band(val):
+        m = {"Top 10%":"background:#f0fdf4;color:#15803d;font-weight:700",
+             "Top 25%":"background:#ecfeff;color:#0e7490;font-weight:700",
+             "Bas 25%":"background:#fef2f2;color:#dc2626;font-weight:700"}
+        return m.get(val,"")
+
+    lr1, lr2 = st.columns([5, 3], gap="medium")
+    with lr1:
+        styled_rank = (ranking.style
+                       .map(style_move, subset=["Mouvement"])
+                       .map(style_band, subset=["Bande"])
+                       .format({"Mouvement": lambda v: "—" if pd.isna(v) else f"{v:+.0f}",
+                                "Percentile": "{:.1f}"}))
+        st.dataframe(styled_rank, use_container_width=True, hide_index=True, height=420)
+    with lr2:
+        lb_site = st.selectbox("Historique du site", board.sites, key="lb_s")
+        hist_rank = board.site_history(lb_site, lb_metric)
+        fig_r = go.Figure(go.Scatter(
+            x=hist_rank["Période"], y=hist_rank["Rang"], mode="lines+markers",
+            line=dict(color="#5b4fcf", width=2.5), marker=dict(size=6, color="#5b4fcf"),
+            customdata=hist_rank["Percentile"],
+            hovertemplate="<b>%{x}</b><br>Rang %{y} · P%{customdata:.0f}<extra></extra>",
+        ))
+        fig_r.update_layout(**PLOT_BG, height=260, margin=dict(l=0,r=0,t=10,b=0), **light_axis())
+        fig_r.update_yaxes(autorange="reversed", title=dict(text="Rang", font=dict(size=10,color="#9ca3af")))
+        st.markdown('<div class="scard">', unsafe_allow_html=True)
+        st.markdown(f'<div class="scard-title">📍 {lb_site} · {lb.METRIC_LABELS[lb_metric]}</div>', unsafe_allow_html=True)
+        st.plotly_chart(fig_r, use_container_width=True, config=PLOT_CFG)
+        st.markdown('</div>', unsafe_allow_html=True)
+
+
+# ══════════════════════════════════════════════════════════════════════════════
+# TAB 6 — CROSS-CORRELATIONS
+# ══════════════════════════════════════════════════════════════════════════════
+if view == VIEWS[5]:
+    st.markdown('<div class="ibox">🔗 <b>Corrélations croisées</b> des variations de chaque paire de KPIs, à chaque décalage · décalage positif = le premier KPI précède le second.</div>', unsafe_allow_html=True)
+
+    ccf = get_ccf(version, df)
+    cc1, cc2 = st.columns([5, 4], gap="medium")
+    with cc1:
+        mat = ccf.matrix()
+        st.markdown('<div class="scard">', unsafe_allow_html=True)
+        st.markdown(f'<div class="scard-title">🌡️ Paires × décalage · {granularity}</div>', unsafe_allow_html=True)
+        st.plotly_chart(charts.ccf_heatmap(mat.values, list(mat.index), mat.columns, height=460),
+                        use_container_width=True, config=PLOT_CFG)
+        st.markdown('</div>', unsafe_allow_html=True)
+    with cc2:
+        st.markdown('<div class="sec-title">⏱️ Relations les plus fortes</div>', unsafe_allow_html=True)
+        leads = ccf.lead_lag()
+        leads = leads[leads["Significatif"]].sort_values("Corrélation", key=abs, ascending=False)
+        if leads.empty:
+            st.info("Aucune corrélation significative sur cette période.")
+        else:
+            st.dataframe(leads[["Paire", "Décalage", "Corrélation", "Lag 0", "Sens"]]
+                         .style.format({"Corrélation": "{:+.2f}", "Lag 0": "{:+.2f}"}),
+                         use_container_width=True, hide_index=True, height=420)
+
+    # Same pair across the portfolio: does the relation hold on every site?
+    portfolio = load_portfolio()
+    pccf = get_portfolio_ccf(dg.data_version(portfolio))
+    pair = st.selectbox("Paire (portefeuille)", pccf.pairs(), format_func=lambda p: pccf.pair_label(*p), key="cc_p")
+    by_site = pccf.pair_by_site(*pair)
+    st.markdown('<div class="scard">', unsafe_allow_html=True)
+    st.markdown(f'<div class="scard-title">🏭 {pccf.pair_label(*pair)} · {len(by_site)} sites</div>', unsafe_allow_html=True)
+    st.plotly_chart(charts.ccf_heatmap(by_site.values, list(by_site.index), by_site.columns,
+                                       height=max(240, 16 * len(by_site))),
+                    use_container_width=True, config=PLOT_CFG)
+    st.markdown('</div>', unsafe_allow_html=True)
@@ -0,0 +1,312 @@
+"""
+cache.py
+Process-wide cache for datasets, models and derived results, shared by every
+session of a dashboard node (st.cache_data keeps one unbounded copy per argument
+set and returns a deserialized copy on every hit).
+
+  - size-aware LRU  entries are weighed in bytes (DataFrame deep memory, array
+                    nbytes, pickled size otherwise); least recently used entries
+                    are evicted once `max_bytes` is exceeded
+  - TTL             per entry (or cache default); expired entries are dropped on access
+  - disk spill      with `spill_dir`, evicted entries are pickled to a local store
+                    (itself LRU-bounded by `max_disk_bytes`) and reloaded on a hit
+  - single flight   concurrent misses on the same key compute the value once
+  - stats           hits / misses / evictions … overall and per namespace
+
+Values are shared, not copied: callers must not mutate what they get back.
+
+Configuration of the default CACHE (environment):
+    KPI_CACHE_MB       memory budget in MB (default 512)
+    KPI_CACHE_TTL      default TTL in seconds (default: none)
+    KPI_CACHE_DIR      spill directory (default: no spill)
+    KPI_CACHE_DISK_MB  disk budget in MB (default 2048)
+"""
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+MB = 1 << 20
+
+
+def sizeof(obj, _seen: Optional[set] = None) -> int:
+    """Approximate memory held by obj, in bytes."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, "sum") else usage)
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(sizeof(k, _seen) + sizeof(v, _seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(sizeof(v, _seen) for v in obj)
+    try:
+        return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(obj)
+
+
+def _digest(key: Hashable) -> str:
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def _content_digest(values) -> str:
+    """Digest of unhashable arguments by content (a DataFrame's repr is truncated, its pickle is not)."""
+    try:
+        data = pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        raise TypeError("Argument non hachable et non sérialisable : préfixez-le par '_' "
+                        "et passez une clé de version (ex. data_version(df))")
+    return hashlib.sha1(data).hexdigest()
+
+
+class Cache:
+    """Thread-safe size-aware LRU with TTLs and optional disk spill."""
+
+    def __init__(self, max_bytes: int = 512 * MB, ttl: Optional[float] = None,
+                 spill_dir: Optional[str] = None, max_disk_bytes: int = 2048 * MB,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_bytes, self.ttl, self.max_disk_bytes = max_bytes, ttl, max_disk_bytes
+        self.clock = clock
+        self._mem:  "OrderedDict[Hashable, Tuple[object, int, Optional[float]]]" = OrderedDict()
+        self._disk: "OrderedDict[Hashable, Tuple[str, int, Optional[float]]]" = OrderedDict()
+        self._bytes = self._disk_bytes = 0
+        self._lock = threading.RLock()
+        self._inflight: Dict[Hashable, threading.Lock] = {}
+        self._counts = {k: 0 for k in ("hits", "misses", "disk_hits", "evictions", "expired", "spilled")}
+        self._by_ns: Dict[str, Dict[str, int]] = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self.spill_dir = None
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self.spill_dir = tempfile.mkdtemp(prefix="kpi_cache_", dir=spill_dir)
+            weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+
+    # ── Lookup / insert ───────────────────────────────────────────────────────
+    def _expired(self, expires: Optional[float]) -> bool:
+        return expires is not None and self.clock() >= expires
+
+    def _lookup(self, key: Hashable, count: bool = True) -> Tuple[bool, object]:
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                if self._expired(entry[2]):
+                    self._drop(key)
+                    self._counts["expired"] += 1
+                else:
+                    self._mem.move_to_end(key)
+                    self._count(key, "hits", count)
+                    return True, entry[0]
+            spilled = self._disk.pop(key, None)
+            if spilled is not None:
+                path, size, expires = spilled
+                self._disk_bytes -= size
+                if not self._expired(expires):
+                    with open(path, "rb") as f:
+                        value = pickle.load(f)
+                    value_size = sizeof(value)
+                    if value_size > self.max_bytes:          # oversized: served from disk, never promoted
+                        self._disk[key] = spilled
+                        self._disk_bytes += size
+                    else:
+                        os.remove(path)
+                        self._insert(key, value, value_size, expires)
+                    self._count(key, "hits", count)
+                    self._counts["disk_hits"] += 1
+                    return True, value
+                os.remove(path)
+                self._counts["expired"] += 1
+            self._count(key, "misses", count)
+            return False, None
+
+    def _count(self, key: Hashable, what: str, count: bool) -> None:
+        if count:
+            self._counts[what] += 1
+            self._by_ns[key[0] if isinstance(key, tuple) and key else ""][what] += 1
+
+    def get(self, key: Hashable, default=None):
+        hit, value = self._lookup(key)
+        return value if hit else default
+
+    def put(self, key: Hashable, value, ttl: Optional[float] = None) -> None:
+        """Store value; an entry larger than the whole memory budget goes straight to disk (or nowhere)."""
+        ttl = self.ttl if ttl is None else ttl
+        expires = self.clock() + ttl if ttl is not None else None
+        size = sizeof(value)
+        with self._lock:
+            self._drop(key)
+            if size > self.max_bytes:
+                self._spill(key, value, size, expires)
+                return
+            self._insert(key, value, size, expires)
+
+    def _insert(self, key: Hashable, value, size: int, expires: Optional[float]) -> None:
+        self._mem[key] = (value, size, expires)
+        self._bytes += size
+        while self._bytes > self.max_bytes and len(self._mem) > 1:
+            old_key, (old_value, old_size, old_expires) = self._mem.popitem(last=False)
+            self._bytes -= old_size
+            self._counts["evictions"] += 1
+            if not self._expired(old_expires):
+                self._spill(old_key, old_value, old_size, old_expires)
+
+    def _spill(self, key: Hashable, value, size: int, expires: Optional[float]) -> None:
+        if self.spill_dir is None:
+            return
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        if len(data) > self.max_disk_bytes:
+            return
+        path = os.path.join(self.spill_dir, _digest(key) + ".pkl")
+        with open(path, "wb") as f:
+            f.write(data)
+        self._disk[key] = (path, len(data), expires)
+        self._disk_bytes += len(data)
+        self._counts["spilled"] += 1
+        while self._disk_bytes > self.max_disk_bytes:
+            _, (old_path, old_size, _) = self._disk.popitem(last=False)
+            self._disk_bytes -= old_size
+            os.remove(old_path)
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._mem.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        spilled = self._disk.pop(key, None)
+        if spilled is not None:
+            self._disk_bytes -= spilled[1]
+            os.remove(spilled[0])
+
+    def invalidate(self, namespace: Optional[str] = None) -> None:
+        """Drop every entry (of one namespace), in memory and on disk."""
+        with self._lock:
+            for key in [k for k in list(self._mem) + list(self._disk)
+                        if namespace is None or (isinstance(k, tuple) and k and k[0] == namespace)]:
+                self._drop(key)
+
+    clear = invalidate
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], object], ttl: Optional[float] = None):
+        """Cached value of key, computing it once even when several threads miss at the same time."""
+        hit, value = self._lookup(key, count=False)
+        if hit:
+            self._count(key, "hits", True)
+            return value
+        with self._lock:
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                hit, value = self._lookup(key)
+                if not hit:
+                    value = compute()
+                    self.put(key, value, ttl)
+                return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    # ── Decorator ─────────────────────────────────────────────────────────────
+    def memoize(self, ttl: Optional[float] = None, namespace: Optional[str] = None) -> Callable:
+        """
+        Cache a function's results, keyed by its arguments. As with st.cache_data,
+        parameters whose name starts with "_" are not part of the key. Unhashable
+        arguments (lists, frames) are keyed by their pickled content.
+        """
+        def decorator(fn: Callable) -> Callable:
+            ns  = namespace or f"{fn.__module__}.{fn.__qualname__}"
+            sig = inspect.signature(fn)
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                bound = sig.bind(*args, **kwargs)
+                bound.apply_defaults()
+                key = (ns,) + tuple(v for k, v in bound.arguments.items() if not k.startswith("_"))
+                try:
+                    hash(key)
+                except TypeError:
+                    key = (ns, _content_digest(key[1:]))
+                return self.get_or_compute(key, lambda: fn(*args, **kwargs), ttl)
+
+            wrapper.clear = lambda: self.invalidate(ns)
+            return wrapper
+        return decorator
+
+    # ── Stats ────────────────────────────────────────────────────────────────
+    def stats(self) -> Dict:
+        """Counters since start plus current occupancy; per_namespace = hits / misses of each function."""
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["misses"]
+            return {
+                **self._counts,
+                "hit_rate":       self._counts["hits"] / lookups if lookups else 0.0,
+                "entries":        len(self._mem),
+                "bytes":          self._bytes,
+                "max_bytes":      self.max_bytes,
+                "disk_entries":   len(self._disk),
+                "disk_bytes":     self._disk_bytes,
+                "per_namespace":  {ns: dict(c) for ns, c in self._by_ns.items()},
+            }
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+CACHE = Cache(max_bytes=int((_env_float("KPI_CACHE_MB") or 512) * MB),
+              ttl=_env_float("KPI_CACHE_TTL"),
+              spill_dir=os.environ.get("KPI_CACHE_DIR") or None,
+              max_disk_bytes=int((_env_float("KPI_CACHE_DISK_MB") or 2048) * MB))
+memoize = CACHE.memoize
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import data_generator as dg
+    import score_engine as se
+
+    parser = argparse.ArgumentParser(description="Simulate many dashboard users sharing one cache budget.")
+    parser.add_argument("--users",     type=int, default=100)
+    parser.add_argument("--sites",     type=int, default=40)
+    parser.add_argument("--budget-mb", type=float, default=2.0)
+    parser.add_argument("--spill",     default=None, help="spill directory")
+    args = parser.parse_args()
+
+    cache = Cache(int(args.budget_mb * MB), spill_dir=args.spill)
+    data  = dg.generate_multisite_data(args.sites)
+    sites = {s: g.reset_index(drop=True) for s, g in data.groupby(dg.SITE_COL, sort=False)}
+
+    @cache.memoize()
+    def site_scores(site):
+        return se.score_history(sites[site])
+
+    rng = np.random.default_rng(0)
+    t0  = time.perf_counter()
+    for _ in range(args.users * 10):                  # each user opens ~10 pages, popular sites first
+        site_scores(f"Site {min(int(rng.zipf(1.5)), args.sites):02d}")
+    s = cache.stats()
+    print(f"{time.perf_counter() - t0:.2f}s · hit rate {s['hit_rate']:.0%} · {s['entries']} en mémoire "
+          f"({s['bytes'] / MB:.2f} / {s['max_bytes'] / MB:.2f} Mo) · évictions {s['evictions']} · "
+          f"disque {s['disk_entries']} ({s['disk_hits']} relectures)")
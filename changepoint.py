@@ -0,0 +1,182 @@
+"""
+changepoint.py
+Level-shift (change-point) detection for KPI series — what z-scores miss:
+a permanent jump (e.g. energy after new equipment) rather than a single outlier.
+
+PELT (Killick et al., 2012) with a Gaussian mean-shift cost computed in O(1) per
+segment from cumulative sums, and a BIC-style penalty scaled by a robust noise
+estimate. Pruning keeps the candidate set small, so a series costs close to O(n).
+Sites are processed in parallel.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import parallel
+from data_generator import SITE_COL
+from forecaster import KPI_COLS, infer_frequency
+
+
+PENALTY_FACTOR   = 3.0     # × σ² · log(n); 2 is plain BIC, higher = fewer, surer breaks
+MIN_SEGMENT      = {"D": 14, "W": 4, "M": 3, "Q": 2, "Y": 2}
+REGIME_MIN_SIGMA = 2.0     # shifts smaller than this (in noise σ) do not reset a train window
+
+
+def noise_scale(x: np.ndarray) -> float:
+    """Robust σ of the noise: MAD of first differences / √2 (insensitive to the shifts themselves)."""
+    d = np.diff(x[~np.isnan(x)])
+    if len(d) == 0:
+        return 0.0
+    return float(1.4826 * np.median(np.abs(d - np.median(d))) / np.sqrt(2))
+
+
+def pelt(x: np.ndarray, penalty: Optional[float] = None, min_size: int = 2) -> List[int]:
+    """
+    Indices where a new regime starts (sorted, excluding 0).
+    Cost of a segment = within-segment sum of squares; penalty defaults to
+    PENALTY_FACTOR · σ² · log(n).
+    """
+    x = np.asarray(x, dtype=float)
+    x = np.where(np.isnan(x), np.nanmean(x) if np.isfinite(x).any() else 0.0, x)
+    n = len(x)
+    if n < 2 * min_size:
+        return []
+    if penalty is None:
+        sigma = noise_scale(x)
+        if sigma == 0:
+            sigma = x.std() or 1.0
+        penalty = PENALTY_FACTOR * sigma ** 2 * np.log(n)
+
+    s1 = np.concatenate([[0.0], np.cumsum(x)])
+    s2 = np.concatenate([[0.0], np.cumsum(x * x)])
+
+    def cost(starts: np.ndarray, end: int) -> np.ndarray:
+        m = end - starts
+        return s2[end] - s2[starts] - (s1[end] - s1[starts]) ** 2 / m
+
+    F    = np.full(n + 1, np.inf)
+    F[0] = -penalty
+    last = np.zeros(n + 1, dtype=int)
+    candidates = np.array([0])
+    for t in range(min_size, n + 1):
+        # s = t - min_size becomes admissible once the segment before it is long enough
+        s_new = t - min_size
+        if s_new >= min_size:
+            candidates = np.append(candidates, s_new)
+        total = F[candidates] + cost(candidates, t)
+        best  = total.argmin()
+        F[t]  = total[best] + penalty
+        last[t] = candidates[best]
+        candidates = candidates[total <= F[t]]           # PELT pruning
+
+    breaks, t = [], n
+    while t > 0:
+        t = last[t]
+        if t > 0:
+            breaks.append(int(t))
+    return sorted(breaks)
+
+
+def segments(x: np.ndarray, breaks: List[int]) -> List[Dict]:
+    """[{start, end, mean}] of the regimes delimited by breaks (end exclusive)."""
+    bounds = [0] + list(breaks) + [len(x)]
+    return [{"start": a, "end": b, "mean": float(np.nanmean(x[a:b]))} for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+# ── Per-site detection (module-level so it can run in worker processes) ─────
+def _site_shifts(site, site_df: pd.DataFrame, kpis: List[str], min_size: int,
+                 penalty_factor: float) -> List[Dict]:
+    site_df = site_df.reset_index(drop=True)
+    records = []
+    for kpi in kpis:
+        x     = site_df[kpi].to_numpy(dtype=float)
+        sigma = noise_scale(x) or float(np.nanstd(x)) or 1.0
+        pen   = penalty_factor * sigma ** 2 * np.log(max(len(x), 2))
+        regs  = segments(x, pelt(x, pen, min_size))
+        for before, after in zip(regs[:-1], regs[1:]):
+            shift = after["mean"] - before["mean"]
+            records.append({
+                "site":        site,
+                "kpi":         kpi,
+                "index":       after["start"],
+                "mois_label":  site_df["mois_label"].iloc[after["start"]],
+                "before":      before["mean"],
+                "after":       after["mean"],
+                "shift_pct":   shift / abs(before["mean"]) * 100 if before["mean"] else 0.0,
+                "shift_sigma": shift / sigma,
+                "regime_end":  after["end"],
+            })
+    return records
+
+
+def _run_task(args) -> List[Dict]:
+    return _site_shifts(*args)
+
+
+def detect_level_shifts(df: pd.DataFrame, kpis: Optional[List[str]] = None, min_size: Optional[int] = None,
+                        penalty_factor: float = PENALTY_FACTOR, n_jobs: Optional[int] = None,
+                        site_col: str = SITE_COL) -> pd.DataFrame:
+    """
+    Change points of every KPI of every site. One row per break:
+    site, kpi, index (first period of the new regime, per-site position), mois_label,
+    before / after (regime means), shift_pct, shift_sigma (shift in noise σ), regime_end.
+    n_jobs > 1 spreads sites over worker processes (parallel.map_tasks).
+    """
+    kpis   = [k for k in (kpis or KPI_COLS) if k in df.columns]
+    groups = parallel.site_groups(df, site_col)
+    if min_size is None:
+        min_size = MIN_SEGMENT.get(infer_frequency(groups[0][1]), 3) if len(df) > 1 else 2
+    tasks = [(site, g, kpis, min_size, penalty_factor) for site, g in groups]
+
+    results = parallel.map_tasks(_run_task, tasks, n_jobs)
+    columns = ["site", "kpi", "index", "mois_label", "before", "after", "shift_pct", "shift_sigma", "regime_end"]
+    return pd.DataFrame([r for site_records in results for r in site_records], columns=columns)
+
+
+def _current_regime(rows: pd.DataFrame, min_sigma: float) -> Optional[int]:
+    """
+    Start of the current regime from one KPI's breaks (sorted by index), skipping
+    breaks smaller than min_sigma and excursions that came back to the level they left.
+    """
+    i = len(rows) - 1
+    while i >= 0:
+        r = rows.iloc[i]
+        if abs(r["shift_sigma"]) < min_sigma:
+            i -= 1
+            continue
+        sigma = abs((r["after"] - r["before"]) / r["shift_sigma"])
+        if i >= 1 and abs(rows.iloc[i - 1]["shift_sigma"]) >= min_sigma \
+                and abs(r["after"] - rows.iloc[i - 1]["before"]) < min_sigma * sigma:
+            i -= 2                                        # temporary excursion, not a new regime
+            continue
+        return int(r["index"])
+    return None
+
+
+def regime_starts(shifts: pd.DataFrame, site=None, min_sigma: float = REGIME_MIN_SIGMA) -> Dict[str, int]:
+    """
+    {kpi: first period of its current regime} for one site, counting only lasting
+    shifts of at least min_sigma noise σ. Used as forecaster.forecast_all_kpis(train_start=...).
+    """
+    if shifts.empty:
+        return {}
+    rows   = shifts if site is None else shifts[shifts["site"] == site]
+    starts = {kpi: _current_regime(g.sort_values("index"), min_sigma) for kpi, g in rows.groupby("kpi")}
+    return {kpi: start for kpi, start in starts.items() if start is not None}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import data_generator as dg
+
+    parser = argparse.ArgumentParser(description="Detect level shifts in every KPI of every site.")
+    parser.add_argument("--sites",   type=int, default=5)
+    parser.add_argument("--daily",   action="store_true", help="use the daily CSV export instead")
+    parser.add_argument("--penalty", type=float, default=PENALTY_FACTOR)
+    parser.add_argument("--jobs",    type=int, default=1)
+    args = parser.parse_args()
+
+    data = dg.load_daily_csv() if args.daily else dg.generate_multisite_data(args.sites)
+    print(detect_level_shifts(data, penalty_factor=args.penalty, n_jobs=args.jobs).to_string(index=False))
@@ -0,0 +1,317 @@
+"""
+charts.py
+Plotly figure builders for the dashboard views.
+Long histories are downsampled server-side (LTTB for lines, max-|z| bins for
+the heatmap) so the JSON sent to the browser stays bounded as data grows.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import plotly.graph_objects as go
+
+
+PLOT_CFG = {"displayModeBar": False, "staticPlot": False}
+PLOT_BG  = dict(paper_bgcolor="rgba(0,0,0,0)", plot_bgcolor="rgba(0,0,0,0)")
+
+# ── Payload budgets ───────────────────────────────────────────────────────────
+MAX_LINE_POINTS    = 400    # per trace, after LTTB
+MAX_HEATMAP_COLS   = 120    # period bins in the z-score heatmap
+MAX_HEATMAP_LABELS = 40     # cell text only when the grid is small enough to read
+
+
+def light_axis():
+    return dict(
+        xaxis=dict(showgrid=False, tickfont=dict(color="#9ca3af", size=9), tickangle=-30),
+        yaxis=dict(gridcolor="#f0f0f4", tickfont=dict(color="#9ca3af", size=9)),
+    )
+
+
+# ── Downsampling ──────────────────────────────────────────────────────────────
+def lttb_indices(y: np.ndarray, n_out: int = MAX_LINE_POINTS) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of n_out points that keep the visual
+    shape of y (first and last points always kept). Returns all indices if short enough.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        if i + 2 < len(edges):
+            nlo, nhi = edges[i + 1], max(edges[i + 2], edges[i + 1] + 1)
+            avg_x, avg_y = x[nlo:nhi].mean(), np.nanmean(y[nlo:nhi])
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.nanargmax(area)) if np.isfinite(area).any() else lo
+        keep[i + 1] = a
+    return keep
+
+
+def shared_indices(series: Sequence[np.ndarray], n_out: int = MAX_LINE_POINTS,
+                   always: Sequence[int] = ()) -> np.ndarray:
+    """
+    Union of the LTTB points of several traces drawn on the same categorical axis,
+    so every trace uses the same x labels (and their order is preserved).
+    """
+    idx = set(always)
+    for y in series:
+        idx.update(lttb_indices(y, n_out).tolist())
+    return np.array(sorted(i for i in idx if 0 <= i < len(series[0])))
+
+
+def bin_signed_max(z: np.ndarray, max_cols: int = MAX_HEATMAP_COLS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Aggregate a (n_rows, n_cols) matrix into at most max_cols column bins, keeping
+    the value with the largest |z| in each bin (sign preserved).
+    Returns (binned matrix, start column of each bin).
+    """
+    n_cols = z.shape[1]
+    if n_cols <= max_cols:
+        return z, np.arange(n_cols)
+    starts = np.linspace(0, n_cols, max_cols + 1).astype(int)[:-1]
+    absz = np.nan_to_num(np.abs(z), nan=-1.0)
+    out = np.empty((z.shape[0], len(starts)))
+    for j, (lo, hi) in enumerate(zip(starts, np.append(starts[1:], n_cols))):
+        pick = lo + np.argmax(absz[:, lo:hi], axis=1)
+        out[:, j] = z[np.arange(z.shape[0]), pick]
+    return out, starts
+
+
+# ── Figures ───────────────────────────────────────────────────────────────────
+def gauge_figure(score: int) -> go.Figure:
+    fig = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=score,
+        domain={"x":[0,1],"y":[0,1]},
+        number={"font":{"size":46,"family":"Plus Jakarta Sans","color":"white"}},
+        gauge={
+            "axis":{"range":[0,100],"visible":False},
+            "bar":{"color":"rgba(255,255,255,0.9)","thickness":0.18},
+            "bgcolor":"rgba(255,255,255,0.1)",
+            "borderwidth":0,
+            "steps":[
+                {"range":[0,40],  "color":"rgba(255,255,255,0.15)"},
+                {"range":[40,65], "color":"rgba(255,255,255,0.15)"},
+                {"range":[65,80], "color":"rgba(255,255,255,0.15)"},
+                {"range":[80,100],"color":"rgba(255,255,255,0.15)"},
+            ],
+            "threshold":{"line":{"color":"white","width":3},"thickness":0.85,"value":score},
+        }
+    ))
+    fig.update_layout(**PLOT_BG, height=150, margin=dict(l=10,r=10,t=10,b=0))
+    return fig
+
+
+def contribution_waterfall(previous_score: float, contributions: Dict[str, float],
+                           labels: Dict[str, str]) -> go.Figure:
+    """Previous score → one bar per KPI contribution (incl. rounding) → current score."""
+    names  = [labels.get(k, k) for k in contributions]
+    values = [round(float(v), 2) for v in contributions.values()]
+    fig = go.Figure(go.Waterfall(
+        x=["Préc."] + names + ["Actuel"],
+        y=[previous_score] + values + [0],
+        measure=["absolute"] + ["relative"] * len(values) + ["total"],
+        increasing={"marker": {"color": "#16a34a"}},
+        decreasing={"marker": {"color": "#dc2626"}},
+        totals={"marker": {"color": "#5b4fcf"}},
+        connector={"line": {"color": "#e5e9f2", "width": 1}},
+        hovertemplate="%{x} : %{y:+.1f}<extra></extra>",
+    ))
+    fig.update_layout(**PLOT_BG, height=190, margin=dict(l=0, r=0, t=6, b=0),
+                      showlegend=False, **light_axis())
+    fig.update_yaxes(range=[max(0, min(previous_score, previous_score + sum(values)) - 15), None])
+    return fig
+
+
+def trend_figure(labels: List[str], traces: Dict[str, Tuple[np.ndarray, str, str]],
+                 selected: Optional[str] = None) -> go.Figure:
+    """
+    All KPIs normalised 0–100 on the same axis.
+    traces: { kpi: (values, color, short label) }; the selected period is always kept.
+    """
+    always = [labels.index(selected)] if selected in labels else []
+    idx = shared_indices([v for v, _, _ in traces.values()], always=always)
+    x = [labels[i] for i in idx]
+
+    fig = go.Figure()
+    for kpi, (vals, color, label) in traces.items():
+        vals = np.asarray(vals, dtype=float)
+        norm = (vals - np.nanmin(vals)) / (np.nanmax(vals) - np.nanmin(vals) + 1e-9) * 100
+        fig.add_trace(go.Scatter(
+            x=x, y=norm[idx],
+            mode="lines", name=label,
+            line=dict(color=color, width=2),
+            hovertemplate=f"<b>{label}</b>: %{{customdata:.1f}}<extra></extra>",
+            customdata=vals[idx],
+        ))
+    if selected is not None:
+        fig.add_shape(type="line", x0=selected, x1=selected, y0=0, y1=100,
+                      line=dict(color="#5b4fcf", width=1.5, dash="dot"))
+    fig.update_layout(
+        **PLOT_BG,
+        height=170, margin=dict(l=0,r=0,t=4,b=0),
+        **light_axis(),
+        legend=dict(orientation="h", y=1.15, font=dict(size=10,color="#6b7280"),
+                    bgcolor="rgba(0,0,0,0)"),
+        hovermode="x unified",
+    )
+    return fig
+
+
+def score_forecast_figure(labels: List[str], hist_scores: Sequence[float], score_fc: List[Dict],
+                          compact: bool = False) -> go.Figure:
+    """Historical global score + forecast with its confidence band (compact = last 8 periods)."""
+    hist_scores = list(hist_scores)
+    fc_x = [labels[-1]] + [s["month"] for s in score_fc]
+    fc_y = [hist_scores[-1]] + [s["score"] for s in score_fc]
+    fc_u = [hist_scores[-1]] + [s["upper"] for s in score_fc]
+    fc_l = [hist_scores[-1]] + [s["lower"] for s in score_fc]
+
+    fig = go.Figure()
+    if compact:
+        fig.add_trace(go.Scatter(
+            x=labels[-8:], y=hist_scores[-8:],
+            mode="lines+markers", line=dict(color="#5b4fcf",width=2.5),
+            marker=dict(size=5,color="#5b4fcf"), showlegend=False,
+        ))
+        fig.add_trace(go.Scatter(
+            x=fc_x, y=fc_y,
+            mode="lines+markers", line=dict(color="#ef4444",width=2,dash="dot"),
+            marker=dict(size=7,symbol="diamond",color="#ef4444"), showlegend=False,
+        ))
+        fig.add_trace(go.Scatter(
+            x=fc_x+fc_x[::-1], y=fc_u+fc_l[::-1],
+            fill="toself", fillcolor="rgba(239,68,68,0.07)",
+            line=dict(color="rgba(0,0,0,0)"), showlegend=False, hoverinfo="skip",
+        ))
+        fig.add_hline(y=55, line_dash="dash", line_color="rgba(239,68,68,0.35)")
+        fig.update_layout(**PLOT_BG, height=145, margin=dict(l=0,r=0,t=4,b=0), **light_axis())
+        return fig
+
+    idx = lttb_indices(np.asarray(hist_scores, dtype=float))
+    many = len(idx) > 60
+    fig.add_trace(go.Scatter(x=[labels[i] for i in idx], y=[hist_scores[i] for i in idx],
+        mode="lines" if many else "lines+markers", name="Historique",
+        line=dict(color="#5b4fcf",width=2.5), marker=dict(size=6,color="#5b4fcf"),
+        fill="tozeroy", fillcolor="rgba(91,79,207,0.05)"))
+    fig.add_trace(go.Scatter(x=fc_x+fc_x[::-1], y=fc_u+fc_l[::-1],
+        fill="toself", fillcolor="rgba(239,68,68,0.08)",
+        line=dict(color="rgba(0,0,0,0)"), showlegend=False, hoverinfo="skip"))
+    fig.add_trace(go.Scatter(x=fc_x, y=fc_y,
+        mode="lines+markers", name="Prévision",
+        line=dict(color="#ef4444",width=2.5,dash="dot"),
+        marker=dict(size=9,symbol="diamond",color="#ef4444")))
+    fig.add_hline(y=55, line_dash="dash", line_color="rgba(239,68,68,0.4)",
+                  annotation_text="Seuil critique", annotation_font_color="#ef4444",annotation_font_size=11)
+    fig.update_layout(**PLOT_BG, height=280, margin=dict(l=0,r=0,t=10,b=0),
+                      **light_axis(),
+                      legend=dict(font=dict(size=11,color="#6b7280"),bgcolor="rgba(0,0,0,0)"))
+    return fig
+
+
+def kpi_forecast_figure(labels: List[str], hist: Sequence[float], fc_labels: List[str],
+                        forecast: Sequence[float], title: str, method: str, color: str) -> go.Figure:
+    hist = np.asarray(hist, dtype=float)
+    idx  = lttb_indices(hist)
+    x_fc = [labels[-1]] + list(fc_labels)
+    y_fc = [float(hist[-1])] + list(forecast)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=[labels[i] for i in idx], y=hist[idx], mode="lines",
+        line=dict(color=color,width=2), showlegend=False))
+    fig.add_trace(go.Scatter(x=x_fc, y=y_fc, mode="lines+markers",
+        line=dict(color="#ef4444",width=2,dash="dot"),
+        marker=dict(size=7,symbol="diamond",color="#ef4444"), showlegend=False))
+    fig.update_layout(**PLOT_BG, height=160,
+        title=dict(text=f"{title} <span style='font-size:10px;color:#9ca3af;'>· {method}</span>",
+                   font=dict(size=12,color="#374151")),
+        margin=dict(l=0,r=0,t=36,b=0), **light_axis())
+    return fig
+
+
+def zscore_heatmap(z: np.ndarray, row_labels: List[str], period_labels: List[str]) -> go.Figure:
+    """KPI × period z-score heatmap; wide histories are binned to the largest |z| per bin."""
+    zb, starts = bin_signed_max(np.asarray(z, dtype=float))
+    x = [period_labels[i] for i in starts]
+    show_text = zb.shape[1] <= MAX_HEATMAP_LABELS
+
+    fig = go.Figure(go.Heatmap(
+        z=zb, x=x, y=row_labels,
+        colorscale=[[0,"#3730a3"],[0.35,"#818cf8"],[0.5,"#f8fafc"],
+                    [0.65,"#fb923c"],[1,"#dc2626"]],
+        zmid=0,
+        colorbar=dict(tickfont=dict(color="#6b7280",size=10),thickness=10),
+        text=np.round(zb, 1) if show_text else None,
+        texttemplate="%{text}" if show_text else None,
+        textfont=dict(size=9),
+        hovertemplate=("<b>%{y}</b> | %{x}<br>Z: %{z:.2f}<extra></extra>" if len(starts) == z.shape[1]
+                       else "<b>%{y}</b> | à partir de %{x}<br>max |Z|: %{z:.2f}<extra></extra>"),
+    ))
+    fig.update_layout(**PLOT_BG, height=240, margin=dict(l=0,r=0,t=4,b=0),
+        xaxis=dict(showgrid=False, tickfont=dict(color="#9ca3af",size=9), tickangle=-35),
+        yaxis=dict(tickfont=dict(color="#374151",size=10)))
+    return fig
+
+
+def tile_heatmap(z: np.ndarray, row_labels: List[str], bucket_labels: List[str],
+                 cell_kpis: Optional[np.ndarray] = None, height: Optional[int] = None) -> go.Figure:
+    """
+    Heatmap of one pre-binned tile (heatmap_tiles). With cell_kpis (KPI behind each
+    cell), hover and clicks go through an invisible marker per cell: heatmap traces
+    cannot be selected, so this is what reports the clicked row to on_select.
+    """
+    z = np.asarray(z, dtype=float)
+    show_text = z.shape[1] <= MAX_HEATMAP_LABELS and z.shape[0] <= MAX_HEATMAP_LABELS
+    fig = go.Figure(go.Heatmap(
+        z=z, x=bucket_labels, y=row_labels,
+        colorscale=[[0,"#3730a3"],[0.35,"#818cf8"],[0.5,"#f8fafc"],
+                    [0.65,"#fb923c"],[1,"#dc2626"]],
+        zmid=0,
+        colorbar=dict(tickfont=dict(color="#6b7280",size=10),thickness=10),
+        text=np.round(z, 1) if show_text else None,
+        texttemplate="%{text}" if show_text else None,
+        textfont=dict(size=9),
+        hoverinfo="skip" if cell_kpis is not None else None,
+        hovertemplate=None if cell_kpis is not None else "<b>%{y}</b> | %{x}<br>Z: %{z:.2f}<extra></extra>",
+    ))
+    if cell_kpis is not None:
+        rows, cols = np.indices(z.shape)
+        fig.add_trace(go.Scatter(
+            x=np.asarray(bucket_labels, dtype=object)[cols.ravel()],
+            y=np.asarray(row_labels, dtype=object)[rows.ravel()],
+            mode="markers", marker=dict(size=12, opacity=0), showlegend=False,
+            selected=dict(marker=dict(opacity=0)), unselected=dict(marker=dict(opacity=0)),
+            customdata=np.column_stack([np.asarray(cell_kpis, dtype=object).ravel(), z.ravel()]),
+            hovertemplate="<b>%{y}</b> | %{x}<br>KPI : %{customdata[0]}<br>Z: %{customdata[1]:.2f}<extra></extra>",
+        ))
+    fig.update_layout(**PLOT_BG, height=height or max(240, 18 * len(row_labels) + 60),
+        margin=dict(l=0,r=0,t=4,b=0),
+        xaxis=dict(showgrid=False, showticklabels=len(bucket_labels) <= MAX_HEATMAP_LABELS,
+                   tickfont=dict(color="#9ca3af",size=9), tickangle=-35),
+        yaxis=dict(tickfont=dict(color="#374151",size=10), autorange="reversed"))
+    return fig
+
+
+def ccf_heatmap(ccf: np.ndarray, row_labels: List[str], lags: Sequence[int], height: int = 300) -> go.Figure:
+    """Rows (KPI pairs or sites) × lag cross-correlation heatmap, fixed -1..1 scale."""
+    fig = go.Figure(go.Heatmap(
+        z=ccf, x=list(lags), y=row_labels,
+        colorscale=[[0,"#3730a3"],[0.35,"#818cf8"],[0.5,"#f8fafc"],
+                    [0.65,"#fb923c"],[1,"#dc2626"]],
+        zmin=-1, zmax=1,
+        colorbar=dict(tickfont=dict(color="#6b7280",size=10),thickness=10),
+        hovertemplate="<b>%{y}</b><br>décalage %{x:+d} · r = %{z:.2f}<extra></extra>",
+    ))
+    fig.update_layout(**PLOT_BG, height=height, margin=dict(l=0,r=0,t=4,b=0),
+        xaxis=dict(showgrid=False, tickfont=dict(color="#9ca3af",size=9),
+                   title=dict(text="Décalage (périodes)", font=dict(size=10,color="#9ca3af"))),
+        yaxis=dict(tickfont=dict(color="#374151",size=10), autorange="reversed"))
+    return fig
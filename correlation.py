@@ -0,0 +1,165 @@
+"""
+correlation.py
+Lead / lag relations between KPIs: cross-correlation of every KPI pair at every
+lag in [-max_lag, +max_lag], for every site at once.
+Computed with FFTs (O(n log n) per series) instead of one dot product per lag
+(O(n · lags)); all sites are zero-padded into one (site × time × KPI) array.
+
+ccf[s, i, j, lag] = corr(x_i[t], x_j[t + lag]) on site s
+    lag > 0 → KPI i leads KPI j by `lag` periods
+"""
+from itertools import combinations
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from anomaly_detector import KPI_LABELS, available_features
+from data_generator import SITE_COL
+from forecaster import infer_frequency
+
+
+# ── Default lag window per data frequency ────────────────────────────────────
+DEFAULT_MAX_LAG = {"D": 30, "W": 12, "M": 6, "Q": 4, "Y": 2}
+CHUNK_BYTES     = 64 * 2**20       # cross-spectrum memory per batch of sites
+
+
+def _fft_size(n: int) -> int:
+    """Smallest power of two ≥ n (no circular wrap-around for lags < n)."""
+    return 1 << max(n - 1, 0).bit_length()
+
+
+class CrossCorrelation:
+    """
+    Cross-correlation functions of all KPI pairs for all sites.
+      ccf     (S, K, K, 2L+1)   lags -L..L along the last axis
+      n_obs   (S,)              periods used per site
+    """
+
+    def __init__(self, df: pd.DataFrame, max_lag: Optional[int] = None,
+                 diff: bool = True, site_col: str = SITE_COL):
+        """
+        diff: correlate period-to-period changes rather than levels, so shared
+              trends do not show up as correlation at every lag.
+        """
+        self.kpis = available_features(df)
+        groups = (list(df.groupby(site_col, sort=False)) if site_col in df.columns
+                  else [("", df)])
+        self.sites = [s for s, _ in groups]
+
+        series = [g[self.kpis].to_numpy(dtype=float) for _, g in groups]
+        if diff:
+            series = [np.diff(x, axis=0) for x in series]
+        self.n_obs = np.array([len(x) for x in series])
+        T = int(self.n_obs.max()) if len(series) else 0
+
+        if max_lag is None:
+            max_lag = DEFAULT_MAX_LAG.get(infer_frequency(groups[0][1]), 6) if len(df) > 1 else 0
+        self.max_lag = int(max(0, min(max_lag, T - 1)))
+        self.lags = np.arange(-self.max_lag, self.max_lag + 1)
+
+        # Standardise each (site, KPI) series; NaN → 0 after centring (drops out of the sums)
+        Z = np.zeros((len(series), T, len(self.kpis)))
+        for s, x in enumerate(series):
+            mu  = np.nanmean(x, axis=0) if len(x) else 0.0
+            std = np.nanstd(x, axis=0) if len(x) else 1.0
+            Z[s, :len(x)] = np.nan_to_num((x - mu) / np.where(std > 0, std, np.inf))
+
+        self.ccf = self._ccf(Z, self.n_obs, self.max_lag)
+
+    @staticmethod
+    def _ccf(Z: np.ndarray, n_obs: np.ndarray, max_lag: int) -> np.ndarray:
+        """Σ_t z_i[t] · z_j[t+lag] / n for all sites and pairs, via batched FFTs."""
+        S, T, K = Z.shape
+        nfft = _fft_size(T + max_lag)
+        idx  = np.arange(-max_lag, max_lag + 1) % nfft
+        out  = np.empty((S, K, K, len(idx)))
+        # Sites in chunks so the (sites × freqs × K × K) cross-spectrum stays bounded
+        chunk = max(1, CHUNK_BYTES // ((nfft // 2 + 1) * K * K * 16))
+        for lo in range(0, S, chunk):
+            F    = np.fft.rfft(Z[lo:lo + chunk], n=nfft, axis=1)       # (s, F, K)
+            spec = np.conj(F)[:, :, :, None] * F[:, :, None, :]        # (s, F, K, K)
+            full = np.fft.irfft(spec, n=nfft, axis=1)                  # (s, nfft, K, K)
+            out[lo:lo + chunk] = np.moveaxis(full[:, idx], 1, -1)
+        return out / np.maximum(n_obs, 1)[:, None, None, None]
+
+    # ── Queries ───────────────────────────────────────────────────────────────
+    def pairs(self) -> List[tuple]:
+        """Every unordered KPI pair (i < j)."""
+        return list(combinations(self.kpis, 2))
+
+    def pair_label(self, a: str, b: str) -> str:
+        return f"{KPI_LABELS.get(a, a)} ↔ {KPI_LABELS.get(b, b)}"
+
+    def matrix(self, site=None) -> pd.DataFrame:
+        """(pair × lag) correlations of one site (first site by default)."""
+        s = self.sites.index(site) if site is not None else 0
+        k = {c: i for i, c in enumerate(self.kpis)}
+        rows = [self.ccf[s, k[a], k[b]] for a, b in self.pairs()]
+        return pd.DataFrame(rows, index=[self.pair_label(a, b) for a, b in self.pairs()], columns=self.lags)
+
+    def pair_by_site(self, a: str, b: str) -> pd.DataFrame:
+        """(site × lag) correlations of one KPI pair."""
+        i, j = self.kpis.index(a), self.kpis.index(b)
+        return pd.DataFrame(self.ccf[:, i, j], index=self.sites, columns=self.lags)
+
+    def lead_lag(self) -> pd.DataFrame:
+        """
+        Strongest lag for every (site, pair): the lag with the largest |correlation|,
+        flagged significant above the ±1.96/√n band of uncorrelated series.
+        """
+        k   = {c: i for i, c in enumerate(self.kpis)}
+        out = []
+        for a, b in self.pairs():
+            c     = self.ccf[:, k[a], k[b]]                         # (S, 2L+1)
+            best  = np.abs(c).argmax(axis=1)
+            corr  = c[np.arange(len(self.sites)), best]
+            lag   = self.lags[best]
+            band  = 1.96 / np.sqrt(np.maximum(self.n_obs, 1))
+            for s, site in enumerate(self.sites):
+                out.append({
+                    "Site":        site,
+                    "Paire":       self.pair_label(a, b),
+                    "kpi_a":       a,
+                    "kpi_b":       b,
+                    "Décalage":    int(lag[s]),
+                    "Corrélation": float(corr[s]),
+                    "Lag 0":       float(c[s, self.max_lag]),
+                    "Significatif": bool(abs(corr[s]) > band[s]),
+                    "Sens":        _direction(a, b, int(lag[s])),
+                })
+        return pd.DataFrame(out)
+
+
+def _direction(a: str, b: str, lag: int) -> str:
+    la, lb = KPI_LABELS.get(a, a), KPI_LABELS.get(b, b)
+    if lag > 0:
+        return f"{la} précède {lb} de {lag}"
+    if lag < 0:
+        return f"{lb} précède {la} de {-lag}"
+    return "simultané"
+
+
+def cross_correlations(df: pd.DataFrame, max_lag: Optional[int] = None, diff: bool = True,
+                       site_col: str = SITE_COL) -> CrossCorrelation:
+    return CrossCorrelation(df, max_lag, diff, site_col)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import data_generator as dg
+
+    parser = argparse.ArgumentParser(description="Lead/lag cross-correlation of every KPI pair and site.")
+    parser.add_argument("--sites",   type=int, default=5)
+    parser.add_argument("--max-lag", type=int, default=None)
+    parser.add_argument("--levels",  action="store_true", help="correlate levels instead of changes")
+    parser.add_argument("--csv",     default=None, help="write the lead/lag table to this file")
+    args = parser.parse_args()
+
+    cc = cross_correlations(dg.generate_multisite_data(args.sites), args.max_lag, diff=not args.levels)
+    table = cc.lead_lag()
+    if args.csv:
+        table.to_csv(args.csv, index=False)
+    print(table[table["Significatif"]].sort_values("Corrélation", key=abs, ascending=False)
+          .head(20).to_string(index=False))
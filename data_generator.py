@@ -1,7 +1,11 @@
 """
 data_generator.py
 Generates 12 months of simulated KPI data.
+Also loads the daily KPI export (simulated_kpi_data_large.csv)
+and builds multi-site panels (one row per site × month).
 """
+import hashlib
+
 import pandas as pd
 import numpy as np
 
@@ -11,6 +15,82 @@ MONTHS = [
     "Sep 2024", "Oct 2024", "Nov 2024", "Déc 2024",
 ]
 
+MONTH_FR = {
+    1: "Jan", 2: "Fév", 3: "Mar", 4: "Avr",
+    5: "Mai", 6: "Juin", 7: "Juil", 8: "Aoû",
+    9: "Sep", 10: "Oct", 11: "Nov", 12: "Déc"
+}
+
+# ── Multi-site panels ─────────────────────────────────────────────────────────
+SITE_COL   = "site"
+REGION_COL = "region"
+REGIONS    = ["Nord", "Centre", "Sud"]
+
+# ── Column mapping for the daily CSV export ───────────────────────────────────
+DAILY_CSV_COLUMNS = {
+    "Date":                  "date",
+    "Revenue_MAD":           "chiffre_affaires",
+    "Margin_MAD":            "marge",
+    "Energy_kWh":            "energie",
+    "CO2_Emissions_kg":      "co2",
+    "Absenteeism_Pct":       "absenteisme",
+    "Customer_Satisfaction": "satisfaction",
+}
+# Source units of the export columns that differ from the dashboard (€, T)
+DAILY_CSV_UNITS = {"chiffre_affaires": "MAD", "marge": "MAD", "co2": "kg"}
+
+
+def format_period_label(ts, freq: str = "M") -> str:
+    """Human-readable label for a period start: "03 Jan 2024", "S05 2024", "Déc 2024", "T4 2024", "2024"."""
+    ts = pd.Timestamp(ts)
+    if freq == "Y":
+        return str(ts.year)
+    if freq == "Q":
+        return f"T{ts.quarter} {ts.year}"
+    if freq == "D":
+        return f"{ts.day:02d} {MONTH_FR[ts.month]} {ts.year}"
+    if freq == "W":
+        iso = ts.isocalendar()
+        return f"S{iso[1]:02d} {iso[0]}"
+    return f"{MONTH_FR[ts.month]} {ts.year}"
+
+
+def period_dates(df: pd.DataFrame) -> pd.DatetimeIndex:
+    """Period start dates, from the "date" column or parsed from "Déc 2024" labels."""
+    if "date" in df.columns:
+        return pd.DatetimeIndex(pd.to_datetime(df["date"]))
+    fr_to_num = {v: k for k, v in MONTH_FR.items()}
+    dates = []
+    for label in df["mois_label"]:
+        month_name, year = label.split(" ")
+        dates.append(pd.Timestamp(int(year), fr_to_num.get(month_name, 12), 1))
+    return pd.DatetimeIndex(dates)
+
+
+def data_version(df: pd.DataFrame) -> str:
+    """Content hash of a KPI frame: cache key that changes when the data changes."""
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=True).values.tobytes()).hexdigest()[:16]
+
+
+def load_daily_csv(path: str = "simulated_kpi_data_large.csv") -> pd.DataFrame:
+    """
+    Load the daily KPI export and rename its columns to the dashboard schema.
+    Only the KPIs present in the file are returned (no productivity column).
+    The export is cleaned by validation.validate (amounts in MAD → €, CO₂ in kg → T);
+    the list of corrections is kept in df.attrs["validation"].
+    """
+    from validation import validate          # validation imports this module
+
+    raw = pd.read_csv(path, parse_dates=["Date"])
+    df = raw.rename(columns=DAILY_CSV_COLUMNS)[list(DAILY_CSV_COLUMNS.values())]
+    df = df.sort_values("date").reset_index(drop=True)
+    df.insert(0, "mois_label", [format_period_label(d, "D") for d in df["date"]])
+    df.insert(1, "mois_idx", np.arange(len(df)))
+    df, report = validate(df, units=DAILY_CSV_UNITS, freq="D")
+    df.attrs["validation"] = report.to_dict("records")
+    return df
+
+
 def generate_monthly_data(seed: int = 42) -> pd.DataFrame:
     rng = np.random.default_rng(seed)
 
@@ -30,6 +110,7 @@ def generate_monthly_data(seed: int = 42) -> pd.DataFrame:
         records.append({
             "mois_label":      m,
             "mois_idx":        i,
+            "date":            pd.Timestamp(2024, i + 1, 1),
             "chiffre_affaires": round(ca_base * (1 + season + rng.normal(0.02, 0.03)), 0),
             "marge":            round(marge_base * (1 + season + rng.normal(0.01, 0.04)), 0),
             # Spike in energy in April & November
@@ -40,4 +121,23 @@ def generate_monthly_data(seed: int = 42) -> pd.DataFrame:
             "productivite": round(min(100, max(60, prod_base + rng.normal(0, 2))), 1),
         })
 
-    return pd.DataFrame(records)
\ No newline at end of file
+    return pd.DataFrame(records)
+
+
+def generate_multisite_data(n_sites: int = 5, seed: int = 42) -> pd.DataFrame:
+    """
+    Stack generate_monthly_data for n_sites sites of different sizes.
+    Volume KPIs (CA, marge, énergie, CO₂) are scaled per site; rows are sorted by site, then month.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = rng.lognormal(0, 0.4, n_sites)
+    frames = []
+    for i in range(n_sites):
+        site_df = generate_monthly_data(seed + i)
+        for col in ["chiffre_affaires", "marge", "co2"]:
+            site_df[col] = (site_df[col] * sizes[i]).round(1)
+        site_df["energie"] = (site_df["energie"] * sizes[i]).astype(int)
+        site_df.insert(0, SITE_COL, f"Site {i + 1:02d}")
+        site_df.insert(1, REGION_COL, REGIONS[i % len(REGIONS)])
+        frames.append(site_df)
+    return pd.concat(frames, ignore_index=True)
@@ -1,20 +1,30 @@
 """
 forecaster.py
 ARIMA-based forecasting for KPI time series.
+Long daily / weekly / monthly histories use a seasonal Fourier-term regression.
 Falls back to linear regression if statsmodels is unavailable.
 """
+import importlib.util
+import warnings
+
 import numpy as np
 import pandas as pd
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+import parallel
+import shared_arrays as sa
+from data_generator import SITE_COL, format_period_label, period_dates
+
+# statsmodels takes ~1.5 s to import: only check it is installed here, import on first ARIMA fit
+STATSMODELS_OK = importlib.util.find_spec("statsmodels") is not None
 
-try:
+
+def _arima_model():
+    """statsmodels' ARIMA class, imported on first use."""
     from statsmodels.tsa.arima.model import ARIMA
     from statsmodels.tools.sm_exceptions import ConvergenceWarning
-    import warnings
     warnings.filterwarnings("ignore", category=ConvergenceWarning)
-    STATSMODELS_OK = True
-except ImportError:
-    STATSMODELS_OK = False
+    return ARIMA
 
 
 KPI_COLS = [
@@ -33,88 +43,388 @@ ARIMA_ORDERS = {
     "productivite":     (1, 0, 1),
 }
 
+# Shortest history a KPI is fitted on when its train window is cut at a regime change
+MIN_TRAIN_POINTS = 8
+
+
+# ── Seasonal cycles per data frequency: (period length, n harmonics) ──────────
+SEASONAL_TERMS = {
+    "D": [(365.25, 4), (7, 2)],
+    "W": [(365.25 / 7, 4)],
+    "M": [(12, 2)],
+    "Q": [(4, 1)],
+}
+# A cycle is only modelled once the history covers this many periods of it
+SEASONAL_MIN_CYCLES = 1.5
+
+PERIOD_OFFSETS = {
+    "D": pd.DateOffset(days=1),
+    "W": pd.DateOffset(weeks=1),
+    "M": pd.DateOffset(months=1),
+    "Q": pd.DateOffset(months=3),
+    "Y": pd.DateOffset(years=1),
+}
+
+
+def period_index(dates, freq: str) -> np.ndarray:
+    """Whole periods elapsed since the first date (gaps kept): position on the calendar, not in the frame."""
+    dates = pd.DatetimeIndex(dates)
+    if len(dates) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if freq in ("D", "W"):
+        days = ((dates - dates.min()) // pd.Timedelta(days=1)).to_numpy(dtype=np.int64)
+        return days // 7 if freq == "W" else days
+    months = (dates.year * 12 + dates.month).to_numpy(dtype=np.int64)
+    months -= months.min()
+    return {"Q": months // 3, "Y": months // 12}.get(freq, months)
+
+
+def infer_frequency(df: pd.DataFrame) -> str:
+    """Return "D", "W", "M", "Q" or "Y" from the median spacing between periods."""
+    dates = period_dates(df)
+    if len(dates) < 2:
+        return "M"
+    step_days = np.median(np.diff(dates.values).astype("timedelta64[D]").astype(float))
+    if step_days <= 2:
+        return "D"
+    if step_days <= 10:
+        return "W"
+    if step_days <= 45:
+        return "M"
+    if step_days <= 120:
+        return "Q"
+    return "Y"
+
+
+def _seasonal_terms(freq: str, n_obs: int) -> List[Tuple[float, int]]:
+    """Seasonal cycles that the history is long enough to estimate."""
+    return [(period, k) for period, k in SEASONAL_TERMS.get(freq, [])
+            if n_obs >= period * SEASONAL_MIN_CYCLES]
+
+
+def _fourier_design(t: np.ndarray, terms: List[Tuple[float, int]]) -> np.ndarray:
+    """Design matrix: intercept, linear trend, then sin/cos pairs per harmonic."""
+    cols = [np.ones_like(t), t]
+    for period, n_harmonics in terms:
+        for h in range(1, n_harmonics + 1):
+            w = 2 * np.pi * h * t / period
+            cols += [np.sin(w), np.cos(w)]
+    return np.column_stack(cols)
+
 
-def _arima_forecast(series: np.ndarray, order: Tuple, n_periods: int) -> np.ndarray:
-    """Fit ARIMA and return n_periods future values."""
+def _fourier_forecast(series: np.ndarray, terms: List[Tuple[float, int]],
+                      n_periods: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Least-squares trend + Fourier seasonality; cost is linear in len(series).
+    series may be 2-D (one column per KPI); rows with a NaN are left out of the fit.
+    Returns (future values, coefficients).
+    """
+    t  = np.arange(len(series), dtype=float)
+    ok = np.isfinite(series) if series.ndim == 1 else np.isfinite(series).all(axis=1)
+    coef, *_ = np.linalg.lstsq(_fourier_design(t[ok], terms), series[ok], rcond=None)
+    future_t = np.arange(len(series), len(series) + n_periods, dtype=float)
+    return _fourier_design(future_t, terms) @ coef, coef
+
+
+def _arima_forecast(series: np.ndarray, order: Tuple, n_periods: int,
+                    start_params: Optional[List[float]] = None) -> Tuple[np.ndarray, Optional[List[float]]]:
+    """
+    Fit ARIMA and return (n_periods future values, fitted params).
+    start_params warm-starts the optimiser, e.g. from the fit on a neighbouring window.
+    """
     try:
-        model  = ARIMA(series, order=order)
-        fitted = model.fit()
+        model  = _arima_model()(series, order=order)
+        if start_params is not None and len(start_params) == len(model.param_names):
+            fitted = model.fit(start_params=np.asarray(start_params))
+        else:
+            fitted = model.fit()
         fc     = fitted.forecast(steps=n_periods)
-        return np.array(fc)
+        return np.array(fc), np.asarray(fitted.params).tolist()
     except Exception:
-        return _linear_forecast(series, n_periods)
+        return _linear_forecast(series, n_periods), None
 
 
 def _linear_forecast(series: np.ndarray, n_periods: int) -> np.ndarray:
     """Simple linear regression fallback."""
-    x = np.arange(len(series))
-    m, b = np.polyfit(x, series, 1)
-    future_x = np.arange(len(series), len(series) + n_periods)
-    return m * future_x + b
+    return batch_linear_forecast(series[np.newaxis, :], n_periods)[0]
+
+
+# ── Batch fallbacks (one row per series, NaN = missing period) ────────────────
+SES_ALPHAS = np.linspace(0.05, 0.95, 19)
 
 
-def forecast_all_kpis(df: pd.DataFrame, n_periods: int = 3) -> Dict[str, Dict]:
+def batch_linear_forecast(Y: np.ndarray, n_periods: int) -> np.ndarray:
     """
-    Forecast each KPI for n_periods months ahead.
-    Returns dict: { kpi_col: { "forecast": [...], "method": "ARIMA"|"Linear" } }
+    Closed-form least-squares trend for every row of Y at once.
+    Y is (n_series, n_obs) on a shared period axis; returns (n_series, n_periods).
     """
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    t = np.arange(Y.shape[1], dtype=float)
+    w = ~np.isnan(Y)
+    y = np.where(w, Y, 0.0)
+
+    n   = w.sum(axis=1)
+    st  = w @ t
+    stt = w @ (t * t)
+    sy  = y.sum(axis=1)
+    sty = y @ t
+    denom = n * stt - st ** 2
+    slope = np.divide(n * sty - st * sy, denom, out=np.zeros_like(sy), where=denom > 0)
+    intercept = (sy - slope * st) / np.maximum(n, 1)
+
+    future_t = np.arange(Y.shape[1], Y.shape[1] + n_periods, dtype=float)
+    return intercept[:, np.newaxis] + slope[:, np.newaxis] * future_t[np.newaxis, :]
+
+
+def batch_ses_forecast(Y: np.ndarray, n_periods: int, alphas: np.ndarray = SES_ALPHAS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Simple exponential smoothing for every row of Y, with the smoothing factor
+    picked per series from `alphas` by one-step-ahead squared error.
+    All candidate alphas run together: one pass over time on (n_alphas, n_series) arrays.
+    Returns (forecasts (n_series, n_periods), chosen alpha per series).
+    """
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    a = np.asarray(alphas, dtype=float)[:, np.newaxis]
+    level = np.full((len(a), Y.shape[0]), np.nan)
+    sse   = np.zeros_like(level)
+
+    for t in range(Y.shape[1]):
+        y = Y[:, t]
+        seen = ~np.isnan(y)
+        err  = y - level
+        has_level = seen & ~np.isnan(level)
+        sse   += np.where(has_level, err * err, 0.0)
+        level  = np.where(has_level, level + a * err, level)
+        level  = np.where(seen & np.isnan(level), y, level)
+
+    best  = np.argmin(sse, axis=0)
+    cols  = np.arange(Y.shape[0])
+    final = level[best, cols]
+    return np.repeat(final[:, np.newaxis], n_periods, axis=1), a[best, 0]
+
+
+def batch_seasonal_profile(Y: np.ndarray, freq: str, t: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    In-sample trend + Fourier seasonality of every row of Y, on a shared period axis
+    t (default 0..n-1). NaN cells are left out of the fit and stay NaN; rows with the
+    same missing cells share one least-squares solve (complete rows: a single one).
+    """
+    Y  = np.atleast_2d(np.asarray(Y, dtype=float))
+    t  = np.arange(Y.shape[1], dtype=float) if t is None else np.asarray(t, dtype=float)
+    ok = np.isfinite(Y)
+    out = np.full(Y.shape, np.nan)
+    patterns, inverse = np.unique(ok, axis=0, return_inverse=True)
+    for p, mask in enumerate(patterns):
+        if mask.sum() < 2:
+            continue
+        rows  = np.flatnonzero(inverse.ravel() == p)
+        tm    = t[mask]
+        terms = _seasonal_terms(freq, int(tm[-1] - tm[0]) + 1)
+        X     = _fourier_design(tm, terms)
+        if len(tm) <= X.shape[1]:                     # too few points for the seasonal terms
+            X = _fourier_design(tm, [])
+        coef, *_ = np.linalg.lstsq(X, Y[np.ix_(rows, mask)].T, rcond=None)
+        out[np.ix_(rows, mask)] = (X @ coef).T
+    return out
+
+
+def forecast_panel(df: pd.DataFrame, n_periods: int = 3, method: str = "linear",
+                   site_col: str = SITE_COL) -> Dict[Tuple[str, str], Dict]:
+    """
+    Baseline forecast for every (site, KPI) of a long multi-site frame in one batch call.
+    method: "linear" (trend) or "ses" (simple exponential smoothing).
+    Returns { (site, kpi): { "forecast": [...], "method": ... } }
+    """
+    dates = period_dates(df)
+    kpis  = [k for k in KPI_COLS if k in df.columns]
+    wide  = (df.assign(_period=dates)
+               .pivot_table(index=site_col, columns="_period", values=kpis, aggfunc="last", dropna=False)
+               .sort_index(axis=1))
+    sites = wide.index.tolist()
+    Y = np.vstack([wide[kpi].values for kpi in kpis])
+
+    if method == "ses":
+        forecasts, alpha = batch_ses_forecast(Y, n_periods)
+        labels = [f"Lissage exponentiel (α={x:.2f})" for x in alpha]
+    else:
+        forecasts = batch_linear_forecast(Y, n_periods)
+        labels = ["Régression linéaire"] * len(Y)
+
+    results = {}
+    for row, (kpi, site) in enumerate((k, s) for k in kpis for s in sites):
+        results[(site, kpi)] = {
+            "forecast": forecasts[row].tolist(),
+            "method":   labels[row],
+        }
+    return results
+
+
+def forecast_all_kpis(df: pd.DataFrame, n_periods: int = 3, freq: Optional[str] = None,
+                      start_params: Optional[Dict[str, List[float]]] = None,
+                      train_start: Optional[Dict[str, int]] = None) -> Dict[str, Dict]:
+    """
+    Forecast each KPI for n_periods ahead at the data frequency (inferred if None).
+    start_params: { kpi_col: params } from a previous call, used to warm-start ARIMA fits.
+    train_start:  { kpi_col: row } fit that KPI from this row on only, e.g. the start of its
+                  current regime (changepoint.regime_starts); at least MIN_TRAIN_POINTS are kept.
+    Returns dict: { kpi_col: { "forecast": [...], "method": "ARIMA"|"Fourier"|"Linear",
+                               "params": ARIMA params|None, "seasonal": Fourier fit|None,
+                               "start": first row of the train window } }
+    """
+    start_params = start_params or {}
+    train_start  = train_start or {}
+    freq  = freq or infer_frequency(df)
     results = {}
     for kpi in KPI_COLS:
+        if kpi not in df.columns:
+            continue
         series = df[kpi].values.astype(float)
+        start  = min(train_start.get(kpi, 0), max(len(series) - MIN_TRAIN_POINTS, 0))
+        series = series[start:]
+        terms  = _seasonal_terms(freq, len(series))
         order  = ARIMA_ORDERS.get(kpi, (1, 1, 1))
 
-        if STATSMODELS_OK and len(series) >= 8:
-            forecast = _arima_forecast(series, order, n_periods)
+        params = seasonal = None
+        if terms:
+            forecast, coef = _fourier_forecast(series, terms, n_periods)
+            seasonal = {"terms": terms, "coef": coef.tolist()}
+            method   = "Fourier saisonnier (" + ", ".join(f"{p:g}×{k}" for p, k in terms) + ")"
+        elif STATSMODELS_OK and len(series) >= 8:
+            forecast, params = _arima_forecast(series, order, n_periods, start_params.get(kpi))
             method   = f"ARIMA{order}"
         else:
             forecast = _linear_forecast(series, n_periods)
             method   = "Régression linéaire"
 
+        if start > 0:
+            method += f" · depuis {df['mois_label'].iloc[start]}"
+
         results[kpi] = {
             "forecast": forecast.tolist(),
             "method":   method,
+            "params":   params,
+            "seasonal": seasonal,
+            "start":    start,
         }
     return results
 
 
-def get_forecast_months(df: pd.DataFrame, n_periods: int = 3) -> List[str]:
-    """Generate future month labels."""
-    from datetime import datetime
-    from dateutil.relativedelta import relativedelta
+# ── Model-expected values (for anomaly detection) ────────────────────────────
+def _arima_one_step(series: np.ndarray, order: Tuple, params: List[float]) -> np.ndarray:
+    """One-step-ahead predictions (made at t−1) of fitted ARIMA params: Kalman filter, no refit."""
+    try:
+        pred = np.asarray(_arima_model()(series, order=order).filter(np.asarray(params)).fittedvalues, dtype=float)
+    except Exception:
+        return np.full(len(series), np.nan)
+    pred[:order[1]] = np.nan                          # differencing burn-in: no prediction yet
+    return pred
+
+
+def expected_values(df: pd.DataFrame, fits: Optional[Dict[str, Dict]] = None,
+                    freq: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """
+    Model-expected value of every row of each KPI, NaN where the model gives none.
+    fits: forecast_all_kpis(df) results, whose models are reused as fitted:
+      ARIMA     one-step-ahead prediction made at t−1 (fitted params, filtered)
+      Fourier   fitted trend + seasonal profile at t
+      linear    trend line of the train window
+    Rows before a fit's train window have no expectation. Without fits, every KPI gets
+    the Fourier profile (or trend line for short histories) in one least-squares call.
+    """
+    freq = freq or infer_frequency(df)
+    kpis = [k for k in KPI_COLS if k in df.columns]
+    Y    = df[kpis].to_numpy(dtype=float)
+    t    = np.arange(len(df), dtype=float)
+    if fits is None:
+        if len(df) < 2:
+            return {kpi: np.full(len(df), np.nan) for kpi in kpis}
+        return dict(zip(kpis, batch_seasonal_profile(Y.T, freq, period_index(period_dates(df), freq))))
+
+    out = {}
+    for j, kpi in enumerate(kpis):
+        fit = fits.get(kpi)
+        exp = np.full(len(df), np.nan)
+        if fit is None:
+            out[kpi] = exp
+            continue
+        start  = fit.get("start", 0)
+        series = Y[start:, j]
+        if fit.get("params") is not None:
+            exp[start:] = _arima_one_step(series, ARIMA_ORDERS.get(kpi, (1, 1, 1)), fit["params"])
+        elif fit.get("seasonal") is not None:
+            exp[start:] = _fourier_design(t[:len(series)], fit["seasonal"]["terms"]) @ np.asarray(fit["seasonal"]["coef"])
+        elif np.isfinite(series).sum() > 1:
+            ok = np.isfinite(series)
+            exp[start:] = np.polyval(np.polyfit(t[:len(series)][ok], series[ok], 1), t[:len(series)])
+        out[kpi] = exp
+    return out
+
+
+def _forecast_task(args) -> Dict[str, Dict]:
+    frame, n_periods, freq, train_start = args
+    return forecast_all_kpis(frame, n_periods, freq, train_start=train_start)
+
 
-    MONTH_FR = {
-        1: "Jan", 2: "Fév", 3: "Mar", 4: "Avr",
-        5: "Mai", 6: "Juin", 7: "Juil", 8: "Aoû",
-        9: "Sep", 10: "Oct", 11: "Nov", 12: "Déc"
-    }
+def forecast_batch(frames: List[pd.DataFrame], n_periods: int = 3, freq: Optional[str] = None,
+                   train_starts: Optional[List[Optional[Dict[str, int]]]] = None,
+                   n_jobs: Optional[int] = None) -> List[Dict[str, Dict]]:
+    """
+    forecast_all_kpis for each frame (one series set per site, hierarchy node, …),
+    spread over n_jobs worker processes. Results are in the order of frames.
+    """
+    train_starts = train_starts or [None] * len(frames)
+    tasks = [(f, n_periods, freq, t) for f, t in zip(frames, train_starts)]
+    return parallel.map_tasks(_forecast_task, tasks, n_jobs)
+
+
+def _shared_forecast_task(args) -> Dict[str, Dict]:
+    """Worker task: forecast_all_kpis on one site's rows of the shared KPI matrix."""
+    handle, site, lo, hi, n_periods, train_start = args
+    frame = sa.frame_view(handle, lo, hi, labels=bool(train_start))
+    return forecast_all_kpis(frame, n_periods, handle.freq, train_start=train_start)
+
+
+def forecast_sites(df: pd.DataFrame, n_periods: int = 3, train_start: Optional[Dict[str, Dict[str, int]]] = None,
+                   n_jobs: Optional[int] = None, site_col: str = SITE_COL) -> Dict[str, Dict[str, Dict]]:
+    """
+    { site: forecast_all_kpis(site history) } for a long multi-site frame, sites spread
+    over n_jobs processes that read the KPIs from shared memory (tasks carry a handle only;
+    one worker: plain serial loop, no shared copy).
+    train_start: { site: { kpi: row } }, e.g. changepoint.regime_starts per site.
+    """
+    train_start = train_start or {}
+    if parallel.n_workers(n_jobs) == 1:
+        groups = parallel.site_groups(df, site_col)
+        freq   = infer_frequency(groups[0][1]) if groups else "M"
+        return {site: forecast_all_kpis(frame.reset_index(drop=True), n_periods, freq, train_start=train_start.get(site))
+                for site, frame in groups}
+    with sa.SharedKPIMatrix(df, site_col=site_col) as shared:
+        tasks = [(shared.handle, site, lo, hi, n_periods, train_start.get(site))
+                 for site, lo, hi in shared.site_ranges]
+        results = parallel.map_tasks(_shared_forecast_task, tasks, n_jobs)
+    return {site: res for (site, _, _), res in zip(shared.site_ranges, results)}
 
-    last_label = df["mois_label"].iloc[-1]  # e.g. "Déc 2024"
-    # Parse
-    parts = last_label.split(" ")
-    month_name, year = parts[0], int(parts[1])
-    FR_TO_NUM = {v: k for k, v in MONTH_FR.items()}
-    month_num = FR_TO_NUM.get(month_name, 12)
-    dt = datetime(year, month_num, 1)
 
-    labels = []
-    for i in range(1, n_periods + 1):
-        try:
-            future = dt + relativedelta(months=i)
-        except Exception:
-            # fallback: just add ~30 days * i
-            import datetime as dt_mod
-            future = dt + dt_mod.timedelta(days=30 * i)
-        labels.append(f"{MONTH_FR[future.month]} {future.year}")
-    return labels
+def get_forecast_months(df: pd.DataFrame, n_periods: int = 3, freq: Optional[str] = None) -> List[str]:
+    """Generate future period labels ("Jan 2025", "S02 2025", "01 Jan 2025", "T1 2025")."""
+    freq   = freq or infer_frequency(df)
+    last   = period_dates(df)[-1]
+    offset = PERIOD_OFFSETS[freq]
+    return [format_period_label(last + offset * i, freq) for i in range(1, n_periods + 1)]
 
 
-def forecast_global_score(df: pd.DataFrame, score_fn, n_periods: int = 3) -> List[Dict]:
+def forecast_global_score(df: pd.DataFrame, score_fn, n_periods: int = 3,
+                          train_start: Optional[Dict[str, int]] = None,
+                          kpi_forecasts: Optional[Dict[str, Dict]] = None) -> List[Dict]:
     """
     Forecast the global score for n_periods ahead using individual KPI forecasts.
+    kpi_forecasts: forecast_all_kpis(df, n_periods) results to reuse (no new fit).
     Returns list of { month, score, lower, upper }
     """
-    kpi_forecasts = forecast_all_kpis(df, n_periods)
-    future_months = get_forecast_months(df, n_periods)
+    freq          = infer_frequency(df)
+    if kpi_forecasts is None:
+        kpi_forecasts = forecast_all_kpis(df, n_periods, freq, train_start=train_start)
+    future_months = get_forecast_months(df, n_periods, freq)
 
     last_row  = df.iloc[-1].copy()
     prev_row  = df.iloc[-2].copy()
@@ -123,9 +433,8 @@ def forecast_global_score(df: pd.DataFrame, score_fn, n_periods: int = 3) -> Lis
     for i in range(n_periods):
         # Build synthetic "future" row
         future_row = last_row.copy()
-        for kpi in ["chiffre_affaires", "marge", "energie", "co2",
-                    "absenteisme", "satisfaction", "productivite"]:
-            future_row[kpi] = kpi_forecasts[kpi]["forecast"][i]
+        for kpi, fc in kpi_forecasts.items():
+            future_row[kpi] = fc["forecast"][i]
 
         score_data = score_fn(future_row, prev_row if i == 0 else last_row)
         sc = score_data["global_score"]
@@ -0,0 +1,155 @@
+"""
+heatmap_tiles.py
+Drill-down anomaly heatmap for many sites × KPIs × periods.
+
+The residual z-scores of every (site, KPI, period) are computed once and reduced
+into a pyramid: level 0 is one column per period, each level above merges pairs
+of columns, keeping the value with the largest |z| (sign preserved). Views never
+touch the raw matrix:
+
+  - overview   site × period-bucket tile, max |z| over the KPIs (plus which KPI)
+  - drill-down one site's KPI × period-bucket tile
+
+Sites are ranked by their worst |z|, so the first row tile shows the most
+anomalous sites. Tiles are cut from the pyramid on first request and then served
+from the process-wide cache (cache.py).
+"""
+from dataclasses import dataclass
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+import anomaly_detector as ad
+from cache import CACHE
+from data_generator import SITE_COL, data_version, format_period_label, period_dates
+from forecaster import infer_frequency, period_index
+
+
+TILE_SITES = 25      # rows of an overview tile
+TILE_COLS  = 120     # period buckets of a tile (= charts.MAX_HEATMAP_COLS)
+
+
+@dataclass
+class Tile:
+    """One heatmap tile: z (rows × buckets), the KPI behind each cell, axis labels."""
+    z:       np.ndarray
+    kpi:     Optional[np.ndarray]          # overview: KPI name per cell; drill-down: None
+    rows:    List[str]
+    columns: List[str]
+    level:   int
+
+
+def signed_max(z: np.ndarray, axis: int) -> np.ndarray:
+    """Value with the largest |z| along axis, sign kept (NaN only if all NaN)."""
+    pick = np.nan_to_num(np.abs(z), nan=-1.0).argmax(axis=axis)
+    return np.take_along_axis(z, np.expand_dims(pick, axis), axis).squeeze(axis)
+
+
+def _halve(z: np.ndarray) -> np.ndarray:
+    """Merge pairs of columns (last axis) with signed_max; an odd last column stays alone."""
+    if z.shape[-1] % 2:
+        z = np.concatenate([z, np.full(z.shape[:-1] + (1,), np.nan)], axis=-1)
+    return signed_max(z.reshape(z.shape[:-1] + (-1, 2)), axis=-1)
+
+
+class ZPyramid:
+    """
+    Signed max-|z| pyramid of a long multi-site frame.
+      levels[l]   (sites × KPIs × ceil(periods / 2**l)) residual z-scores
+      sites       ranked by worst |z| (most anomalous first)
+    """
+
+    def __init__(self, df: pd.DataFrame, kpis: Optional[List[str]] = None, site_col: str = SITE_COL):
+        self.kpis    = [k for k in (kpis or ad.available_features(df)) if k in df.columns]
+        self.version = data_version(df)
+        codes, sites = (pd.factorize(df[site_col], sort=False) if site_col in df.columns
+                        else (np.zeros(len(df), dtype=np.int64), np.array([""], dtype=object)))
+        dates = pd.DatetimeIndex(period_dates(df))
+        period_codes, periods = pd.factorize(dates, sort=True)
+        order = np.lexsort((period_codes, codes))
+        self.freq = infer_frequency(df.iloc[order[:max(2, int((codes == 0).sum()))]])
+
+        X = df[self.kpis].to_numpy(dtype=float)[order]
+        Z = ad.residual_zscores_by_site(X, codes[order], self.freq, period_index(dates[order], self.freq))
+        z0 = np.full((len(sites), len(self.kpis), len(periods)), np.nan)
+        z0[codes[order], :, period_codes[order]] = Z
+
+        worst = np.nan_to_num(np.abs(z0), nan=0.0).max(axis=(1, 2))
+        rank  = np.argsort(-worst, kind="stable")
+        self.sites   = [str(s) for s in np.asarray(sites, dtype=object)[rank]]
+        self.periods = pd.DatetimeIndex(periods)
+        self.levels  = [z0[rank]]
+        while self.levels[-1].shape[2] > 1:
+            self.levels.append(_halve(self.levels[-1]))
+
+    # ── Geometry ──────────────────────────────────────────────────────────────
+    def level_for(self, max_cols: int = TILE_COLS) -> int:
+        """Finest level whose whole period axis fits in max_cols buckets."""
+        return next(l for l, z in enumerate(self.levels) if z.shape[2] <= max_cols)
+
+    def n_tiles(self, level: int) -> tuple:
+        """(row tiles, column tiles) of the overview at a level."""
+        return (-(-len(self.sites) // TILE_SITES), -(-self.levels[level].shape[2] // TILE_COLS))
+
+    def bucket_labels(self, level: int, lo: int, hi: int) -> List[str]:
+        """"start" (level 0) or "start → end" label of buckets lo:hi."""
+        step, n = 2 ** level, len(self.periods)
+        labels = []
+        for b in range(lo, hi):
+            first, last = b * step, min((b + 1) * step, n) - 1
+            label = format_period_label(self.periods[first], self.freq)
+            if last > first:
+                label += " → " + format_period_label(self.periods[last], self.freq)
+            labels.append(label)
+        return labels
+
+    # ── Tiles (cached) ────────────────────────────────────────────────────────
+    def tile(self, level: int, row_tile: int = 0, col_tile: int = 0) -> Tile:
+        """Overview tile: sites × buckets, max |z| over the KPIs."""
+        key = ("heatmap_tiles", self.version, "overview", level, row_tile, col_tile)
+        return CACHE.get_or_compute(key, lambda: self._overview(level, row_tile, col_tile))
+
+    def site_tile(self, site: str, level: int, col_tile: int = 0) -> Tile:
+        """Drill-down tile: one site's KPIs × buckets."""
+        key = ("heatmap_tiles", self.version, "site", site, level, col_tile)
+        return CACHE.get_or_compute(key, lambda: self._site(site, level, col_tile))
+
+    def _overview(self, level: int, row_tile: int, col_tile: int) -> Tile:
+        r0, c0 = row_tile * TILE_SITES, col_tile * TILE_COLS
+        block  = self.levels[level][r0:r0 + TILE_SITES, :, c0:c0 + TILE_COLS]
+        kpi    = np.nan_to_num(np.abs(block), nan=-1.0).argmax(axis=1)
+        return Tile(signed_max(block, axis=1), np.asarray(self.kpis, dtype=object)[kpi],
+                    self.sites[r0:r0 + TILE_SITES], self.bucket_labels(level, c0, c0 + block.shape[2]), level)
+
+    def _site(self, site: str, level: int, col_tile: int) -> Tile:
+        c0    = col_tile * TILE_COLS
+        block = self.levels[level][self.sites.index(site), :, c0:c0 + TILE_COLS]
+        return Tile(block, None, list(self.kpis), self.bucket_labels(level, c0, c0 + block.shape[1]), level)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import data_generator as dg
+
+    parser = argparse.ArgumentParser(description="Build the max-|z| pyramid of a simulated portfolio and cut tiles.")
+    parser.add_argument("--sites", type=int, default=500)
+    args = parser.parse_args()
+
+    data = dg.generate_multisite_data(args.sites)
+    t0 = time.perf_counter()
+    pyramid = ZPyramid(data)
+    t1 = time.perf_counter()
+    level = pyramid.level_for()
+    top = pyramid.tile(level)
+    t2 = time.perf_counter()
+    pyramid.tile(level)
+    t3 = time.perf_counter()
+    print(f"{len(pyramid.sites)} sites × {len(pyramid.kpis)} KPIs × {len(pyramid.periods)} périodes · "
+          f"pyramide {len(pyramid.levels)} niveaux en {t1 - t0:.2f}s · tuile {1e3 * (t2 - t1):.1f} ms, "
+          f"en cache {1e3 * (t3 - t2):.2f} ms · {pyramid.n_tiles(level)[0]} tuiles de sites")
+    worst = pyramid.site_tile(top.rows[0], 0)
+    i, j = np.unravel_index(np.nanargmax(np.abs(worst.z)), worst.z.shape)
+    print(f"Site le plus anormal : {top.rows[0]} · {worst.rows[i]} {worst.columns[j]} z={worst.z[i, j]:+.2f}")
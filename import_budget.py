@@ -0,0 +1,97 @@
+"""
+import_budget.py
+Import-time budget for the modules that scoring jobs, CLIs and the API start from.
+Each module is imported in a fresh interpreter (python -X importtime); the check
+fails when an import goes over budget or pulls in a heavy dependency that should
+only be loaded on first use (scikit-learn, statsmodels, Plotly, Streamlit).
+
+Usage:
+    python import_budget.py            # exit code 1 if any budget is exceeded
+    python import_budget.py --top 10   # also list the slowest imports of each module
+"""
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+
+# ── Budgets: seconds of cumulative import time (pandas alone is ~0.4 s) ──────
+BUDGETS = {
+    "score_engine":     0.8,
+    "scoring_profiles": 0.8,
+    "anomaly_detector": 0.8,
+    "forecaster":       0.8,
+    "rollups":          0.8,
+    "leaderboard":      0.8,
+    "incremental":      0.8,
+    "reports":          0.8,
+    "backtest":         0.8,
+    "validation":       0.8,
+    "cache":            0.8,
+    "carbon":           0.8,
+    "meter_ingest":     0.8,
+    "heatmap_tiles":    0.8,
+    "profiling":        0.8,
+    "correlation":      0.8,
+    "changepoint":      0.8,
+    "hierarchy":        1.0,        # scipy.sparse
+    "parallel":         0.8,
+    "shared_arrays":    0.8,
+    "alerting":         0.8,
+    "api":              1.0,
+}
+
+# Loaded on first use only; none of the modules above may import them
+LAZY_MODULES = ["sklearn", "statsmodels", "plotly", "streamlit"]
+
+ROOT = Path(__file__).resolve().parent
+
+
+def measure(module: str) -> Tuple[float, List[str], List[Tuple[float, str]]]:
+    """(cumulative import seconds, heavy modules loaded, [(seconds, name)] per imported package)."""
+    code = (f"import sys, json; import {module}; "
+            f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    total, timings = 0.0, []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue                                      # header line
+        seconds = int(cumulative) / 1e6
+        timings.append((seconds, name.strip()))
+        if name.strip() == module:
+            total = seconds
+    return total, json.loads(proc.stdout.strip().splitlines()[-1]), timings
+
+
+def check(budgets: Dict[str, float], repeat: int = 3, top: int = 0) -> bool:
+    """Best of `repeat` runs per module against its budget. Prints a report, returns True if all pass."""
+    ok = True
+    for module, budget in budgets.items():
+        runs  = [measure(module) for _ in range(repeat)]
+        total, heavy, timings = min(runs, key=lambda r: r[0])
+        passed = total <= budget and not heavy
+        ok &= passed
+        status = "OK  " if passed else "FAIL"
+        extra  = f"  charge : {', '.join(heavy)}" if heavy else ""
+        print(f"{status} {module:18s} {total:5.2f}s / {budget:.2f}s{extra}")
+        for seconds, name in sorted(timings, reverse=True)[1:top + 1]:
+            print(f"       {seconds:5.2f}s  {name}")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Check import-time budgets of the fast-start modules.")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per module (best is kept)")
+    parser.add_argument("--top",    type=int, default=0, help="slowest imports to list per module")
+    parser.add_argument("modules",  nargs="*", help="modules to check (default: all)")
+    args = parser.parse_args()
+
+    budgets = {m: BUDGETS.get(m, 1.0) for m in args.modules} if args.modules else BUDGETS
+    sys.exit(0 if check(budgets, args.repeat, args.top) else 1)
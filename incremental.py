@@ -0,0 +1,261 @@
+"""
+incremental.py
+Append-only KPI store for one site. New rows are ingested with `append` and
+only the results they affect are recomputed:
+  - scores            : the new rows, each scored against its predecessor
+  - z-statistics      : running mean / variance, merged in O(new rows)
+  - anomaly records   : the new rows only, against the updated statistics
+  - Isolation Forest  : new rows are scored with the fitted model; the model is
+                        refit only once the history has grown by `refit_every`
+  - forecasts         : marked stale and recomputed on next access (warm-started,
+                        over a bounded trailing window)
+Derived results form a small dependency graph; invalidating a node invalidates
+everything downstream and notifies subscribers (e.g. UI caches).
+"""
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import anomaly_detector as ad
+import forecaster as fc
+import score_engine as se
+import validation as va
+from data_generator import period_dates
+
+
+# ── Dependency graph: node → nodes derived from it ───────────────────────────
+DEPENDENCIES = {
+    "rows":      ["frame", "zstats", "scores", "if_model", "forecasts"],
+    "zstats":    ["zscores", "anomalies"],
+    "if_model":  ["anomalies"],
+    "scores":    ["score_forecast"],
+    "forecasts": ["score_forecast"],
+}
+
+
+def _dependents(node: str) -> List[str]:
+    """node and everything downstream of it, in dependency order."""
+    seen, stack = [], [node]
+    while stack:
+        n = stack.pop()
+        if n not in seen:
+            seen.append(n)
+            stack.extend(DEPENDENCIES.get(n, []))
+    return seen
+
+
+class KPIStore:
+    """Append-only history of one site's KPIs with incrementally maintained results."""
+
+    def __init__(self, df: Optional[pd.DataFrame] = None, contamination: float = 0.1,
+                 refit_every: float = 0.25, forecast_window: int = 1095, n_periods: int = 3):
+        """
+        refit_every:     refit the Isolation Forest once the history grew by this fraction
+                         (amortised O(1) per row).
+        forecast_window: forecasts are fit on at most this many trailing periods.
+        """
+        self.contamination   = contamination
+        self.refit_every     = refit_every
+        self.forecast_window = forecast_window
+        self.n_periods       = n_periods
+
+        self.kpis: List[str] = []
+        self._values = np.empty((0, 0))          # growable buffer, rows [:n] are valid
+        self._n      = 0
+        self._labels: List[str] = []
+        self._dates:  List[pd.Timestamp] = []
+        self._freq:   Optional[str] = None
+        self.validation: List[Dict] = []         # validation report rows of every batch
+
+        # running z-statistics (Chan et al. parallel merge)
+        self._count = 0
+        self._mean  = None
+        self._m2    = None
+
+        self._scores: List[pd.DataFrame] = []
+        self._records: List[Dict] = []
+        self._if_model   = None
+        self._if_fit_n   = 0
+
+        self._cache: Dict[str, object] = {}
+        self._forecast_params: Dict[str, List[float]] = {}
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = defaultdict(list)
+
+        if df is not None and len(df):
+            self.append(df)
+
+    # ── Dependency tracking ───────────────────────────────────────────────────
+    def subscribe(self, node: str, callback: Callable[[str], None]) -> None:
+        """Call callback(node) whenever `node` (or anything upstream of it) is invalidated."""
+        self._subscribers[node].append(callback)
+
+    def invalidate(self, node: str) -> None:
+        for n in _dependents(node):
+            self._cache.pop(n, None)
+            for callback in self._subscribers.get(n, []):
+                callback(n)
+
+    def __len__(self) -> int:
+        return self._n
+
+    # ── Ingestion ─────────────────────────────────────────────────────────────
+    def _grow(self, n_new: int) -> None:
+        """Amortised O(1) append: double the buffer capacity when it is full."""
+        needed = self._n + n_new
+        if needed > self._values.shape[0]:
+            capacity = max(needed, 2 * self._values.shape[0], 64)
+            buf = np.empty((capacity, len(self.kpis)))
+            buf[:self._n] = self._values[:self._n]
+            self._values = buf
+
+    def _merge_stats(self, x: np.ndarray) -> None:
+        n_b = len(x)
+        mean_b = x.mean(axis=0)
+        m2_b = ((x - mean_b) ** 2).sum(axis=0)
+        if self._count == 0:
+            self._count, self._mean, self._m2 = n_b, mean_b, m2_b
+            return
+        n = self._count + n_b
+        delta = mean_b - self._mean
+        self._mean = self._mean + delta * n_b / n
+        self._m2   = self._m2 + m2_b + delta ** 2 * self._count * n_b / n
+        self._count = n
+
+    def append(self, rows: pd.DataFrame) -> Dict:
+        """
+        Ingest new KPI rows (same columns as the dashboard frame, in time order).
+        Rows are cleaned by validation.validate first (see _validate).
+        Returns {"rows": n ingested, "anomalies": new alert records, "validation": report rows}.
+        """
+        rows, report = self._validate(rows)
+        if rows.empty:
+            return {"rows": 0, "anomalies": [], "validation": report}
+        if not self.kpis:
+            self.kpis = ad.available_features(rows)
+            self._values = np.empty((0, len(self.kpis)))
+
+        x = rows[self.kpis].to_numpy(dtype=float)
+        start = self._n
+        self._grow(len(x))
+        self._values[start:start + len(x)] = x
+        self._n += len(x)
+        self._labels.extend(rows["mois_label"].tolist())
+        self._dates.extend(period_dates(rows))
+        self.invalidate("rows")
+
+        self._merge_stats(x)
+
+        # Window = last known row + new rows, so every new row has its predecessor
+        lo = max(start - 1, 0)
+        window = self._window(lo, self._n)
+
+        scores = se.score_history(window)
+        self._scores.append(scores.iloc[start - lo:].set_index(pd.RangeIndex(start, self._n)))
+
+        self._update_if_model()
+        if self._if_model is None:
+            flags = ad.run_isolation_forest(window)
+        else:
+            flags = ad.predict_isolation_forest(self._if_model, window)
+
+        new_records = ad.anomaly_records(window, self._zscores(window), flags, start=max(start - lo, 1))
+        self._records.extend(new_records)
+        return {"rows": len(x), "anomalies": new_records, "validation": report}
+
+    def _validate(self, rows: pd.DataFrame) -> Tuple[pd.DataFrame, List[Dict]]:
+        """
+        (clean rows, report rows) of a batch. Periods already stored are dropped and
+        the last stored row is prepended, so a gap between the history and the batch
+        is interpolated too. Values are not winsorized: a batch alone is too short
+        for robust per-KPI statistics.
+        """
+        if rows.empty:
+            return rows, []
+        report = []
+        if self._n:
+            new = np.asarray(period_dates(rows) > self._dates[-1])
+            if not new.all():
+                report.append({"Étape": "Doublons", "KPI": "—", "Valeurs": int((~new).sum()),
+                               "Détail": "période déjà ingérée → ligne ignorée"})
+            if not new.any():
+                self.validation.extend(report)
+                return rows.iloc[:0], report
+            rows = pd.concat([self._window(self._n - 1, self._n), rows[new]], ignore_index=True)
+        self._freq = self._freq or fc.infer_frequency(rows)
+        clean, checks = va.validate(rows, freq=self._freq, clamp=False)
+        report += checks.to_dict("records")
+        self.validation.extend(report)
+        return (clean.iloc[1:] if self._n else clean), report
+
+    def _update_if_model(self) -> None:
+        """Refit only when the history outgrew the last fit by `refit_every`."""
+        if self._if_model is not None and self._n < self._if_fit_n * (1 + self.refit_every):
+            return
+        self._if_model = ad.fit_isolation_forest(self.frame, self.contamination)
+        self._if_fit_n = self._n
+        self.invalidate("if_model")
+
+    # ── Views ─────────────────────────────────────────────────────────────────
+    def _window(self, lo: int, hi: int) -> pd.DataFrame:
+        out = pd.DataFrame(self._values[lo:hi], columns=self.kpis)
+        out.insert(0, "mois_label", self._labels[lo:hi])
+        out.insert(1, "mois_idx", np.arange(lo, hi))
+        out.insert(2, "date", self._dates[lo:hi])
+        return out
+
+    def _zscores(self, frame: pd.DataFrame) -> pd.DataFrame:
+        std = np.sqrt(self._m2 / max(self._count - 1, 1))
+        z = (frame[self.kpis].to_numpy(dtype=float) - self._mean) / np.where(std > 0, std, np.inf)
+        return pd.DataFrame(z, columns=self.kpis, index=frame.index)
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        """Full history as a dashboard DataFrame (built on demand, cached until the next append)."""
+        if "frame" not in self._cache:
+            self._cache["frame"] = self._window(0, self._n)
+        return self._cache["frame"]
+
+    def zscores(self) -> pd.DataFrame:
+        """Z-scores of the whole history against the current running statistics."""
+        if "zscores" not in self._cache:
+            self._cache["zscores"] = self._zscores(self.frame)
+        return self._cache["zscores"]
+
+    def scores(self) -> pd.DataFrame:
+        """score_history of every row, assembled from the per-append results."""
+        if "scores" not in self._cache:
+            self._cache["scores"] = pd.concat(self._scores) if self._scores else pd.DataFrame()
+        return self._cache["scores"]
+
+    def anomalies(self) -> pd.DataFrame:
+        """
+        Alert log in the get_all_anomaly_rows format. Each row was judged when it was
+        ingested, against the statistics and model known at that time.
+        """
+        if "anomalies" not in self._cache:
+            if not self._records:
+                self._cache["anomalies"] = pd.DataFrame()
+            else:
+                result = pd.DataFrame(self._records)
+                result = result.sort_values(["_level_order", "Mois"]).drop(columns=["_level_order"])
+                self._cache["anomalies"] = result.reset_index(drop=True)
+        return self._cache["anomalies"]
+
+    def forecasts(self) -> Dict[str, Dict]:
+        """forecast_all_kpis over the trailing window, warm-started from the previous fit."""
+        if "forecasts" not in self._cache:
+            recent = self.frame.iloc[-self.forecast_window:].reset_index(drop=True)
+            result = fc.forecast_all_kpis(recent, self.n_periods, start_params=self._forecast_params)
+            self._forecast_params = {k: v["params"] for k, v in result.items() if v["params"] is not None}
+            self._cache["forecasts"] = result
+        return self._cache["forecasts"]
+
+    def score_forecast(self) -> List[Dict]:
+        """forecast_global_score over the trailing window, from the cached KPI forecasts."""
+        if "score_forecast" not in self._cache:
+            recent = self.frame.iloc[-self.forecast_window:].reset_index(drop=True)
+            self._cache["score_forecast"] = fc.forecast_global_score(
+                recent, se.compute_score, self.n_periods, kpi_forecasts=self.forecasts())
+        return self._cache["score_forecast"]
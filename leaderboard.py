@@ -0,0 +1,154 @@
+"""
+leaderboard.py
+Cross-site ranking by global score, sustainability score and each sub-score.
+All sites are scored once (score_engine.score_history), then every
+(period, metric) is sorted once into rank / order arrays, so a query is a
+slice of precomputed arrays — no re-scoring, no re-sorting.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import score_engine as se
+from data_generator import REGION_COL, SITE_COL, period_dates
+
+
+METRICS = ["global_score", "sustainability_score", "finance", "energie", "co2", "rh", "satisfaction"]
+
+METRIC_LABELS = {
+    "global_score":         "Score Global",
+    "sustainability_score": "Sustainability",
+    "finance":              "Finance",
+    "energie":              "Énergie",
+    "co2":                  "CO₂",
+    "rh":                   "RH",
+    "satisfaction":         "Satisfaction",
+}
+
+# ── Percentile bands (lower bound of the percentile, label) ──────────────────
+PERCENTILE_BANDS = [
+    (90, "Top 10%"),
+    (75, "Top 25%"),
+    (50, "Médiane +"),
+    (25, "Médiane −"),
+    (0,  "Bas 25%"),
+]
+
+
+def _band(percentile: np.ndarray) -> np.ndarray:
+    bounds = np.array([b for b, _ in PERCENTILE_BANDS])
+    labels = np.array([label for _, label in PERCENTILE_BANDS] + ["—"], dtype=object)
+    # first band whose lower bound is strictly below the percentile; NaN → "—"
+    idx = np.argmax(percentile[:, None] > bounds[None, :], axis=1)
+    idx = np.where(np.isnan(percentile), len(bounds), idx)
+    return labels[idx]
+
+
+def _rank_rows(values: np.ndarray):
+    """
+    Sort every row (period) of a (n_periods, n_sites) matrix, best first, NaN last.
+    Returns (order, rank, n_valid): tied scores share the best rank ("1, 2, 2, 4").
+    """
+    filled = np.where(np.isnan(values), -np.inf, values)
+    order  = np.argsort(-filled, axis=1, kind="stable").astype(np.int32)
+    sorted_vals = np.take_along_axis(filled, order, axis=1)
+
+    pos = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    new_group = np.ones(values.shape, dtype=bool)
+    new_group[:, 1:] = sorted_vals[:, 1:] != sorted_vals[:, :-1]
+    sorted_rank = np.maximum.accumulate(np.where(new_group, pos, 0), axis=1) + 1
+
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, sorted_rank.astype(np.int32), axis=1)
+    rank = np.where(np.isnan(values), 0, rank)
+    n_valid = (~np.isnan(values)).sum(axis=1)
+    return order, rank, n_valid
+
+
+class LeaderboardIndex:
+    """Precomputed per-period rankings of every site for every metric."""
+
+    def __init__(self, scores: pd.DataFrame, site_col: str = SITE_COL):
+        """scores: one row per (site, period) with "period", "date" and the METRICS columns."""
+        periods = (scores[["period", "date"]].drop_duplicates("period").sort_values("date"))
+        self.periods: List[str] = periods["period"].tolist()
+        self.sites:   List[str] = sorted(scores[site_col].unique().tolist())
+        self._period_pos = {p: i for i, p in enumerate(self.periods)}
+        self._site_pos   = {s: i for i, s in enumerate(self.sites)}
+        self.regions = (scores.drop_duplicates(site_col).set_index(site_col)[REGION_COL]
+                        .reindex(self.sites).to_numpy() if REGION_COL in scores.columns else None)
+
+        p_idx = scores["period"].map(self._period_pos).to_numpy()
+        s_idx = scores[site_col].map(self._site_pos).to_numpy()
+        self.values: Dict[str, np.ndarray] = {}
+        self.order:  Dict[str, np.ndarray] = {}
+        self.rank:   Dict[str, np.ndarray] = {}
+        self.n_valid: Dict[str, np.ndarray] = {}
+        for metric in METRICS:
+            mat = np.full((len(self.periods), len(self.sites)), np.nan)
+            mat[p_idx, s_idx] = scores[metric].to_numpy(dtype=float)
+            self.values[metric] = mat
+            self.order[metric], self.rank[metric], self.n_valid[metric] = _rank_rows(mat)
+
+    def percentile(self, metric: str, p, rank: np.ndarray) -> np.ndarray:
+        """Percentile of ranks in period(s) p: 100 for the leader, NaN for unranked sites."""
+        n = np.maximum(self.n_valid[metric][p], 1)
+        return np.where(rank > 0, 100 * (1 - (rank - 1) / n), np.nan)
+
+    def ranking(self, period: str, metric: str = "global_score", top: Optional[int] = None,
+                bottom: bool = False) -> pd.DataFrame:
+        """
+        Leaderboard for one period: rank, site, score, percentile, band and movement
+        (places gained since the previous period; NaN for the first period or a new site).
+        top: only the first N rows (or last N with bottom=True), read straight from the order array.
+        """
+        p = self._period_pos[period]
+        n_valid = int(self.n_valid[metric][p])
+        order = self.order[metric][p, :n_valid]
+        if top is not None:
+            order = order[-top:][::-1] if bottom else order[:top]
+
+        rank = self.rank[metric][p, order]
+        if p > 0:
+            prev_rank = self.rank[metric][p - 1, order].astype(float)
+            movement  = np.where(prev_rank > 0, prev_rank - rank, np.nan)
+        else:
+            movement  = np.full(len(order), np.nan)
+
+        pct = self.percentile(metric, p, rank)
+        table = pd.DataFrame({
+            "Rang":       rank,
+            "Site":       np.asarray(self.sites, dtype=object)[order],
+            METRIC_LABELS[metric]: self.values[metric][p, order].astype(int),
+            "Percentile": np.round(pct, 1),
+            "Bande":      _band(pct),
+            "Mouvement":  movement,
+        })
+        if self.regions is not None:
+            table.insert(2, "Région", self.regions[order])
+        return table
+
+    def site_history(self, site: str, metric: str = "global_score") -> pd.DataFrame:
+        """Rank and percentile of one site over all periods."""
+        s = self._site_pos[site]
+        rank = self.rank[metric][:, s]
+        pct  = self.percentile(metric, slice(None), rank)
+        return pd.DataFrame({
+            "Période":    self.periods,
+            "Score":      self.values[metric][:, s],
+            "Rang":       rank,
+            "Percentile": np.round(pct, 1),
+        })
+
+
+def build_leaderboard(df: pd.DataFrame, site_col: str = SITE_COL) -> LeaderboardIndex:
+    """Score every (site, period) of a long multi-site frame once and index the rankings."""
+    df = df.reset_index(drop=True)
+    scores = se.score_history(df, site_col=site_col)
+    scores[site_col] = df[site_col].to_numpy()
+    scores["period"] = df["mois_label"].to_numpy()
+    scores["date"]   = period_dates(df)
+    if REGION_COL in df.columns:
+        scores[REGION_COL] = df[REGION_COL].to_numpy()
+    return LeaderboardIndex(scores, site_col=site_col)
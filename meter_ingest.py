@@ -0,0 +1,301 @@
+"""
+meter_ingest.py
+Streaming ingestion of interval meter readings (e.g. one kWh value per meter every
+15 minutes) into daily and monthly energie / co2 KPIs with a peak / off-peak split.
+
+  - input       CSV or Parquet, long format: timestamp, site, kWh, optional energy
+                source; read in record batches of `chunk_rows` (pyarrow when
+                installed, pandas chunks otherwise), never whole
+  - aggregation each batch is added with np.bincount into a fixed
+                (source × site × day × peak) array: memory grows with sites × days,
+                not with the number of readings
+  - CO₂         kWh per (source, site, day) × the emission factor in force that day
+                (carbon.py); factor tables that change within a day are applied per
+                reading instead. kWh with no factor in force make the day's (and
+                month's) co2 NaN rather than booking them at zero emissions
+  - peak        hours PEAK_HOURS on PEAK_DAYS are "pointe", the rest "hors pointe"
+
+Timestamps are local, naive, and mark the start of each interval.
+"""
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import carbon as cb
+from data_generator import SITE_COL, format_period_label
+
+
+DEFAULT_COLUMNS = {"timestamp": "timestamp", "site": "site", "kwh": "kwh", "source": "source"}
+PEAK_HOURS  = (18, 23)                   # [start, end) hour of the peak tariff period
+PEAK_DAYS   = (0, 1, 2, 3, 4, 5, 6)      # Monday = 0
+CHUNK_ROWS  = 1_000_000
+NS_PER_HOUR = 3_600 * 10 ** 9
+EPOCH_WEEKDAY = 3                        # 1970-01-01 was a Thursday
+
+DAILY_COLUMNS = [SITE_COL, "mois_label", "mois_idx", "date", "energie", "co2",
+                 "energie_pointe", "energie_hors_pointe", "part_pointe", "n_releves"]
+
+
+def peak_table(hours: Tuple[int, int] = PEAK_HOURS, days: Sequence[int] = PEAK_DAYS) -> np.ndarray:
+    """Boolean lookup over the 168 hours of the week (Monday 00h first): True = peak."""
+    hour = np.arange(168)
+    return ((hour % 24 >= hours[0]) & (hour % 24 < hours[1])) & np.isin(hour // 24, days)
+
+
+class MeterAggregator:
+    """
+    Running daily totals of interval readings. Feed it with add() (or ingest()),
+    then read daily() / monthly(). Sites, sources and days are discovered on the way.
+    """
+
+    def __init__(self, factors: Optional[pd.DataFrame] = None, peak_hours: Tuple[int, int] = PEAK_HOURS,
+                 peak_days: Sequence[int] = PEAK_DAYS, default_source: str = "electricite"):
+        self.factors  = cb.factor_table() if factors is None else factors
+        self.peak     = peak_table(peak_hours, peak_days)
+        self.default_source = default_source
+        self.sites:   Dict[str, int] = {}
+        self.sources: Dict[str, int] = {}
+        self.day0     = None
+        self.kwh      = np.zeros((0, 0, 0, 2))       # source × site × day × (hors pointe, pointe)
+        self.count    = np.zeros((0, 0), dtype=np.int64)
+        self.rows     = 0
+        self.dropped  = 0                            # readings without a timestamp or a finite kWh
+        vf = self.factors["valid_from"]
+        self._co2_kg  = None if (vf == vf.dt.normalize()).all() else np.zeros((0, 0))
+
+    # ── Accumulation ──────────────────────────────────────────────────────────
+    @staticmethod
+    def _codes(names, mapping: Dict[str, int]) -> np.ndarray:
+        """Global codes of a batch's distinct names (new names get the next codes)."""
+        for name in names:
+            mapping.setdefault(str(name), len(mapping))
+        return np.array([mapping[str(n)] for n in names], dtype=np.int64)
+
+    def _grow(self, n_sources: int, n_sites: int, day_lo: int, day_hi: int) -> None:
+        """Enlarge the arrays to hold these sources, sites and days [day_lo, day_hi]."""
+        if self.day0 is None:
+            self.day0 = day_lo
+        before = max(0, self.day0 - day_lo)
+        after  = max(0, day_hi - (self.day0 + self.kwh.shape[2] - 1))
+        pad_src, pad_site = n_sources - self.kwh.shape[0], n_sites - self.kwh.shape[1]
+        if before or after or pad_src > 0 or pad_site > 0:
+            if after:                                          # grow by at least a month at a time
+                after = max(after, 31)
+            self.kwh   = np.pad(self.kwh, ((0, max(pad_src, 0)), (0, max(pad_site, 0)), (before, after), (0, 0)))
+            self.count = np.pad(self.count, ((0, max(pad_site, 0)), (before, after)))
+            if self._co2_kg is not None:
+                self._co2_kg = np.pad(self._co2_kg, ((0, max(pad_site, 0)), (before, after)))
+            self.day0 -= before
+
+    def add(self, timestamps, site_idx: np.ndarray, site_names, kwh: np.ndarray,
+            source_idx: Optional[np.ndarray] = None, source_names=None) -> None:
+        """
+        Add one batch. timestamps: datetime64 / int64 ns; sites (and sources) as
+        dictionary codes + names, as produced by pd.factorize or pyarrow dictionary_encode.
+        Readings with a missing timestamp (NaT) or kWh are skipped and counted in `dropped`.
+        """
+        ts   = np.asarray(timestamps).astype("datetime64[ns]")
+        kwh  = np.asarray(kwh, dtype=float)
+        if not len(ts):
+            return
+        ok = np.isfinite(kwh) & ~np.isnat(ts)
+        self.dropped += int(len(ts) - ok.sum())
+        if not ok.any():
+            return
+        ts   = ts.astype(np.int64)
+        hour = ts // NS_PER_HOUR
+        day  = hour // 24
+        peak = self.peak[((day + EPOCH_WEEKDAY) % 7) * 24 + hour % 24]
+
+        site = self._codes(site_names, self.sites)[site_idx]
+        if source_idx is None:
+            src = np.full(len(ts), self._codes([self.default_source], self.sources)[0])
+        else:
+            src = self._codes(source_names, self.sources)[source_idx]
+        self._grow(len(self.sources), len(self.sites), int(day[ok].min()), int(day[ok].max()))
+
+        n_src, n_site, n_day, _ = self.kwh.shape
+        d    = day - self.day0
+        cell = site * n_day + d
+        flat = ((src * n_site * n_day + cell) * 2 + peak)[ok]
+        self.kwh   += np.bincount(flat, weights=kwh[ok], minlength=self.kwh.size).reshape(self.kwh.shape)
+        self.count += np.bincount(cell[ok], minlength=self.count.size).reshape(self.count.shape)
+        if self._co2_kg is not None:                          # intraday factor changes: per reading
+            names  = np.array(list(self.sources))[src[ok]]
+            sites  = np.array(list(self.sites))[site[ok]]
+            kg     = kwh[ok] * cb.lookup_factors(names, sites, ts[ok].astype("datetime64[ns]"), self.factors)
+            kg     = np.where(kwh[ok] == 0, 0.0, kg)             # NaN = no factor for these kWh
+            self._co2_kg += np.bincount(cell[ok], weights=kg,
+                                        minlength=self._co2_kg.size).reshape(self._co2_kg.shape)
+        self.rows += int(ok.sum())
+
+    # ── Results ───────────────────────────────────────────────────────────────
+    def _co2_by_day(self) -> np.ndarray:
+        """kg CO₂e per (site, day); NaN where some kWh had no emission factor."""
+        if self._co2_kg is not None:
+            return self._co2_kg
+        n_src, n_site, n_day, _ = self.kwh.shape
+        src, site, day = np.meshgrid(np.arange(n_src), np.arange(n_site), np.arange(n_day), indexing="ij")
+        dates  = (self.day0 + day.ravel()).astype("datetime64[D]")
+        factor = cb.lookup_factors(np.array(list(self.sources))[src.ravel()],
+                                   np.array(list(self.sites))[site.ravel()], dates, self.factors)
+        kwh = self.kwh.sum(axis=3)
+        kg  = np.where(kwh == 0, 0.0, kwh * factor.reshape(n_src, n_site, n_day))
+        return kg.sum(axis=0)
+
+    def _days(self) -> pd.DatetimeIndex:
+        n_day = self.count.shape[1]
+        return pd.DatetimeIndex(((self.day0 or 0) + np.arange(n_day)).astype("datetime64[D]")).astype("datetime64[ns]")
+
+    def _table(self, starts: pd.DatetimeIndex, first_day: np.ndarray, freq: str) -> pd.DataFrame:
+        """One row per (site, period with readings); period p covers days first_day[p]:first_day[p + 1]."""
+        total = self.kwh.sum(axis=0)                                     # site × day × peak
+        def per_period(x: np.ndarray) -> np.ndarray:                    # site × day → site × period
+            return np.add.reduceat(x, first_day, axis=1) if x.shape[1] else x
+        peak_kwh = per_period(total[:, :, 1])
+        off_kwh  = per_period(total[:, :, 0])
+        co2      = per_period(self._co2_by_day())
+        count    = per_period(self.count)
+
+        site_i, per_i = np.nonzero(count)
+        energie = peak_kwh[site_i, per_i] + off_kwh[site_i, per_i]
+        out = pd.DataFrame({
+            SITE_COL:              np.array(list(self.sites), dtype=object)[site_i],
+            "mois_label":          [format_period_label(starts[p], freq) for p in per_i],
+            "mois_idx":            pd.Series(site_i).groupby(site_i).cumcount().to_numpy(),
+            "date":                starts[per_i],
+            "energie":             np.round(energie, 3),
+            "co2":                 np.round(co2[site_i, per_i] / cb.KG_PER_T, 4),
+            "energie_pointe":      np.round(peak_kwh[site_i, per_i], 3),
+            "energie_hors_pointe": np.round(off_kwh[site_i, per_i], 3),
+            "part_pointe":         np.round(np.divide(peak_kwh[site_i, per_i], energie,
+                                                      out=np.zeros(len(site_i)), where=energie > 0), 4),
+            "n_releves":           count[site_i, per_i],
+        })
+        return out[DAILY_COLUMNS].sort_values(SITE_COL, kind="stable").reset_index(drop=True)
+
+    def daily(self) -> pd.DataFrame:
+        """Dashboard frame, one row per (site, day): energie (kWh), co2 (T), peak split, n_releves."""
+        days = self._days()
+        return self._table(days, np.arange(len(days)), "D")
+
+    def monthly(self) -> pd.DataFrame:
+        """Same as daily(), one row per (site, month)."""
+        months = self._days().to_period("M").start_time
+        first  = np.flatnonzero(np.r_[True, months[1:] != months[:-1]]) if len(months) else np.arange(0)
+        return self._table(months[first], first, "M")
+
+
+# ── Readers: record batches of (timestamps, site codes, kWh, source codes) ────
+def _arrow_batches(path: str, columns: Dict[str, str], chunk_rows: int) -> Iterator:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+
+    if path.endswith((".parquet", ".pq")):
+        pf = pq.ParquetFile(path)
+        batches = pf.iter_batches(batch_size=chunk_rows,
+                                  columns=[c for c in columns.values() if c in pf.schema_arrow.names])
+    else:
+        batches = pacsv.open_csv(
+            path,
+            read_options=pacsv.ReadOptions(block_size=max(1 << 20, chunk_rows * 48)),
+            convert_options=pacsv.ConvertOptions(
+                column_types={columns["timestamp"]: pa.timestamp("ns"), columns["kwh"]: pa.float64(),
+                              columns["site"]: pa.string(), columns["source"]: pa.string()}))
+    for batch in batches:
+        names = batch.schema.names
+        site  = batch.column(columns["site"]).dictionary_encode()
+        ts    = batch.column(columns["timestamp"]).cast(pa.timestamp("ns"))
+        src = batch.column(columns["source"]).dictionary_encode() if columns["source"] in names else None
+        yield (ts.to_numpy(zero_copy_only=False),
+               site.indices.to_numpy(zero_copy_only=False), site.dictionary.to_pylist(),
+               batch.column(columns["kwh"]).to_numpy(zero_copy_only=False),
+               None if src is None else src.indices.to_numpy(zero_copy_only=False),
+               None if src is None else src.dictionary.to_pylist())
+
+
+def _pandas_batches(path: str, columns: Dict[str, str], chunk_rows: int) -> Iterator:
+    for chunk in pd.read_csv(path, chunksize=chunk_rows):
+        site_idx, site_names = pd.factorize(chunk[columns["site"]].astype(str))
+        src_idx, src_names   = (pd.factorize(chunk[columns["source"]].astype(str))
+                                if columns["source"] in chunk.columns else (None, None))
+        yield (pd.to_datetime(chunk[columns["timestamp"]]).to_numpy(dtype="datetime64[ns]"),
+               site_idx, list(site_names), chunk[columns["kwh"]].to_numpy(dtype=float),
+               src_idx, None if src_names is None else list(src_names))
+
+
+def read_batches(path: str, columns: Optional[Dict[str, str]] = None, chunk_rows: int = CHUNK_ROWS) -> Iterator:
+    """Record batches of a CSV / Parquet reading file (Parquet needs pyarrow)."""
+    columns = {**DEFAULT_COLUMNS, **(columns or {})}
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        if path.endswith((".parquet", ".pq")):
+            raise ImportError("pyarrow est requis pour lire des fichiers Parquet")
+        return _pandas_batches(path, columns, chunk_rows)
+    return _arrow_batches(path, columns, chunk_rows)
+
+
+def ingest(path: str, columns: Optional[Dict[str, str]] = None, chunk_rows: int = CHUNK_ROWS,
+           aggregator: Optional[MeterAggregator] = None, **kwargs) -> MeterAggregator:
+    """
+    Stream a reading file into an aggregator (a new MeterAggregator(**kwargs) by default,
+    or an existing one to append a further file). Returns the aggregator.
+    """
+    agg = aggregator or MeterAggregator(**kwargs)
+    for batch in read_batches(path, columns, chunk_rows):
+        agg.add(*batch)
+    return agg
+
+
+def simulate_readings(n_sites: int = 50, days: int = 31, start: str = "2024-01-01",
+                      step_minutes: int = 15, seed: int = 42) -> pd.DataFrame:
+    """Interval readings with a daily load curve, for tests and the CLI."""
+    rng   = np.random.default_rng(seed)
+    times = pd.date_range(start, periods=days * 24 * 60 // step_minutes, freq=f"{step_minutes}min")
+    hour  = times.hour.to_numpy() + times.minute.to_numpy() / 60
+    curve = 1 + 0.6 * np.exp(-((hour - 19) ** 2) / 8) + 0.3 * np.exp(-((hour - 11) ** 2) / 6)
+    size  = rng.lognormal(0, 0.4, n_sites)
+    kwh   = (size[:, None] * curve[None, :] * 12 * step_minutes / 60
+             * rng.gamma(20, 0.05, (n_sites, len(times))))
+    return pd.DataFrame({
+        "timestamp": np.tile(times, n_sites),
+        "site":      np.repeat([f"Site {i + 1:02d}" for i in range(n_sites)], len(times)),
+        "kwh":       kwh.ravel().round(3),
+        "source":    np.where(rng.random(n_sites * len(times)) < 0.85, "electricite", "gaz"),
+    })
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+
+    parser = argparse.ArgumentParser(description="Stream 15-minute meter readings into daily / monthly KPIs.")
+    parser.add_argument("path", nargs="?", default=None, help="CSV / Parquet file (default: simulated)")
+    parser.add_argument("--sites",  type=int, default=200, help="simulated sites")
+    parser.add_argument("--days",   type=int, default=180, help="simulated days")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="parquet")
+    parser.add_argument("--chunk",  type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(), f"releves_{args.sites}x{args.days}.{args.format}")
+        if not os.path.exists(path):
+            sim = simulate_readings(args.sites, args.days)
+            sim.to_parquet(path, index=False) if args.format == "parquet" else sim.to_csv(path, index=False)
+            del sim
+
+    tracemalloc.start()
+    t0  = time.perf_counter()
+    agg = ingest(path, chunk_rows=args.chunk)
+    dt  = time.perf_counter() - t0
+    peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    print(f"{agg.rows:,} relevés ({agg.dropped:,} ignorés) · {len(agg.sites)} sites · {dt:.2f}s "
+          f"({agg.rows / dt / 1e6:.1f} M relevés/s) · pic mémoire Python {peak_mb:.0f} Mo")
+    print(agg.monthly().head(6).to_string(index=False))
@@ -0,0 +1,127 @@
+"""
+parallel.py
+Execution layer shared by the batch paths (scoring, anomaly detection, forecasting,
+change points, backtests): one `map_tasks` call that runs a list of independent
+tasks serially, on threads or on worker processes, in task order.
+
+  - n_jobs      None → KPI_N_JOBS environment variable (default 1), -1 → all cores,
+                -2 → all but one, … (joblib convention)
+  - chunking    work is split by whole sites (`site_groups`, `site_blocks`) or by
+                contiguous time blocks (`blocks`)
+  - BLAS        workers run with BLAS / OpenMP pools capped at cores // workers,
+                so n workers × n BLAS threads never oversubscribe the machine
+  - seeds       randomized models use RANDOM_STATE per task, never a per-worker RNG
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_generator import SITE_COL
+
+
+BACKENDS     = ["serial", "thread", "process"]
+RANDOM_STATE = 42
+JOBS_ENV     = "KPI_N_JOBS"
+BLAS_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                 "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+
+def cpu_count() -> int:
+    """Cores available to this process (respects CPU affinity / container limits)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def n_workers(n_jobs: Optional[int] = None) -> int:
+    """Number of workers for n_jobs (None → $KPI_N_JOBS or 1; negative → cores + 1 + n_jobs)."""
+    if n_jobs is None:
+        n_jobs = int(os.environ.get(JOBS_ENV, "1"))
+    if n_jobs < 0:
+        n_jobs = cpu_count() + 1 + n_jobs
+    return max(1, n_jobs)
+
+
+def blocks(items: Sequence, n_blocks: int) -> List[list]:
+    """Split items into at most n_blocks contiguous, non-empty blocks of near-equal size."""
+    n_blocks = max(1, min(n_blocks, len(items)))
+    return [b.tolist() for b in np.array_split(np.asarray(items), n_blocks) if len(b)]
+
+
+def site_groups(df: pd.DataFrame, site_col: str = SITE_COL, sort: bool = False) -> List[Tuple]:
+    """[(site, site frame)] of a long frame, or [("", df)] for a single-site frame."""
+    if site_col not in df.columns:
+        return [("", df)]
+    return list(df.groupby(site_col, sort=sort))
+
+
+def site_blocks(df: pd.DataFrame, n_blocks: int, site_col: str = SITE_COL) -> List[pd.DataFrame]:
+    """Row subsets of df holding whole sites, for tasks that need a site's full history."""
+    if site_col not in df.columns or n_blocks <= 1:
+        return [df]
+    codes, sites = pd.factorize(df[site_col], sort=False)
+    return [df[np.isin(codes, block)] for block in blocks(np.arange(len(sites)), n_blocks)]
+
+
+# ── BLAS / OpenMP thread pools ───────────────────────────────────────────────
+def limit_blas_threads(n_threads: int = 1) -> None:
+    """
+    Cap native thread pools in this process: environment variables for libraries
+    loaded later, threadpoolctl (installed with scikit-learn) for those already loaded.
+    Called by worker_init in every worker process.
+    """
+    for var in BLAS_ENV_VARS:
+        os.environ[var] = str(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(n_threads)
+
+
+def worker_init(n_threads: int = 1) -> None:
+    """Process-pool initializer: no nested pools (n_jobs=None → 1) and capped BLAS threads."""
+    os.environ[JOBS_ENV] = "1"
+    limit_blas_threads(n_threads)
+
+
+@contextmanager
+def blas_threads(n_threads: int):
+    """Temporarily cap native thread pools (thread backend: the pools are process-wide)."""
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        limiter = nullcontext()
+    else:
+        limiter = threadpool_limits(n_threads)
+    with limiter:
+        yield
+
+
+# ── Task execution ───────────────────────────────────────────────────────────
+def map_tasks(fn: Callable, tasks: Iterable, n_jobs: Optional[int] = None, backend: str = "process",
+              chunksize: Optional[int] = None) -> list:
+    """
+    [fn(task) for task in tasks], possibly in parallel; results keep task order.
+    backend: "process" for Python-heavy work (fn and tasks must be picklable),
+             "thread" for NumPy / compiled work that releases the GIL, "serial".
+    Falls back to serial for one worker or one task.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend inconnu : {backend} (attendu : {', '.join(BACKENDS)})")
+    tasks = list(tasks)
+    n = min(n_workers(n_jobs), len(tasks))
+    if backend == "serial" or n <= 1:
+        return [fn(t) for t in tasks]
+
+    per_worker = max(1, cpu_count() // n)
+    if backend == "thread":
+        with blas_threads(per_worker), ThreadPoolExecutor(max_workers=n) as pool:
+            return list(pool.map(fn, tasks))
+    with ProcessPoolExecutor(max_workers=n, initializer=worker_init, initargs=(per_worker,)) as pool:
+        return list(pool.map(fn, tasks, chunksize=chunksize or max(1, len(tasks) // (4 * n))))
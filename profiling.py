@@ -0,0 +1,309 @@
+"""
+profiling.py
+Opt-in profiling of pipeline runs (scoring, anomaly detection, forecasting),
+for renders and batch jobs that are slow on production-sized data.
+
+Each profiled run writes one directory <KPI_PROFILE_DIR>/<name>-<timestamp>-<pid>/:
+  - cprofile.pstats   cProfile stats (pstats / snakeviz)
+  - cprofile.txt      top functions by cumulative time
+  - tracemalloc.txt   top allocation sites at the end of the run, peak traced memory
+  - stacks.collapsed  sampled call stacks, "root;…;leaf count" (flamegraph.pl, speedscope)
+  - summary.json      wall / CPU time, peak memory, per-function and per-line totals,
+                      read by `compare` to diff two runs
+
+Profiling is off unless asked for:
+    KPI_PROFILE=1            app renders and batch CLIs (`maybe_profile`) are profiled
+    KPI_PROFILE_DIR          output directory (default "profiles")
+    reports.py --profile     same, for one batch export
+
+Only the calling thread is profiled; work sent to worker processes (n_jobs > 1)
+shows up as time spent waiting in parallel.map_tasks. `run` therefore runs the
+pipeline serially. Overhead: cProfile ~2×, tracemalloc ~4× more (each traced frame
+adds to it), so compare runs recorded with the same settings; trace_frames=0
+skips memory tracing when only timings are needed.
+
+Usage:
+    python profiling.py run --sites 200 --name before
+    python profiling.py compare profiles/before-… profiles/after-… --fail-above 20
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+import pandas as pd
+
+
+PROFILE_ENV     = "KPI_PROFILE"
+PROFILE_DIR_ENV = "KPI_PROFILE_DIR"
+SAMPLE_INTERVAL = 0.005     # seconds between stack samples
+TRACE_FRAMES    = 1         # tracemalloc frames kept per allocation (0 = no memory tracing)
+TOP_N           = 40        # rows of the text reports
+
+ROOT = Path(__file__).resolve().parent
+
+# tracemalloc is process-wide: one profiled run at a time, others run unprofiled
+_ACTIVE = threading.Lock()
+
+
+def enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+@functools.lru_cache(maxsize=None)
+def _where(filename: str) -> str:
+    """Machine-independent location: repo-relative, or relative to site-packages / the stdlib."""
+    path = Path(filename)
+    try:
+        return path.resolve().relative_to(ROOT).as_posix()
+    except (ValueError, OSError):
+        pass
+    parts = path.parts
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            return "/".join(parts[parts.index(marker) + 1:])
+    return path.name if path.suffix else filename
+
+
+def _func_key(func) -> str:
+    filename, line, name = func
+    return name if filename == "~" else f"{_where(filename)}:{line}({name})"
+
+
+class StackSampler:
+    """Samples one thread's call stack every `interval` seconds into collapsed-stack counts (one frame per function)."""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id, self.interval = thread_id, interval
+        self.counts: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self) -> None:
+        # Code objects only while sampling; names are formatted in write()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            if stack:
+                self.counts[tuple(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.counts.most_common():
+                frames = (f"{c.co_name} ({_where(c.co_filename)}:{c.co_firstlineno})" for c in stack)
+                f.write(f"{';'.join(frames)} {count}\n")
+
+
+# ── Profiled run ─────────────────────────────────────────────────────────────
+@contextmanager
+def profile_run(name: str, out_dir: Optional[str] = None, interval: float = SAMPLE_INTERVAL,
+                trace_frames: int = TRACE_FRAMES) -> Iterator[Optional[Path]]:
+    """
+    Profile the enclosed block (cProfile + tracemalloc + stack sampling) and write
+    its run directory, which is yielded. If another run is already being profiled,
+    None is yielded and the block runs unprofiled (nothing is written).
+    """
+    out = Path(out_dir or os.environ.get(PROFILE_DIR_ENV) or "profiles")
+    run_dir = out / f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    if not _ACTIVE.acquire(blocking=False):
+        yield None
+        return
+    try:
+        was_tracing = tracemalloc.is_tracing()
+        if trace_frames and not was_tracing:
+            tracemalloc.start(trace_frames)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        sampler  = StackSampler(threading.get_ident(), interval)
+        profiler = cProfile.Profile()
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        sampler.start()
+        profiler.enable()
+        try:
+            yield run_dir
+        finally:
+            profiler.disable()
+            wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+            sampler.stop()
+            snapshot = tracemalloc.take_snapshot() if tracing else None
+            peak     = tracemalloc.get_traced_memory()[1] if tracing else 0
+            if tracing and not was_tracing:
+                tracemalloc.stop()
+            _write_run(run_dir, name, profiler, sampler, snapshot, wall, cpu, peak, trace_frames)
+    finally:
+        _ACTIVE.release()
+
+
+def maybe_profile(name: str, force: bool = False, out_dir: Optional[str] = None):
+    """profile_run(name) when KPI_PROFILE is set (or force), else a no-op context."""
+    return profile_run(name, out_dir) if force or enabled() else nullcontext()
+
+
+def _write_run(run_dir: Path, name: str, profiler: cProfile.Profile, sampler: StackSampler,
+               snapshot: Optional[tracemalloc.Snapshot], wall: float, cpu: float, peak: int,
+               trace_frames: int) -> None:
+    run_dir.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(run_dir / "cprofile.pstats")
+
+    text  = io.StringIO()
+    stats = pstats.Stats(profiler, stream=text)
+    stats.sort_stats("cumulative").print_stats(TOP_N)
+    (run_dir / "cprofile.txt").write_text(text.getvalue(), encoding="utf-8")
+
+    by_line = []
+    if snapshot is not None:
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                           tracemalloc.Filter(False, __file__)])
+        by_line  = snapshot.statistics("lineno")
+        lines    = [f"peak traced memory: {peak / 2**20:.1f} MiB", ""]
+        for stat in snapshot.statistics("traceback")[:TOP_N]:
+            lines.append(f"{stat.size / 1024:10.1f} KiB  {stat.count:7d} blocks")
+            lines.extend(f"    {line}" for line in stat.traceback.format())
+        (run_dir / "tracemalloc.txt").write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    sampler.write(run_dir / "stacks.collapsed")
+
+    functions = {_func_key(func): {"ncalls": nc, "tottime": round(tt, 6), "cumtime": round(ct, 6)}
+                 for func, (_, nc, tt, ct, _) in stats.stats.items()}
+    allocations = {f"{_where(s.traceback[0].filename)}:{s.traceback[0].lineno}": s.size
+                   for s in by_line[:500]}
+    summary = {
+        "name": name, "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(time.time() - wall)),
+        "wall_s": round(wall, 4), "cpu_s": round(cpu, 4), "peak_bytes": peak,
+        "samples": sum(sampler.counts.values()), "trace_frames": trace_frames, "python": sys.version.split()[0],
+        "functions": functions, "allocations": allocations,
+    }
+    (run_dir / "summary.json").write_text(json.dumps(summary, indent=1), encoding="utf-8")
+
+
+# ── Pipeline ─────────────────────────────────────────────────────────────────
+def run_pipeline(df: pd.DataFrame, n_periods: int = 3) -> Dict:
+    """
+    Full serial pipeline of a KPI frame: score history and explanations, forecasts,
+    residual z-score / Isolation Forest anomalies (per site for a multi-site frame).
+    """
+    import anomaly_detector as ad
+    import forecaster as fc
+    import score_engine as se
+    from data_generator import SITE_COL
+
+    out = {"scores": se.score_history(df, n_jobs=1), "explain": se.explain_scores(df)}
+    if SITE_COL in df.columns:
+        out["forecasts"] = fc.forecast_sites(df, n_periods=n_periods, n_jobs=1)
+        out["anomalies"] = ad.anomaly_rows_by_site(df, n_jobs=1)
+    else:
+        out["forecasts"] = fc.forecast_all_kpis(df, n_periods=n_periods)
+        out["anomalies"] = ad.get_all_anomaly_rows(df, fits=out["forecasts"])
+    return out
+
+
+# ── Comparison ───────────────────────────────────────────────────────────────
+def load_summary(run) -> Dict:
+    path = Path(run)
+    return json.loads((path / "summary.json" if path.is_dir() else path).read_text(encoding="utf-8"))
+
+
+def _pct(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else float("inf") if after else 0.0
+
+
+def compare(before, after, top: int = 15, min_delta: float = 0.005) -> Dict:
+    """
+    Differences between two runs (run directories or summary.json paths):
+    totals, the functions whose cumulative / own time changed most (≥ min_delta s)
+    and the allocation sites whose retained memory changed most.
+    """
+    a, b = load_summary(before), load_summary(after)
+    totals = {k: (a[k], b[k], _pct(a[k], b[k])) for k in ("wall_s", "cpu_s", "peak_bytes")}
+
+    zero = {"ncalls": 0, "tottime": 0.0, "cumtime": 0.0}
+    funcs = []
+    for key in set(a["functions"]) | set(b["functions"]):
+        fa, fb = a["functions"].get(key, zero), b["functions"].get(key, zero)
+        delta = fb["cumtime"] - fa["cumtime"]
+        if max(abs(delta), abs(fb["tottime"] - fa["tottime"])) >= min_delta:
+            funcs.append((key, fa, fb, delta))
+    funcs.sort(key=lambda f: -abs(f[3]))
+
+    allocs = [(key, a["allocations"].get(key, 0), b["allocations"].get(key, 0))
+              for key in set(a["allocations"]) | set(b["allocations"])]
+    allocs.sort(key=lambda r: -abs(r[2] - r[1]))
+    return {"before": a["name"], "after": b["name"], "totals": totals,
+            "same_settings": a.get("trace_frames") == b.get("trace_frames"),
+            "functions": funcs[:top], "allocations": allocs[:top]}
+
+
+def format_comparison(diff: Dict) -> str:
+    lines = [f"{diff['before']} → {diff['after']}", ""]
+    if not diff["same_settings"]:
+        lines += ["⚠️ profondeur tracemalloc différente : les temps ne sont pas comparables", ""]
+    for key, (x, y, pct) in diff["totals"].items():
+        unit = 2**20 if key == "peak_bytes" else 1
+        label = {"wall_s": "temps réel (s)", "cpu_s": "temps CPU (s)", "peak_bytes": "pic mémoire (MiB)"}[key]
+        lines.append(f"{label:20s} {x / unit:10.3f} → {y / unit:10.3f}  ({pct:+.1f} %)")
+    lines += ["", f"{'cumul avant':>12s} {'après':>9s} {'Δ':>9s} {'propre Δ':>9s} {'appels':>15s}  fonction"]
+    for key, fa, fb, delta in diff["functions"]:
+        lines.append(f"{fa['cumtime']:12.3f} {fb['cumtime']:9.3f} {delta:+9.3f} "
+                     f"{fb['tottime'] - fa['tottime']:+9.3f} {fa['ncalls']:>7d}→{fb['ncalls']:<7d}  {key}")
+    lines += ["", f"{'KiB avant':>12s} {'après':>9s} {'Δ':>9s}  allocation"]
+    for key, x, y in diff["allocations"]:
+        lines.append(f"{x / 1024:12.1f} {y / 1024:9.1f} {(y - x) / 1024:+9.1f}  {key}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Profile a pipeline run, or diff two profiled runs.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run", help="profile score / anomaly / forecast pipeline on simulated or CSV data")
+    run.add_argument("--sites", type=int, default=50, help="simulated sites (ignored with --csv)")
+    run.add_argument("--csv",   default=None, help="daily KPI export (data_generator.load_daily_csv)")
+    run.add_argument("--name",  default="pipeline")
+    run.add_argument("--out",   default=None, help="output directory (default $KPI_PROFILE_DIR or profiles)")
+    run.add_argument("--frames", type=int, default=TRACE_FRAMES, help="tracemalloc frames (0 = timings only)")
+    cmp = sub.add_parser("compare", help="diff two run directories")
+    cmp.add_argument("before")
+    cmp.add_argument("after")
+    cmp.add_argument("--top", type=int, default=15)
+    cmp.add_argument("--fail-above", type=float, default=None,
+                     help="exit code 1 if wall time grew by more than this many percent")
+    args = parser.parse_args()
+
+    if args.cmd == "run":
+        import data_generator as dg
+
+        data = dg.load_daily_csv(args.csv) if args.csv else dg.generate_multisite_data(args.sites)
+        with profile_run(args.name, args.out, trace_frames=args.frames) as run_dir:
+            run_pipeline(data)
+        if run_dir is None:
+            sys.exit("Un autre profilage est en cours dans ce processus.")
+        s = load_summary(run_dir)
+        print(f"{run_dir} · {s['wall_s']:.2f}s réel · {s['cpu_s']:.2f}s CPU · "
+              f"pic {s['peak_bytes'] / 2**20:.1f} MiB · {s['samples']} échantillons")
+    else:
+        diff = compare(args.before, args.after, args.top)
+        print(format_comparison(diff))
+        if args.fail_above is not None and diff["totals"]["wall_s"][2] > args.fail_above:
+            sys.exit(1)
@@ -0,0 +1,267 @@
+"""
+reports.py
+Bulk monthly reports for every (site, month), produced as a stream.
+Reports are written one at a time into a zip / tar archive, a summary CSV
+or a multi-sheet Excel workbook, so memory stays flat however many are sent.
+
+Usage:
+    python reports.py --sites 50 --out rapports.zip --format html
+    python reports.py --sites 50 --profile        # profiling.py run directory in ./profiles
+"""
+import csv
+import html
+import io
+import re
+import tarfile
+import zipfile
+from string import Template
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+import anomaly_detector as ad
+import score_engine as se
+from data_generator import SITE_COL
+
+
+# ── HTML template (print-ready: A4, no external assets) ──────────────────────
+HTML_TEMPLATE = Template("""<!DOCTYPE html>
+<html lang="fr">
+<head>
+<meta charset="utf-8">
+<title>Rapport $month — $site</title>
+<style>
+@page { size: A4; margin: 18mm; }
+body { font-family: 'Plus Jakarta Sans', Arial, sans-serif; color: #1a1d2e; font-size: 12px; }
+h1 { font-size: 20px; margin: 0 0 4px; color: #5b4fcf; }
+h2 { font-size: 14px; margin: 18px 0 6px; border-bottom: 1px solid #e5e9f2; padding-bottom: 3px; }
+table { border-collapse: collapse; width: 100%; }
+td { padding: 3px 6px; border-bottom: 1px solid #f0f2f8; }
+td.v { text-align: right; font-weight: 700; }
+.hero { display: flex; gap: 24px; margin: 10px 0; }
+.hero div { background: #f4f6fb; border-radius: 8px; padding: 8px 14px; }
+.hero b { font-size: 22px; display: block; }
+.lvl { font-weight: 700; text-transform: uppercase; font-size: 10px; }
+.critique { color: #dc2626; } .élevé { color: #ea580c; } .modéré { color: #ca8a04; }
+footer { margin-top: 24px; color: #9ca3af; font-size: 10px; }
+</style>
+</head>
+<body>
+<h1>Smart Impact Dashboard — Rapport $month</h1>
+<div>$site</div>
+<div class="hero">
+  <div>Score Global<b>$global_score/100</b></div>
+  <div>Sustainability Index<b>$sustainability_score/100</b></div>
+  <div>Bonus<b>+$bonus_points pts</b>$bonus_reason</div>
+</div>
+<h2>KPIs Clés</h2>
+<table>$kpi_rows</table>
+<h2>Scores par Dimension</h2>
+<table>$dimension_rows</table>
+<h2>Priorités</h2>
+<ol>$priority_items</ol>
+<h2>Recommandations</h2>
+<ul>$reco_items</ul>
+<footer>Généré par Smart Impact Dashboard</footer>
+</body>
+</html>
+""")
+
+KPI_ROWS = [
+    ("Chiffre d'affaires", "chiffre_affaires", "{:,.0f} €"),
+    ("Marge",              "marge",            "{:,.0f} €"),
+    ("Énergie",            "energie",          "{:,.0f} kWh"),
+    ("CO₂",                "co2",              "{:,.2f} T"),
+    ("Absentéisme",        "absenteisme",      "{:.1f}%"),
+    ("Satisfaction",       "satisfaction",     "{:.0f}/100"),
+    ("Productivité",       "productivite",     "{:.1f}%"),
+]
+
+
+def render_html_report(current, score_data, priorities, recommendations, month: str, site: str = "") -> str:
+    """Same content as score_engine.generate_report, as a standalone HTML page."""
+    esc = html.escape
+    kpi_rows = "".join(
+        f"<tr><td>{label}</td><td class='v'>{fmt.format(current[kpi])}</td></tr>"
+        for label, kpi, fmt in KPI_ROWS if kpi in current
+    )
+    dimension_rows = "".join(
+        f"<tr><td>{esc(k.capitalize())}</td><td class='v'>{v}/100</td></tr>"
+        for k, v in score_data["sub_scores"].items()
+    )
+    priority_items = "".join(
+        f"<li><span class='lvl {esc(p['level'])}'>{esc(p['level'])}</span> "
+        f"<b>{esc(p['title'])}</b><br>{esc(p['description'])}</li>"
+        for p in priorities
+    ) or "<li>Aucune priorité</li>"
+    reco_items = "".join(
+        f"<li><b>{esc(r['title'])}</b><br>{esc(r['description'])}</li>" for r in recommendations
+    ) or "<li>Aucune recommandation</li>"
+    return HTML_TEMPLATE.substitute(
+        month=esc(month), site=esc(site),
+        global_score=score_data["global_score"],
+        sustainability_score=score_data["sustainability_score"],
+        bonus_points=score_data["bonus_points"],
+        bonus_reason=esc(score_data["bonus_reason"]),
+        kpi_rows=kpi_rows, dimension_rows=dimension_rows,
+        priority_items=priority_items, reco_items=reco_items,
+    )
+
+
+# ── Report stream ─────────────────────────────────────────────────────────────
+def iter_reports(df: pd.DataFrame, fmt: str = "txt", site_col: str = SITE_COL,
+                 months: Optional[List[str]] = None) -> Iterator[Dict]:
+    """
+    Yield one report per (site, month), site by site.
+    Z-scores and the Isolation Forest are computed once per site, not once per month.
+    fmt: "txt" (score_engine.generate_report) or "html".
+    """
+    wanted = None if months is None else set(months)
+    groups = df.groupby(site_col, sort=False) if site_col in df.columns else [("", df)]
+    for site, site_df in groups:
+        site_df    = site_df.reset_index(drop=True)
+        zscores_df = ad.compute_residual_zscores(site_df)
+        if_labels  = ad.run_isolation_forest(site_df)
+
+        for idx in range(len(site_df)):
+            current  = site_df.iloc[idx]
+            previous = site_df.iloc[max(0, idx - 1)]
+            month    = current["mois_label"]
+            if wanted is not None and month not in wanted:
+                continue
+
+            score_data = se.compute_score(current, previous)
+            anomalies  = ad.detect_anomalies(current, previous, site_df, zscores_df, if_labels, idx)
+            priorities = ad.get_priorities(anomalies)
+            recos      = ad.get_recommendations(anomalies)
+            if fmt == "html":
+                content = render_html_report(current, score_data, priorities, recos, month, site)
+            else:
+                content = se.generate_report(current, previous, score_data, priorities, recos, month)
+
+            yield {
+                "site":                 site,
+                "month":                month,
+                "format":               fmt,
+                "global_score":         score_data["global_score"],
+                "sustainability_score": score_data["sustainability_score"],
+                "bonus_points":         score_data["bonus_points"],
+                "n_anomalies":          len(anomalies),
+                "content":              content,
+            }
+
+
+def _report_name(report: Dict) -> str:
+    stem = f"rapport_{report['month'].replace(' ', '_')}.{report['format']}"
+    return f"{report['site'].replace(' ', '_')}/{stem}" if report["site"] else stem
+
+
+# ── Writers: each consumes the stream one report at a time ───────────────────
+def write_zip(reports: Iterable[Dict], path) -> int:
+    """Write every report into a zip archive (one file per site/month). Returns the count."""
+    n = 0
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for r in reports:
+            zf.writestr(_report_name(r), r["content"])
+            n += 1
+    return n
+
+
+def write_tar(reports: Iterable[Dict], path) -> int:
+    """Write every report into a gzipped tar archive. Returns the count."""
+    n = 0
+    with tarfile.open(path, "w:gz") as tf:
+        for r in reports:
+            data = r["content"].encode("utf-8")
+            info = tarfile.TarInfo(_report_name(r))
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+            n += 1
+    return n
+
+
+SUMMARY_FIELDS = ["site", "month", "global_score", "sustainability_score", "bonus_points", "n_anomalies"]
+
+
+def write_summary_csv(reports: Iterable[Dict], path) -> int:
+    """One CSV row per report (scores only), written as the stream advances."""
+    n = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        for r in reports:
+            writer.writerow(r)
+            n += 1
+    return n
+
+
+def _sheet_name(site, used: set) -> str:
+    """Valid, unique Excel sheet name for a site: ≤ 31 chars, no []:*?/ or backslash, no edge quote."""
+    base = re.sub(r"[\[\]:*?/\\]", "_", str(site))[:31].strip().strip("'") or "Rapport"
+    name, i = base, 1
+    while name.lower() in used:
+        i += 1
+        suffix = f" ({i})"
+        name = base[:31 - len(suffix)] + suffix
+    used.add(name.lower())
+    return name
+
+
+def write_excel(reports: Iterable[Dict], path) -> int:
+    """
+    One sheet per site with its monthly scores (needs openpyxl).
+    Only the current site's rows are buffered, since the stream is grouped by site.
+    """
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        raise ImportError("L'export Excel nécessite openpyxl (pip install openpyxl)")
+
+    n, site, rows, used = 0, None, [], set()
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        def flush():
+            if rows:
+                pd.DataFrame(rows, columns=SUMMARY_FIELDS[1:]).to_excel(
+                    writer, sheet_name=_sheet_name(site, used), index=False)
+        for r in reports:
+            if r["site"] != site:
+                flush()
+                site, rows = r["site"], []
+            rows.append({k: r[k] for k in SUMMARY_FIELDS[1:]})
+            n += 1
+        flush()
+    return n
+
+
+WRITERS = {
+    ".zip":  write_zip,
+    ".gz":   write_tar,
+    ".tgz":  write_tar,
+    ".csv":  write_summary_csv,
+    ".xlsx": write_excel,
+}
+
+
+def export_reports(df: pd.DataFrame, path: str, fmt: str = "txt", site_col: str = SITE_COL) -> int:
+    """Stream every (site, month) report of df into `path`; the writer is chosen from its extension."""
+    ext = "." + path.rsplit(".", 1)[-1].lower()
+    if ext not in WRITERS:
+        raise ValueError(f"Format d'export non supporté : {ext} ({', '.join(WRITERS)})")
+    return WRITERS[ext](iter_reports(df, fmt=fmt, site_col=site_col), path)
+
+
+if __name__ == "__main__":
+    import argparse
+    import data_generator as dg
+    import profiling
+
+    parser = argparse.ArgumentParser(description="Bulk monthly report export")
+    parser.add_argument("--sites",  type=int, default=5)
+    parser.add_argument("--out",    default="rapports.zip", help=".zip, .tar.gz, .csv or .xlsx")
+    parser.add_argument("--format", default="txt", choices=["txt", "html"])
+    parser.add_argument("--profile", action="store_true", help="profile the export (see profiling.py; or KPI_PROFILE=1)")
+    args = parser.parse_args()
+
+    with profiling.maybe_profile("reports", force=args.profile):
+        count = export_reports(dg.generate_multisite_data(args.sites), args.out, fmt=args.format)
+    print(f"{count} rapport(s) écrits dans {args.out}")
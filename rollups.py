@@ -0,0 +1,111 @@
+"""
+rollups.py
+Pre-aggregated rollup tables of a KPI frame at every granularity
+(day, week, month, quarter, year). Built once per dataset; switching the
+dashboard view only slices a ready table, nothing is resampled per rerun.
+"""
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from data_generator import format_period_label, period_dates
+from forecaster import KPI_COLS, infer_frequency
+
+
+# ── Granularities, finest first: label → period code ─────────────────────────
+GRANULARITIES = {
+    "Jour":      "D",
+    "Semaine":   "W",
+    "Mois":      "M",
+    "Trimestre": "Q",
+    "Année":     "Y",
+}
+
+# Volumes add up over a period; rates and scores are averaged
+AGGREGATIONS = {
+    "chiffre_affaires": "sum",
+    "marge":            "sum",
+    "energie":          "sum",
+    "co2":              "sum",
+    "absenteisme":      "mean",
+    "satisfaction":     "mean",
+    "productivite":     "mean",
+}
+
+
+def _period_start(dates: pd.DatetimeIndex, freq: str) -> pd.DatetimeIndex:
+    """Start date of the period each date falls in (weeks start on Monday)."""
+    dates = dates.normalize()
+    if freq == "D":
+        return dates
+    if freq == "W":
+        return dates - pd.to_timedelta(dates.weekday, unit="D")
+    return dates.to_period(freq).start_time
+
+
+def _next_start(starts: pd.DatetimeIndex, freq: str) -> pd.DatetimeIndex:
+    """Start of the following period (= exclusive end of each period)."""
+    if freq in ("D", "W"):
+        return starts + pd.Timedelta(days=7 if freq == "W" else 1)
+    return (starts.to_period(freq) + 1).start_time
+
+
+def rollup(df: pd.DataFrame, freq: str, base: Optional[str] = None) -> pd.DataFrame:
+    """
+    Aggregate a KPI frame to one row per period of `freq`.
+    Adds "n_obs" (rows aggregated) and "coverage" (share of the period inside the
+    data's date range). The first / last periods are usually partial (data ending on
+    a Tuesday leaves a 2-day week): their volumes are scaled to the full period, so
+    they compare with complete periods. base: the data's own frequency (inferred if None).
+    """
+    kpis  = [k for k in KPI_COLS if k in df.columns]
+    dates = period_dates(df)
+    base  = base or infer_frequency(df)
+    start = _period_start(dates, freq)
+    grouped = df[kpis].groupby(start.values)
+    table = grouped.agg({k: AGGREGATIONS[k] for k in kpis})
+    table["n_obs"] = grouped.size()
+
+    # Days of each period inside [first period of the data, end of its last period)
+    starts = pd.DatetimeIndex(table.index)
+    ends   = _next_start(starts, freq)
+    lo     = _period_start(pd.DatetimeIndex([dates.min()]), base)[0]
+    hi     = _next_start(_period_start(pd.DatetimeIndex([dates.max()]), base), base)[0]
+    coverage = ((ends.where(ends < hi, hi) - starts.where(starts > lo, lo)).days
+                / (ends - starts).days).to_numpy(dtype=float)
+    volumes  = [k for k in kpis if AGGREGATIONS[k] == "sum"]
+    partial  = coverage < 1
+    if partial.any() and volumes:
+        table.loc[partial, volumes] = table.loc[partial, volumes].div(coverage[partial], axis=0)
+    table["coverage"] = np.round(coverage, 4)
+
+    table.index.name = "date"
+    table = table.reset_index()
+    table.insert(0, "mois_label", [format_period_label(d, freq) for d in table["date"]])
+    table.insert(1, "mois_idx", np.arange(len(table)))
+    return table
+
+
+def build_rollups(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Rollup tables for every granularity at or above the data's own frequency.
+    Returns { "Jour": ..., "Semaine": ..., ... } in GRANULARITIES order.
+    """
+    base  = infer_frequency(df)
+    codes = list(GRANULARITIES.values())
+    return {label: rollup(df, code, base) for label, code in GRANULARITIES.items()
+            if codes.index(code) >= codes.index(base)}
+
+
+def select_range(table: pd.DataFrame, start: Optional[pd.Timestamp] = None,
+                 end: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """Rows of a rollup table whose period starts within [start, end], re-indexed from 0."""
+    mask = np.ones(len(table), dtype=bool)
+    if start is not None:
+        mask &= table["date"].values >= np.datetime64(pd.Timestamp(start))
+    if end is not None:
+        mask &= table["date"].values <= np.datetime64(pd.Timestamp(end))
+    out = table[mask].reset_index(drop=True)
+    out["mois_idx"] = np.arange(len(out))
+    return out
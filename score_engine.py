@@ -1,8 +1,17 @@
 """
 score_engine.py
 Computes the global composite score (0–100) and sub-scores.
+score_history does the same for every row of a (multi-site) history in one vectorized pass,
+explain_scores breaks each period's score change down by KPI.
 """
+from typing import List, Optional
+
 import numpy as np
+import pandas as pd
+
+import parallel
+import shared_arrays as sa
+from data_generator import SITE_COL
 
 
 # ── Weights for global score ──────────────────────────────────────────────────
@@ -48,10 +57,16 @@ def compute_score(current, previous) -> dict:
     )
     energie_score = _normalize(e_growth, THRESHOLDS["energie_growth"][0], THRESHOLDS["energie_growth"][2])
     co2_score     = _normalize(co2_growth, THRESHOLDS["co2_growth"][0], THRESHOLDS["co2_growth"][2])
-    rh_score = (
-        _normalize(current["absenteisme"], THRESHOLDS["absenteisme_abs"][0], THRESHOLDS["absenteisme_abs"][2]) * 0.5 +
-        _normalize(current["productivite"], THRESHOLDS["productivite_abs"][2], THRESHOLDS["productivite_abs"][0]) * 0.5
-    )
+    abs_score = _normalize(current["absenteisme"], THRESHOLDS["absenteisme_abs"][0], THRESHOLDS["absenteisme_abs"][2])
+    productivite = current.get("productivite", np.nan)
+    if np.isnan(productivite):
+        # Datasets without a productivity KPI (e.g. the daily export): RH = absenteeism only
+        rh_score = abs_score
+    else:
+        rh_score = (
+            abs_score * 0.5 +
+            _normalize(productivite, THRESHOLDS["productivite_abs"][2], THRESHOLDS["productivite_abs"][0]) * 0.5
+        )
     sat_score = _normalize(current["satisfaction"], THRESHOLDS["satisfaction_abs"][0], THRESHOLDS["satisfaction_abs"][2])
 
     sub_scores = {
@@ -96,6 +111,201 @@ def compute_score(current, previous) -> dict:
     }
 
 
+# ── Vectorized scoring over a whole history ─────────────────────────────────
+SCORE_COLUMNS = ["global_score", "sustainability_score", "finance", "energie", "co2", "rh",
+                 "satisfaction", "bonus_points", "bonus_reason"]
+
+SCORED_KPIS = ["chiffre_affaires", "marge", "energie", "co2", "absenteisme", "satisfaction", "productivite"]
+GROWTH_KPIS = ["chiffre_affaires", "marge", "energie", "co2"]
+
+BONUS_REASONS = ["Aucun bonus ce mois", "CA + Marge en hausse ✅",
+                 "Énergie & CO₂ réduits 🌱", "Satisfaction excellente 😊"]
+BONUS_POINTS    = np.array([0, 5, 8, 4])
+BONUS_RULE_KPIS = [[], ["chiffre_affaires", "marge"], ["energie", "co2"], ["satisfaction"]]
+
+
+def _normalize_array(values: np.ndarray, good: float, bad: float) -> np.ndarray:
+    """Vectorized _normalize."""
+    if good == bad:
+        return np.full(np.shape(values), 50.0)
+    return np.clip((values - bad) / (good - bad) * 100, 0, 100)
+
+
+def previous_rows(df: pd.DataFrame, site_col: str = SITE_COL, kpis: List[str] = GROWTH_KPIS) -> pd.DataFrame:
+    """Row t-1 of the same site for every row; the first row of a site is its own previous."""
+    if site_col in df.columns:
+        prev = df.groupby(site_col, sort=False)[kpis].shift(1)
+    else:
+        prev = df[kpis].shift(1)
+    return prev.fillna(df[kpis])
+
+
+def int_scores(values: np.ndarray):
+    """Scores as int; nullable Int64 (<NA>) when a row is missing an input KPI."""
+    if np.isnan(values).any():
+        return pd.array(values, dtype="Int64")
+    return values.astype(int)
+
+
+def _score_arrays(df: pd.DataFrame, site_col: str) -> dict:
+    """Intermediate arrays of score_history: clipped KPI scores, sub-scores, global, bonus rule."""
+    prev = previous_rows(df, site_col)
+    cur  = {k: df[k].to_numpy(dtype=float) if k in df.columns else np.full(len(df), np.nan)
+            for k in SCORED_KPIS}
+    ca_growth  = (cur["chiffre_affaires"] - prev["chiffre_affaires"].to_numpy()) / prev["chiffre_affaires"].to_numpy() * 100
+    m_growth   = (cur["marge"] - prev["marge"].to_numpy()) / prev["marge"].to_numpy() * 100
+    e_growth   = (cur["energie"] - prev["energie"].to_numpy()) / prev["energie"].to_numpy() * 100
+    co2_growth = (cur["co2"] - prev["co2"].to_numpy()) / prev["co2"].to_numpy() * 100
+
+    kpi_scores = {
+        "chiffre_affaires": _normalize_array(ca_growth, THRESHOLDS["ca_growth"][0], THRESHOLDS["ca_growth"][2]),
+        "marge":            _normalize_array(m_growth,  THRESHOLDS["marge_growth"][0], THRESHOLDS["marge_growth"][2]),
+        "energie":          _normalize_array(e_growth, THRESHOLDS["energie_growth"][0], THRESHOLDS["energie_growth"][2]),
+        "co2":              _normalize_array(co2_growth, THRESHOLDS["co2_growth"][0], THRESHOLDS["co2_growth"][2]),
+        "absenteisme":      _normalize_array(cur["absenteisme"], THRESHOLDS["absenteisme_abs"][0], THRESHOLDS["absenteisme_abs"][2]),
+        "productivite":     _normalize_array(cur["productivite"], THRESHOLDS["productivite_abs"][2], THRESHOLDS["productivite_abs"][0]),
+        "satisfaction":     _normalize_array(cur["satisfaction"], THRESHOLDS["satisfaction_abs"][0], THRESHOLDS["satisfaction_abs"][2]),
+    }
+    k = kpi_scores
+    finance_score = k["chiffre_affaires"] * 0.6 + k["marge"] * 0.4
+    rh_score = np.where(np.isnan(cur["productivite"]), k["absenteisme"],
+                        k["absenteisme"] * 0.5 + k["productivite"] * 0.5)
+
+    # np.rint rounds half to even, like the built-in round() in compute_score
+    sub = {
+        "finance":      np.rint(finance_score),
+        "energie":      np.rint(k["energie"]),
+        "co2":          np.rint(k["co2"]),
+        "rh":           np.rint(rh_score),
+        "satisfaction": np.rint(k["satisfaction"]),
+    }
+    global_score = np.clip(np.rint(sum(sub[d] * WEIGHTS[d] for d in WEIGHTS)), 0, 100)
+    sustainability = np.rint(k["co2"] * 0.5 + k["energie"] * 0.3 + k["satisfaction"] * 0.2)
+
+    bonus_idx = np.select(
+        [(ca_growth > 3) & (m_growth > 2), (co2_growth < 0) & (e_growth < 0), cur["satisfaction"] >= 82],
+        [1, 2, 3], default=0,
+    )
+    return {"kpi_scores": kpi_scores, "sub": sub, "global_score": global_score,
+            "sustainability": sustainability, "bonus_idx": bonus_idx,
+            "has_productivite": ~np.isnan(cur["productivite"])}
+
+
+def _score_block(args) -> pd.DataFrame:
+    """Worker task: score_history of a run of whole sites of the shared KPI matrix."""
+    handle, lo, hi = args
+    block = sa.frame_view(handle, lo, hi, labels=False)
+    block[SITE_COL] = sa.open_array(handle)[lo:hi, -1]
+    return score_history(block, SITE_COL, 1)
+
+
+def score_history(df: pd.DataFrame, site_col: str = SITE_COL, n_jobs: Optional[int] = None,
+                  backend: str = "thread") -> pd.DataFrame:
+    """
+    compute_score for every row against the previous row of the same site,
+    in one pass of array operations. Returns a frame aligned on df.index.
+    Rows with a missing input KPI get <NA> scores (nullable Int64 columns).
+    n_jobs > 1 scores blocks of whole sites in parallel: on threads (NumPy releases
+    the GIL), or with backend="process" on workers reading a shared KPI matrix.
+    """
+    n_blocks = parallel.n_workers(n_jobs)
+    if n_blocks > 1 and site_col in df.columns and df.index.is_unique and df[site_col].nunique() > 1:
+        if backend == "process":
+            with sa.SharedKPIMatrix(df, SCORED_KPIS, site_col=site_col) as shared:
+                tasks = [(shared.handle, lo, hi) for lo, hi in shared.block_ranges(n_blocks)]
+                result = pd.concat(parallel.map_tasks(_score_block, tasks, n_blocks), ignore_index=True)
+            return result.set_axis(df.index[shared.order]).loc[df.index]
+        parts = parallel.map_tasks(lambda part: score_history(part, site_col, 1),
+                                   parallel.site_blocks(df, n_blocks, site_col), n_blocks, backend=backend)
+        return pd.concat(parts).loc[df.index]
+
+    a = _score_arrays(df, site_col)
+    result = pd.DataFrame({
+        "global_score":         int_scores(a["global_score"]),
+        "sustainability_score": int_scores(a["sustainability"]),
+        **{k: int_scores(v) for k, v in a["sub"].items()},
+        "bonus_points":         BONUS_POINTS[a["bonus_idx"]],
+        "bonus_reason":         np.array(BONUS_REASONS, dtype=object)[a["bonus_idx"]],
+    }, index=df.index)
+    return result[SCORE_COLUMNS]
+
+
+# ── Score attribution: what moved the global score since the previous period ──
+# Each KPI's share of the global score: (dimension, weight inside the dimension)
+KPI_DIMENSIONS = {
+    "chiffre_affaires": ("finance", 0.6),
+    "marge":            ("finance", 0.4),
+    "energie":          ("energie", 1.0),
+    "co2":              ("co2", 1.0),
+    "absenteisme":      ("rh", 0.5),          # 1.0 when there is no productivity KPI
+    "productivite":     ("rh", 0.5),
+    "satisfaction":     ("satisfaction", 1.0),
+}
+
+EXPLAIN_COLUMNS = (["global_score", "previous_score", "delta"] + SCORED_KPIS + ["rounding",
+                   "bonus_points", "previous_bonus", "bonus_delta"] + [f"bonus_{k}" for k in SCORED_KPIS])
+
+
+def _shift_in_site(values: pd.DataFrame, df: pd.DataFrame, site_col: str) -> pd.DataFrame:
+    """Previous row of the same site; the first row of a site is its own previous."""
+    if site_col in df.columns:
+        prev = values.groupby(df[site_col].to_numpy(), sort=False).shift(1)
+    else:
+        prev = values.shift(1)
+    return prev.fillna(values)
+
+
+def explain_scores(df: pd.DataFrame, site_col: str = SITE_COL) -> pd.DataFrame:
+    """
+    Additive attribution of every row's global score change vs the previous period
+    of the same site, for a whole history in one vectorized pass.
+
+      delta            = global_score - previous_score
+                       = sum of the KPI columns + rounding
+      <kpi>            = weight in the global score × change of the KPI's clipped 0–100
+                         score (a KPI pinned at 0 or 100 contributes nothing)
+      rounding         = effect of rounding the sub-scores / global score and of the 0–100 clip
+      bonus_delta      = bonus_points - previous_bonus = sum of the bonus_<kpi> columns
+                         (a rule's points are split evenly among the KPIs in its condition)
+    Rows are aligned on df.index; the first row of a site has every change at 0.
+    """
+    a = _score_arrays(df, site_col)
+    weights = {}
+    for kpi, (dim, w) in KPI_DIMENSIONS.items():
+        weights[kpi] = np.full(len(df), WEIGHTS[dim] * w)
+    weights["absenteisme"]  = np.where(a["has_productivite"], weights["absenteisme"], WEIGHTS["rh"])
+    weights["productivite"] = np.where(a["has_productivite"], weights["productivite"], 0.0)
+
+    cur = pd.DataFrame({
+        **{k: np.nan_to_num(v) for k, v in a["kpi_scores"].items()},
+        "global_score": a["global_score"],
+        "bonus_points": BONUS_POINTS[a["bonus_idx"]].astype(float),
+        **{f"bonus_{k}": _bonus_shares(a["bonus_idx"], k) for k in SCORED_KPIS},
+    }, index=df.index)
+    prev = _shift_in_site(cur, df, site_col)
+
+    out = pd.DataFrame(index=df.index)
+    out["global_score"]   = int_scores(a["global_score"])
+    out["previous_score"] = int_scores(prev["global_score"].to_numpy())
+    out["delta"]          = out["global_score"] - out["previous_score"]
+    for k in SCORED_KPIS:
+        out[k] = weights[k] * (cur[k] - prev[k])
+    out["rounding"]       = out["delta"] - out[SCORED_KPIS].sum(axis=1)
+    out["bonus_points"]   = cur["bonus_points"].astype(int)
+    out["previous_bonus"] = prev["bonus_points"].astype(int)
+    out["bonus_delta"]    = out["bonus_points"] - out["previous_bonus"]
+    for k in SCORED_KPIS:
+        out[f"bonus_{k}"] = cur[f"bonus_{k}"] - prev[f"bonus_{k}"]
+    return out[EXPLAIN_COLUMNS]
+
+
+def _bonus_shares(bonus_idx: np.ndarray, kpi: str) -> np.ndarray:
+    """Points of the matched bonus rule credited to kpi (split evenly among the rule's KPIs)."""
+    share = np.array([BONUS_POINTS[r] / len(kpis) if kpi in kpis else 0.0
+                      for r, kpis in enumerate(BONUS_RULE_KPIS)])
+    return share[bonus_idx]
+
+
 def generate_report(current, previous, score_data, priorities, recommendations, month: str) -> str:
     lines = [
         "=" * 60,
@@ -109,11 +319,14 @@ def generate_report(current, previous, score_data, priorities, recommendations,
         "── KPIs Clés ─────────────────────────────────────────",
         f"  Chiffre d'affaires : {current['chiffre_affaires']:,.0f} €",
         f"  Marge              : {current['marge']:,.0f} €",
-        f"  Énergie            : {current['energie']:,} kWh",
+        f"  Énergie            : {current['energie']:,.0f} kWh",
         f"  CO₂                : {current['co2']:.1f} T",
         f"  Absentéisme        : {current['absenteisme']:.1f}%",
         f"  Satisfaction       : {current['satisfaction']:.0f}/100",
-        f"  Productivité       : {current['productivite']:.1f}%",
+    ]
+    if not np.isnan(current.get("productivite", np.nan)):
+        lines.append(f"  Productivité       : {current['productivite']:.1f}%")
+    lines += [
         "",
         "── Scores par Dimension ──────────────────────────────",
     ]
@@ -0,0 +1,363 @@
+"""
+scoring_profiles.py
+Configurable scoring: per-site / per-industry profiles loaded from YAML or JSON.
+A profile declares indicators (KPI + transform + good/bad thresholds), dimensions
+(weighted groups of indicators), sustainability weights and first-match bonus rules.
+All active profiles are compiled once into weight matrices and threshold arrays;
+scoring a history is then array operations whatever the number of profiles.
+
+The built-in "default" profile reproduces score_engine.compute_score exactly.
+
+Example file:
+    profiles:
+      industrie:
+        extends: default
+        indicators:
+          eau_growth: {kpi: eau, transform: growth, good: -5, bad: 10}
+        dimensions:
+          eau: {weight: 0.10, indicators: {eau_growth: 1}}
+          finance: {weight: 0.20, indicators: {ca_growth: 0.6, marge_growth: 0.4}}
+        bonus:
+          - {points: 6, reason: "Eau en baisse 💧", when: [[eau_growth, "<", -3]]}
+    sites:
+      Site 03: industrie
+    industries:
+      chimie: industrie
+"""
+import copy
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import score_engine as se
+from data_generator import SITE_COL
+
+try:
+    import yaml
+    YAML_OK = True
+except ImportError:
+    YAML_OK = False
+
+
+INDUSTRY_COL = "industrie"
+TRANSFORMS   = ["growth", "level"]     # % change vs previous period / raw value
+OPERATORS    = {">": 0, ">=": 1, "<": 2, "<=": 3, "==": 4}
+BLOCK_ROWS   = 1 << 16                  # rows per block when gathering per-row weights
+
+
+# ── Default profile, built from the score_engine constants ──────────────────
+def _indicator(kpi: str, transform: str, thresholds, good: int = 0, bad: int = 2) -> Dict:
+    return {"kpi": kpi, "transform": transform, "good": thresholds[good], "bad": thresholds[bad]}
+
+
+T = se.THRESHOLDS
+DEFAULT_PROFILE = {
+    "indicators": {
+        "ca_growth":      _indicator("chiffre_affaires", "growth", T["ca_growth"]),
+        "marge_growth":   _indicator("marge",            "growth", T["marge_growth"]),
+        "energie_growth": _indicator("energie",          "growth", T["energie_growth"]),
+        "co2_growth":     _indicator("co2",              "growth", T["co2_growth"]),
+        "absenteisme":    _indicator("absenteisme",      "level",  T["absenteisme_abs"]),
+        # good/bad swapped, as in compute_score
+        "productivite":   _indicator("productivite",     "level",  T["productivite_abs"], good=2, bad=0),
+        "satisfaction":   _indicator("satisfaction",     "level",  T["satisfaction_abs"]),
+    },
+    "dimensions": {
+        "finance":      {"weight": se.WEIGHTS["finance"],      "indicators": {"ca_growth": 0.6, "marge_growth": 0.4}},
+        "energie":      {"weight": se.WEIGHTS["energie"],      "indicators": {"energie_growth": 1.0}},
+        "co2":          {"weight": se.WEIGHTS["co2"],          "indicators": {"co2_growth": 1.0}},
+        "rh":           {"weight": se.WEIGHTS["rh"],           "indicators": {"absenteisme": 0.5, "productivite": 0.5}},
+        "satisfaction": {"weight": se.WEIGHTS["satisfaction"], "indicators": {"satisfaction": 1.0}},
+    },
+    "sustainability": {"co2_growth": 0.5, "energie_growth": 0.3, "satisfaction": 0.2},
+    "bonus": [
+        {"points": 5, "reason": se.BONUS_REASONS[1], "when": [["ca_growth", ">", 3], ["marge_growth", ">", 2]]},
+        {"points": 8, "reason": se.BONUS_REASONS[2], "when": [["co2_growth", "<", 0], ["energie_growth", "<", 0]]},
+        {"points": 4, "reason": se.BONUS_REASONS[3], "when": [["satisfaction", ">=", 82]]},
+    ],
+    "no_bonus_reason": se.BONUS_REASONS[0],
+}
+del T
+
+
+# ── Loading ───────────────────────────────────────────────────────────────────
+def _merge(base: Dict, override: Dict) -> Dict:
+    """Profile inheritance: mappings are merged key by key, everything else replaced."""
+    out = copy.deepcopy(base)
+    for key, value in override.items():
+        if key == "extends":
+            continue
+        if isinstance(value, dict) and isinstance(out.get(key), dict):
+            out[key] = {**out[key], **copy.deepcopy(value)}
+        else:
+            out[key] = copy.deepcopy(value)
+    return out
+
+
+def resolve_profiles(raw: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Expand `extends` chains. "default" is always available as a base."""
+    raw = {"default": DEFAULT_PROFILE, **raw}
+    resolved: Dict[str, Dict] = {}
+
+    def resolve(name: str, chain: List[str]) -> Dict:
+        if name in resolved:
+            return resolved[name]
+        if name not in raw:
+            raise ValueError(f"Profil inconnu : {name}")
+        if name in chain:
+            raise ValueError(f"Héritage circulaire : {' → '.join(chain + [name])}")
+        spec   = raw[name]
+        parent = spec.get("extends")
+        base   = resolve(parent, chain + [name]) if parent else {}
+        resolved[name] = _merge(base, spec)
+        return resolved[name]
+
+    for name in raw:
+        resolve(name, [])
+    return resolved
+
+
+def load_config(path) -> Dict:
+    """Read a profile file (.yaml / .yml / .json)."""
+    path = Path(path)
+    text = path.read_text(encoding="utf-8")
+    if path.suffix in (".yaml", ".yml"):
+        if not YAML_OK:
+            raise ImportError("PyYAML est requis pour lire les profils YAML (pip install pyyaml)")
+        return yaml.safe_load(text) or {}
+    return json.loads(text)
+
+
+# ── Compilation ───────────────────────────────────────────────────────────────
+class CompiledProfiles:
+    """
+    Every profile as arrays over the union of indicators (I) and dimensions (D):
+      good, bad          (P, I)       thresholds (NaN where a profile lacks the indicator)
+      ind_weights        (P, D, I)    indicator weights inside each dimension
+      dim_weights        (P, D)       dimension weights in the global score
+      dim_defined        (P, D)       dimensions a profile scores (others are NaN)
+      sust_weights       (P, I)       sustainability index weights
+      rule_*             (P, R, C)    bonus conditions, padded with always-true slots
+    """
+
+    def __init__(self, profiles: Dict[str, Dict]):
+        self.names = list(profiles)
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+        indicators: Dict[str, Dict] = {}
+        dimensions: List[str] = []
+        for name, p in profiles.items():
+            for ind, spec in p.get("indicators", {}).items():
+                if spec.get("transform", "level") not in TRANSFORMS:
+                    raise ValueError(f"Profil {name} : transformation inconnue pour {ind}")
+                prev = indicators.setdefault(ind, spec)
+                if (prev["kpi"], prev.get("transform", "level")) != (spec["kpi"], spec.get("transform", "level")):
+                    raise ValueError(f"Indicateur {ind} défini différemment selon les profils")
+            dimensions += [d for d in p.get("dimensions", {}) if d not in dimensions]
+
+        self.indicators = list(indicators)
+        self.dimensions = dimensions
+        self.kpis       = [indicators[i]["kpi"] for i in self.indicators]
+        self.growth     = np.array([indicators[i].get("transform", "level") == "growth" for i in self.indicators])
+
+        P, I, D = len(self.names), len(self.indicators), len(self.dimensions)
+        ind_pos = {ind: i for i, ind in enumerate(self.indicators)}
+        dim_pos = {d: i for i, d in enumerate(self.dimensions)}
+        self.good         = np.full((P, I), np.nan)
+        self.bad          = np.full((P, I), np.nan)
+        self.ind_weights  = np.zeros((P, D, I))
+        self.dim_weights  = np.zeros((P, D))
+        self.dim_defined  = np.zeros((P, D), dtype=bool)
+        self.sust_weights = np.zeros((P, I))
+
+        R = max((len(p.get("bonus", [])) for p in profiles.values()), default=0)
+        C = max((len(r["when"]) for p in profiles.values() for r in p.get("bonus", [])), default=0)
+        self.rule_ind    = np.zeros((P, R, C), dtype=int)
+        self.rule_op     = np.full((P, R, C), -1, dtype=int)       # -1 = padding, always true
+        self.rule_value  = np.zeros((P, R, C))
+        self.rule_active = np.zeros((P, R), dtype=bool)
+        self.rule_points = np.zeros((P, R + 1), dtype=int)         # last slot = no bonus
+        self.rule_reason = np.empty((P, R + 1), dtype=object)
+
+        for p, (name, prof) in enumerate(profiles.items()):
+            for ind, spec in prof.get("indicators", {}).items():
+                self.good[p, ind_pos[ind]] = spec["good"]
+                self.bad[p, ind_pos[ind]]  = spec["bad"]
+            for dim, spec in prof.get("dimensions", {}).items():
+                self.dim_weights[p, dim_pos[dim]] = spec["weight"]
+                self.dim_defined[p, dim_pos[dim]] = True
+                for ind, w in spec["indicators"].items():
+                    self.ind_weights[p, dim_pos[dim], self._pos(ind_pos, ind, name)] = w
+            for ind, w in prof.get("sustainability", {}).items():
+                self.sust_weights[p, self._pos(ind_pos, ind, name)] = w
+            self.rule_reason[p, :] = prof.get("no_bonus_reason", se.BONUS_REASONS[0])
+            for r, rule in enumerate(prof.get("bonus", [])):
+                self.rule_active[p, r] = True
+                self.rule_points[p, r] = rule["points"]
+                self.rule_reason[p, r] = rule["reason"]
+                for c, (ind, op, value) in enumerate(rule["when"]):
+                    if op not in OPERATORS:
+                        raise ValueError(f"Profil {name} : opérateur inconnu {op}")
+                    self.rule_ind[p, r, c]   = self._pos(ind_pos, ind, name)
+                    self.rule_op[p, r, c]    = OPERATORS[op]
+                    self.rule_value[p, r, c] = value
+
+    @staticmethod
+    def _pos(ind_pos: Dict[str, int], ind: str, profile: str) -> int:
+        if ind not in ind_pos:
+            raise ValueError(f"Profil {profile} : indicateur inconnu {ind}")
+        return ind_pos[ind]
+
+    # ── Evaluation ────────────────────────────────────────────────────────────
+    def raw_values(self, df: pd.DataFrame, site_col: str = SITE_COL) -> np.ndarray:
+        """(N, I) indicator values before normalisation: % growth or level. NaN if the KPI is absent."""
+        present = sorted({k for k in self.kpis if k in df.columns})
+        cur  = df[present].to_numpy(dtype=float)
+        col  = {k: i for i, k in enumerate(present)}
+        growth_kpis = sorted({k for k, g in zip(self.kpis, self.growth) if g and k in col})
+        prev = se.previous_rows(df, site_col, growth_kpis) if growth_kpis else None
+
+        raw = np.full((len(df), len(self.indicators)), np.nan)
+        for i, (kpi, is_growth) in enumerate(zip(self.kpis, self.growth)):
+            if kpi not in col:
+                continue
+            x = cur[:, col[kpi]]
+            if is_growth:
+                p = prev[kpi].to_numpy(dtype=float)
+                raw[:, i] = (x - p) / p * 100
+            else:
+                raw[:, i] = x
+        return raw
+
+    def score(self, df: pd.DataFrame, profile_idx: np.ndarray, site_col: str = SITE_COL) -> pd.DataFrame:
+        """
+        Score every row of df with its own profile (profile_idx: one index per row).
+        Weights are re-normalised over the indicators / dimensions available in a row,
+        so a missing KPI drops out instead of scoring 0. Scores are int like
+        score_engine.score_history (nullable Int64 where a dimension is undefined).
+        """
+        profile_idx = np.asarray(profile_idx, dtype=int)
+        raw  = self.raw_values(df, site_col)
+        good = self.good[profile_idx]
+        bad  = self.bad[profile_idx]
+        span = good - bad
+        with np.errstate(invalid="ignore", divide="ignore"):
+            norm = np.where(span == 0, 50.0, np.clip((raw - bad) / span * 100, 0, 100))
+
+        dims = _weighted(norm, self.ind_weights.transpose(0, 2, 1), profile_idx)
+        sust = _weighted(norm, self.sust_weights[:, :, None], profile_idx)[:, 0]
+        dims = np.where(self.dim_defined[profile_idx], np.rint(dims), np.nan)
+        global_score = _weighted(dims, self.dim_weights[:, :, None], profile_idx)[:, 0]
+        global_score = np.clip(np.rint(global_score), 0, 100)
+
+        rule = self._first_rule(raw, profile_idx)
+        result = pd.DataFrame({
+            "global_score":         se.int_scores(global_score),
+            "sustainability_score": se.int_scores(np.rint(sust)),
+            **{d: se.int_scores(dims[:, j]) for j, d in enumerate(self.dimensions)},
+            "bonus_points":         self.rule_points[profile_idx, rule],
+            "bonus_reason":         self.rule_reason[profile_idx, rule],
+            "profile":              np.array(self.names, dtype=object)[profile_idx],
+        }, index=df.index)
+        return result
+
+    def _first_rule(self, raw: np.ndarray, profile_idx: np.ndarray) -> np.ndarray:
+        """Index of the first matching bonus rule per row (R = no bonus)."""
+        R = self.rule_active.shape[1]
+        if R == 0:
+            return np.zeros(len(raw), dtype=int)
+        ind   = self.rule_ind[profile_idx]                              # (N, R, C)
+        op    = self.rule_op[profile_idx]
+        value = self.rule_value[profile_idx]
+        x     = np.take_along_axis(raw, ind.reshape(len(raw), -1), axis=1).reshape(ind.shape)
+        with np.errstate(invalid="ignore"):
+            ok = np.select([op == -1, op == 0, op == 1, op == 2, op == 3, op == 4],
+                           [True, x > value, x >= value, x < value, x <= value, x == value], default=False)
+        match = ok.all(axis=2) & self.rule_active[profile_idx]
+        return np.where(match.any(axis=1), match.argmax(axis=1), R)
+
+
+def _weighted(values: np.ndarray, weights: np.ndarray, profile_idx: np.ndarray) -> np.ndarray:
+    """
+    values (N, I) weighted by their row's profile weights (weights: (P, I, K), gathered
+    per row, BLOCK_ROWS at a time), ignoring NaN values and re-normalising the remaining
+    weights. Summed term by term (I is small) so rows with every input present give
+    exactly the same float as the hand-written sums in score_engine.
+    """
+    out = np.empty((len(values), weights.shape[2]))
+    for lo in range(0, len(values), BLOCK_ROWS):
+        x = values[lo:lo + BLOCK_ROWS]
+        w = weights[profile_idx[lo:lo + BLOCK_ROWS]]                     # (n, I, K)
+        valid   = ~np.isnan(x)
+        num     = np.zeros((len(x), w.shape[2]))
+        cover   = np.zeros_like(num)
+        missing = np.zeros_like(num)
+        for i in range(w.shape[1]):
+            num     += np.where(valid[:, i, None], x[:, i, None] * w[:, i], 0.0)
+            cover   += valid[:, i, None] * w[:, i]
+            missing += ~valid[:, i, None] & (w[:, i] != 0)
+        total = w.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[lo:lo + BLOCK_ROWS] = np.where(missing == 0, num, num / cover * total)
+    return out
+
+
+# ── Registry: which profile applies to which site ────────────────────────────
+class ProfileRegistry:
+    """Compiled profiles plus site → profile and industry → profile assignments."""
+
+    def __init__(self, profiles: Optional[Dict[str, Dict]] = None, sites: Optional[Dict[str, str]] = None,
+                 industries: Optional[Dict[str, str]] = None, default: str = "default"):
+        self.profiles   = resolve_profiles(profiles or {})
+        self.compiled   = CompiledProfiles(self.profiles)
+        self.sites      = dict(sites or {})
+        self.industries = dict(industries or {})
+        self.default    = default
+        for name in [default, *self.sites.values(), *self.industries.values()]:
+            if name not in self.compiled.index:
+                raise ValueError(f"Profil inconnu : {name}")
+
+    @classmethod
+    def from_file(cls, path) -> "ProfileRegistry":
+        cfg = load_config(path)
+        return cls(cfg.get("profiles"), cfg.get("sites"), cfg.get("industries"), cfg.get("default", "default"))
+
+    def resolve(self, site: Optional[str] = None, industry: Optional[str] = None) -> str:
+        """Site assignment first, then industry, then the default profile."""
+        if site in self.sites:
+            return self.sites[site]
+        if industry in self.industries:
+            return self.industries[industry]
+        return self.default
+
+    def assign(self, df: pd.DataFrame, site_col: str = SITE_COL, industry_col: str = INDUSTRY_COL) -> np.ndarray:
+        """Profile index for every row of df."""
+        sites      = df[site_col] if site_col in df.columns else pd.Series(None, index=df.index)
+        industries = df[industry_col] if industry_col in df.columns else pd.Series(None, index=df.index)
+        pairs = pd.DataFrame({"s": sites.to_numpy(), "i": industries.to_numpy()})
+        codes, uniques = pd.factorize(pd.MultiIndex.from_frame(pairs))
+        lookup = np.array([self.compiled.index[self.resolve(s, i)] for s, i in uniques], dtype=int)
+        return lookup[codes]
+
+    def score_history(self, df: pd.DataFrame, site_col: str = SITE_COL,
+                      industry_col: str = INDUSTRY_COL) -> pd.DataFrame:
+        """score_engine.score_history with each site's profile; adds a "profile" column."""
+        return self.compiled.score(df, self.assign(df, site_col, industry_col), site_col)
+
+    def compute_score(self, current, previous, site: Optional[str] = None,
+                      industry: Optional[str] = None) -> Dict:
+        """score_engine.compute_score for one (current, previous) pair with the resolved profile."""
+        pair = pd.DataFrame([previous, current]).reset_index(drop=True)
+        pair = pair.drop(columns=[SITE_COL], errors="ignore")
+        row  = self.compiled.score(pair, np.full(2, self.compiled.index[self.resolve(site, industry)])).iloc[1]
+        dims = self.compiled.dimensions
+        return {
+            "global_score":         int(row["global_score"]),
+            "sub_scores":           {d: int(row[d]) for d in dims if not pd.isna(row[d])},
+            "sustainability_score": int(row["sustainability_score"]),
+            "bonus_points":         int(row["bonus_points"]),
+            "bonus_reason":         row["bonus_reason"],
+        }
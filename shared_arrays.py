@@ -0,0 +1,164 @@
+"""
+shared_arrays.py
+KPI matrices shared with worker processes instead of pickled to them.
+The owner copies a (multi-site) KPI frame once into one float64 matrix held in
+multiprocessing.shared_memory (or a memory-mapped .npy file); tasks carry only a
+small ArrayHandle plus a row range, and workers read zero-copy views of it.
+Task payloads are therefore constant-size whatever the length of the history.
+
+Matrix layout: one row per period, sites contiguous and in time order;
+columns = KPIs, then DAY_COL (days since 1970-01-01) and SITE_CODE_COL.
+"""
+import os
+import tempfile
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_generator import SITE_COL, format_period_label, period_dates
+from parallel import blocks
+
+
+BACKENDS      = ["shm", "memmap"]
+DAY_COL       = "_day"
+SITE_CODE_COL = "_site"
+
+
+@dataclass(frozen=True)
+class ArrayHandle:
+    """Picklable reference to a shared KPI matrix (a few hundred bytes)."""
+    kind:    str                  # "shm" | "memmap"
+    name:    str                  # shared-memory block name or .npy path
+    shape:   Tuple[int, int]
+    columns: Tuple[str, ...]
+    freq:    str
+
+    @property
+    def kpis(self) -> List[str]:
+        return [c for c in self.columns if c not in (DAY_COL, SITE_CODE_COL)]
+
+
+# ── Worker side: attach once per process, then slice ─────────────────────────
+_ATTACHED: Dict[str, Tuple[object, np.ndarray]] = {}
+
+
+def _attach_shm(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)      # Python ≥ 3.13
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def open_array(handle: ArrayHandle) -> np.ndarray:
+    """Read-only view of the whole matrix; the block / file is opened once per process."""
+    if handle.name not in _ATTACHED:
+        if handle.kind == "shm":
+            shm = _attach_shm(handle.name)
+            arr = np.ndarray(handle.shape, dtype=np.float64, buffer=shm.buf)
+        else:
+            shm, arr = None, np.load(handle.name, mmap_mode="r")
+        arr.flags.writeable = False
+        _ATTACHED[handle.name] = (shm, arr)
+    return _ATTACHED[handle.name][1]
+
+
+def frame_view(handle: ArrayHandle, lo: int = 0, hi: Optional[int] = None,
+               labels: bool = True) -> pd.DataFrame:
+    """
+    Rows lo:hi as a dashboard frame. KPI columns are zero-copy views of the shared
+    matrix; "date" and, if labels, "mois_label" are rebuilt from the day column.
+    """
+    arr  = open_array(handle)[lo:hi]
+    k    = len(handle.kpis)
+    df   = pd.DataFrame(arr[:, :k], columns=handle.kpis, copy=False)
+    days = arr[:, handle.columns.index(DAY_COL)].astype("int64")
+    dates = pd.DatetimeIndex(days.astype("datetime64[D]"))
+    df.insert(0, "date", dates)
+    if labels:
+        df.insert(0, "mois_label", [format_period_label(d, handle.freq) for d in dates])
+    df.insert(1 if labels else 0, "mois_idx", np.arange(len(df)))
+    return df
+
+
+def release(handle: Optional[ArrayHandle] = None) -> None:
+    """Detach this process from one shared matrix (or from all of them)."""
+    for name in ([handle.name] if handle else list(_ATTACHED)):
+        shm, _ = _ATTACHED.pop(name, (None, None))
+        if shm is not None:
+            shm.close()
+
+
+# ── Owner side ───────────────────────────────────────────────────────────────
+class SharedKPIMatrix:
+    """
+    Owner of a shared KPI matrix built from a dashboard frame. Use as a context
+    manager: the shared block / file is removed on exit.
+      handle       ArrayHandle to send to workers
+      site_ranges  [(site, lo, hi)] row range of every site in the matrix
+      order        df row position of every matrix row
+    """
+
+    def __init__(self, df: pd.DataFrame, kpis: Optional[List[str]] = None, backend: str = "shm",
+                 freq: Optional[str] = None, site_col: str = SITE_COL, directory: Optional[str] = None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend inconnu : {backend} (attendu : {', '.join(BACKENDS)})")
+        from forecaster import KPI_COLS, infer_frequency      # forecaster imports this module
+
+        kpis = [k for k in (kpis or KPI_COLS) if k in df.columns]
+        if site_col in df.columns:
+            codes, sites = pd.factorize(df[site_col], sort=False)
+        else:
+            codes, sites = np.zeros(len(df), dtype=np.int64), [""]
+        self.order = order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+        days  = period_dates(df).values.astype("datetime64[D]").astype("int64")[order]
+
+        bounds = np.searchsorted(codes, np.arange(len(sites) + 1))
+        self.site_ranges = [(s, int(bounds[i]), int(bounds[i + 1])) for i, s in enumerate(sites)]
+        first = df.iloc[order[:bounds[1]]] if len(df) else df
+        freq  = freq or infer_frequency(first)
+
+        columns = tuple(kpis) + (DAY_COL, SITE_CODE_COL)
+        shape   = (len(df), len(columns))
+        self._shm, self._path = None, None
+        if backend == "shm":
+            self._shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * 8))
+            arr = np.ndarray(shape, dtype=np.float64, buffer=self._shm.buf)
+            name = self._shm.name
+        else:
+            fd, self._path = tempfile.mkstemp(suffix=".npy", prefix="kpi_", dir=directory)
+            os.close(fd)
+            arr = np.lib.format.open_memmap(self._path, mode="w+", dtype=np.float64, shape=shape)
+            name = self._path
+        arr[:, :len(kpis)] = df[kpis].to_numpy(dtype=float)[order]
+        arr[:, -2] = days
+        arr[:, -1] = codes
+        if self._path:
+            arr.flush()
+        del arr
+        self.handle = ArrayHandle(backend, name, shape, columns, freq)
+
+    def block_ranges(self, n_blocks: int) -> List[Tuple[int, int]]:
+        """(lo, hi) row ranges of up to n_blocks runs of whole sites."""
+        return [(self.site_ranges[b[0]][1], self.site_ranges[b[-1]][2])
+                for b in blocks(list(range(len(self.site_ranges))), n_blocks)]
+
+    def close(self) -> None:
+        """Free the shared block / delete the file (workers must be done with it)."""
+        release(self.handle)
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        if self._path and os.path.exists(self._path):
+            os.remove(self._path)
+            self._path = None
+
+    def __enter__(self) -> "SharedKPIMatrix":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
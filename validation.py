@@ -0,0 +1,259 @@
+"""
+validation.py
+One validation / cleaning pass over a KPI frame at load time, so the scoring,
+anomaly and forecast hot paths can assume a clean grid:
+  - schema     required KPI columns present, numeric, valid period dates
+  - units      declared source units converted to the dashboard's (€, kWh, T, %)
+  - doublons   one row per (site, period): the last exported row wins
+  - bornes     values clipped to their physical range; zeros of growth KPIs
+               (score denominators) treated as missing
+  - échelle    isolated rows off by a unit factor (MAD vs €, kg vs T) rescaled
+  - extrêmes   MAD-based winsorizing per (site, KPI)
+  - trous      missing periods inserted and every gap linearly interpolated
+Every step is vectorized over all sites and KPIs; what was changed is returned
+as a report table.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_generator import SITE_COL, format_period_label, period_dates
+from forecaster import KPI_COLS, infer_frequency
+
+
+# ── Schema: dashboard unit and admissible range per KPI ──────────────────────
+SCHEMA = {
+    "chiffre_affaires": {"unit": "€",    "min": 0.0,  "max": None,  "nonzero": True},
+    "marge":            {"unit": "€",    "min": None, "max": None,  "nonzero": True},
+    "energie":          {"unit": "kWh",  "min": 0.0,  "max": None,  "nonzero": True},
+    "co2":              {"unit": "T",    "min": 0.0,  "max": None,  "nonzero": True},
+    "absenteisme":      {"unit": "%",    "min": 0.0,  "max": 100.0, "nonzero": False},
+    "satisfaction":     {"unit": "/100", "min": 0.0,  "max": 100.0, "nonzero": False},
+    "productivite":     {"unit": "%",    "min": 0.0,  "max": 100.0, "nonzero": False},
+}
+REQUIRED_KPIS = ["chiffre_affaires", "marge", "energie", "co2", "absenteisme", "satisfaction"]
+
+# ── Units: factor to the base unit of each family ────────────────────────────
+MAD_PER_EUR = 10.8          # reference rate for exports in dirhams
+UNIT_FACTORS = {
+    "€": 1.0, "EUR": 1.0, "MAD": 1 / MAD_PER_EUR,
+    "kWh": 1.0, "Wh": 1e-3, "MWh": 1e3,
+    "T": 1.0, "t": 1.0, "kg": 1e-3,
+    "%": 1.0, "/100": 1.0,
+}
+# Unit mix-ups looked for row by row: a value this many times its site median
+SCALE_SUSPECTS = {
+    "chiffre_affaires": MAD_PER_EUR,
+    "marge":            MAD_PER_EUR,
+    "energie":          1e3,
+    "co2":              1e3,
+}
+SCALE_TOLERANCE = 1.5       # ratio within [factor / 1.5, factor × 1.5]
+
+CLAMP_SIGMA = 25.0          # winsorize beyond median ± 25 robust σ: data errors, not business anomalies
+
+PERIOD_FREQ = {"D": "D", "W": "W-SUN", "M": "M", "Q": "Q", "Y": "Y"}
+
+REPORT_COLUMNS = ["Étape", "KPI", "Valeurs", "Détail"]
+
+
+def _note(report: List[Dict], step: str, kpi: str, count: int, detail: str) -> None:
+    if count:
+        report.append({"Étape": step, "KPI": kpi, "Valeurs": int(count), "Détail": detail})
+
+
+def _site_median(x: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """Per-site median of every column, broadcast back to the rows (NaN ignored)."""
+    return pd.DataFrame(x).groupby(codes).transform("median").to_numpy()
+
+
+def interpolate_blocks(x: np.ndarray, block_start: np.ndarray, block_end: np.ndarray) -> np.ndarray:
+    """
+    Linear interpolation of the NaNs of every column of x (n × k), without crossing
+    block boundaries (block_start / block_end: first / last row of each row's block).
+    Leading and trailing gaps take the nearest value; all-NaN blocks stay NaN.
+    """
+    n     = len(x)
+    idx   = np.arange(n)[:, None]
+    valid = ~np.isnan(x)
+    prev  = np.maximum.accumulate(np.where(valid, idx, -1), axis=0)
+    nxt   = np.minimum.accumulate(np.where(valid, idx, n)[::-1], axis=0)[::-1]
+    has_prev = prev >= block_start[:, None]
+    has_next = nxt <= block_end[:, None]
+
+    lo = np.where(has_prev, prev, nxt).clip(0, n - 1)
+    hi = np.where(has_next, nxt, prev).clip(0, n - 1)
+    x_lo = np.take_along_axis(x, lo, axis=0)
+    x_hi = np.take_along_axis(x, hi, axis=0)
+    w    = np.divide(idx - lo, hi - lo, out=np.zeros(x.shape), where=hi != lo)
+    filled = x_lo + (x_hi - x_lo) * w
+    return np.where(valid, x, np.where(has_prev | has_next, filled, np.nan))
+
+
+def validate(df: pd.DataFrame, units: Optional[Dict[str, str]] = None, freq: Optional[str] = None,
+             fill_gaps: bool = True, clamp: bool = True, clamp_sigma: float = CLAMP_SIGMA,
+             site_col: str = SITE_COL) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Clean a dashboard-schema KPI frame (one site, or long multi-site with site_col).
+    units: {kpi: source unit} for columns not in the dashboard unit, e.g. {"co2": "kg"}.
+    Returns (clean frame sorted by site and period, report with one row per change).
+    Raises ValueError if a required KPI column or every period date is missing.
+    """
+    missing = [k for k in REQUIRED_KPIS if k not in df.columns]
+    if missing:
+        raise ValueError(f"Colonnes manquantes : {', '.join(missing)}")
+    if "date" not in df.columns and "mois_label" not in df.columns:
+        raise ValueError("Colonne de période absente (attendu : date ou mois_label)")
+
+    report: List[Dict] = []
+    kpis = [k for k in KPI_COLS if k in df.columns]
+    df   = df.reset_index(drop=True)
+
+    # ── Schema: numeric KPIs, parseable dates ─────────────────────────────────
+    raw = df[kpis]
+    num = raw.apply(pd.to_numeric, errors="coerce")
+    bad = num.isna() & raw.notna()
+    for k in kpis:
+        _note(report, "Schéma", k, bad[k].sum(), "valeur non numérique → manquante")
+    x = num.to_numpy(dtype=float)
+
+    dates = (pd.to_datetime(df["date"], errors="coerce") if "date" in df.columns
+             else pd.Series(period_dates(df)))
+    keep = dates.notna().to_numpy()
+    _note(report, "Schéma", "date", (~keep).sum(), "date invalide → ligne supprimée")
+    if not keep.any():
+        raise ValueError("Aucune date de période valide")
+    df, x, dates = df[keep].reset_index(drop=True), x[keep], pd.DatetimeIndex(dates[keep])
+
+    # ── Units declared by the source ──────────────────────────────────────────
+    for k, unit in (units or {}).items():
+        if k not in kpis or unit == SCHEMA[k]["unit"]:
+            continue
+        if unit not in UNIT_FACTORS:
+            raise ValueError(f"Unité inconnue pour {k} : {unit}")
+        factor = UNIT_FACTORS[unit] / UNIT_FACTORS[SCHEMA[k]["unit"]]
+        j = kpis.index(k)
+        x[:, j] *= factor
+        _note(report, "Unités", k, (~np.isnan(x[:, j])).sum(), f"{unit} → {SCHEMA[k]['unit']}")
+
+    # ── One row per (site, period), last row wins ────────────────────────────
+    freq  = freq or infer_frequency(df.assign(date=dates))
+    pfreq = PERIOD_FREQ[freq]
+    ordinal = dates.to_period(pfreq).asi8
+    codes, sites = (pd.factorize(df[site_col], sort=False) if site_col in df.columns
+                    else (np.zeros(len(df), dtype=np.int64), [None]))
+    order = np.lexsort((np.arange(len(df)), ordinal, codes))
+    last  = np.r_[(codes[order][1:] != codes[order][:-1]) | (ordinal[order][1:] != ordinal[order][:-1]), True]
+    _note(report, "Doublons", "—", (~last).sum(), "même site et période → dernière ligne conservée")
+    order = order[last]
+    df, x, dates = df.iloc[order].reset_index(drop=True), x[order], dates[order]
+    codes, ordinal = codes[order], ordinal[order]
+
+    # ── Physical bounds and zero denominators ────────────────────────────────
+    for j, k in enumerate(kpis):
+        lo, hi = SCHEMA[k]["min"], SCHEMA[k]["max"]
+        if lo is not None or hi is not None:
+            clipped = np.clip(x[:, j], lo, hi)
+            bounds  = f"[{'−∞' if lo is None else f'{lo:g}'}, {'+∞' if hi is None else f'{hi:g}'}]"
+            _note(report, "Bornes", k, np.sum(clipped != x[:, j]), f"hors {bounds} → écrêté")
+            x[:, j] = clipped
+        if SCHEMA[k]["nonzero"]:
+            zero = x[:, j] == 0
+            _note(report, "Zéros", k, zero.sum(), "dénominateur de croissance nul → interpolé")
+            x[zero, j] = np.nan
+
+    # ── Unit mix-ups: rows a unit factor away from their site median ─────────
+    med = _site_median(x, codes)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_ratio = np.log(x / med)
+    for k, factor in SCALE_SUSPECTS.items():
+        if k not in kpis:
+            continue
+        j = kpis.index(k)
+        up   = np.abs(log_ratio[:, j] - np.log(factor)) < np.log(SCALE_TOLERANCE)
+        down = np.abs(log_ratio[:, j] + np.log(factor)) < np.log(SCALE_TOLERANCE)
+        x[up, j]   /= factor
+        x[down, j] *= factor
+        _note(report, "Échelle", k, up.sum() + down.sum(), f"valeur ×{factor:g} / ÷{factor:g} la médiane du site → corrigée")
+
+    # ── Extreme values: winsorize at median ± clamp_sigma · 1.4826 · MAD ──────
+    if clamp:
+        med   = _site_median(x, codes)
+        scale = 1.4826 * _site_median(np.abs(x - med), codes)
+        lo, hi = med - clamp_sigma * scale, med + clamp_sigma * scale
+        extreme = (scale > 0) & ((x < lo) | (x > hi))
+        for j, k in enumerate(kpis):
+            _note(report, "Extrêmes", k, extreme[:, j].sum(), f"au-delà de ±{clamp_sigma:g} σ robustes → écrêté")
+        x = np.where(extreme, np.clip(x, lo, hi), x)
+
+    # ── Missing periods: full per-site period grid, gaps interpolated ────────
+    n_sites = len(sites)
+    start   = np.full(n_sites, np.iinfo(np.int64).max)
+    end     = np.full(n_sites, np.iinfo(np.int64).min)
+    np.minimum.at(start, codes, ordinal)
+    np.maximum.at(end, codes, ordinal)
+    if fill_gaps:
+        length  = end - start + 1
+        offsets = np.r_[0, np.cumsum(length)[:-1]]
+        total   = int(length.sum())
+        slot    = offsets[codes] + ordinal - start[codes]
+        grid_code = np.repeat(np.arange(n_sites), length)
+        grid_ord  = np.repeat(start, length) + np.arange(total) - np.repeat(offsets, length)
+    else:
+        offsets = np.r_[0, np.cumsum(np.bincount(codes, minlength=n_sites))[:-1]]
+        total, slot = len(df), np.arange(len(df))
+        grid_code, grid_ord = codes, ordinal
+    existing = np.zeros(total, dtype=bool)
+    existing[slot] = True
+    _note(report, "Trous", "—", total - len(df), "période manquante → ligne insérée")
+
+    # Non-KPI columns are carried over from the last existing row of the site
+    row_at = np.full(total, -1)
+    row_at[slot] = np.arange(len(df))
+    carry = np.maximum.accumulate(row_at)
+
+    block_start = offsets[grid_code]
+    block_end   = np.r_[offsets[1:], total][grid_code] - 1
+    grid_x = np.full((total, len(kpis)), np.nan)
+    grid_x[slot] = x
+    gaps   = np.isnan(grid_x)
+    grid_x = interpolate_blocks(grid_x, block_start, block_end)
+    for j, k in enumerate(kpis):
+        _note(report, "Interpolation", k, (gaps[:, j] & ~np.isnan(grid_x[:, j])).sum(), "valeur manquante → interpolée")
+
+    out = df.take(carry).reset_index(drop=True)
+    out[kpis] = grid_x
+    if total > len(df):
+        period_start = pd.PeriodIndex.from_ordinals(grid_ord, freq=pfreq).start_time
+        new = ~existing
+        out["date"] = np.where(existing, dates.take(carry), period_start)
+        out["date"] = pd.to_datetime(out["date"])
+        labels = out["mois_label"].to_numpy(dtype=object) if "mois_label" in out.columns else np.empty(total, dtype=object)
+        labels[new] = [format_period_label(d, freq) for d in period_start[new]]
+        out["mois_label"] = labels
+    elif "date" in out.columns:
+        out["date"] = dates
+    if "mois_idx" in out.columns:
+        out["mois_idx"] = np.arange(total) - offsets[grid_code]
+
+    return out, pd.DataFrame(report, columns=REPORT_COLUMNS)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import data_generator as dg
+
+    parser = argparse.ArgumentParser(description="Validate and clean a KPI export.")
+    parser.add_argument("--csv",   default=None, help="daily export to check (default: simulated multi-site data)")
+    parser.add_argument("--sites", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.csv:
+        data = dg.load_daily_csv(args.csv)
+        print(pd.DataFrame(data.attrs.get("validation", []), columns=REPORT_COLUMNS).to_string(index=False))
+    else:
+        clean, rep = validate(dg.generate_multisite_data(args.sites))
+        print(f"{len(clean)} lignes")
+        print(rep.to_string(index=False) if len(rep) else "Aucune correction.")